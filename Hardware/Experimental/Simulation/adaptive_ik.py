@@ -0,0 +1,231 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from batch_ik import (baseIMUHeading, baseIMUName, find_sessions, modelFileName, mot_name_for, resultsDirectory,
+                      run_ik_tool, sensor_to_opensim_rotations)
+from calibration_cache import MAX_ENTRIES, calibrated_model, evict
+from joint_angles import write_mot
+from orientation import quaternion_angle, quaternion_normalize, relative_rotation
+from reprocess_raw import write_sto
+from resample import slerp
+from storage_loader import load_motion, load_orientations
+
+# Error-bounded adaptive keyframe IK.
+#
+# IMUInverseKinematicsTool solves every frame, yet during slow rehab motion most frames barely differ from the
+# last one. Here a frame becomes a keyframe when any IMU has rotated more than KEYFRAME_DEGREES since the previous
+# keyframe (or MAX_KEYFRAME_GAP seconds have passed), IK is solved on the keyframes only and every coordinate is
+# interpolated linearly in time in between. The result is then checked against full IK:
+#   1. in every interval between solved frames, the frame whose orientations deviate most from the SLERP of the
+#      interval's ends is the likeliest to be interpolated badly; the VALIDATION_FRAMES worst of them are solved
+#   2. the interpolated BOUNDED_COORDINATES at those frames are compared with their solution; the solved
+#      frames join the keyframes either way, so a failing check refines exactly where interpolation was worst
+#   3. if the error still exceeds ERROR_BOUND degrees after VALIDATION_ROUNDS rounds, the session falls back to
+#      full IK on the frames not solved yet, so a written .mot is never worse than the bound on any frame
+#      that was checked
+# The output is an ik_<session>.mot in the layout batch_ik.py writes, one row per orientation frame, in
+# IK_results/adaptive/ so the full-IK results (and their _orientationErrors.sto) in IK_results/ stay untouched.
+#
+#   python adaptive_ik.py                                   # every session in data/ -> IK_results/adaptive/
+#   python adaptive_ik.py --threshold 0.5 --bound 1 data/data_2024_11_07_19_01.sto
+#   python adaptive_ik.py --keyframes-only                  # keyframe counts only, no OpenSim needed
+
+RESULTS_DIRECTORY = os.path.join(resultsDirectory, 'adaptive')
+KEYFRAME_DEGREES = 1.0      # Rotation of any IMU since the last keyframe that makes a new keyframe
+MAX_KEYFRAME_GAP = 1.0      # Seconds between keyframes at most, even when nothing moves
+ERROR_BOUND = 2.0           # Degrees an interpolated coordinate may differ from full IK (frame to frame IK noise
+                            # in hip rotation alone is about 1.5 deg, so much tighter bounds always fall back)
+VALIDATION_FRAMES = 20      # Frames checked against full IK per round
+VALIDATION_ROUNDS = 3       # Rounds of checking and refining before falling back to full IK
+# Coordinates held to the bound: the ones the pelvis, femur and tibia IMUs determine. No IMU constrains the arms,
+# lumbar or feet, so IK leaves those wherever assembly puts them and they are interpolated but not checked
+BOUNDED_COORDINATES = ('pelvis_tilt', 'pelvis_list', 'pelvis_rotation', 'hip_flexion_r', 'hip_adduction_r',
+                       'hip_rotation_r', 'knee_angle_r', 'hip_flexion_l', 'hip_adduction_l', 'hip_rotation_l',
+                       'knee_angle_l')
+
+# Normalized quaternions with all-zero ones (IMU not connected yet) as identity, so they never trigger a keyframe
+def _unit_quaternions(quats):
+    quats = np.array(quats, dtype=np.float64)
+    quats[np.linalg.norm(quats, axis=-1) == 0] = (1.0, 0.0, 0.0, 0.0)
+    return quaternion_normalize(quats)
+
+# Indices of the keyframes of (times (N,), quats (N, IMUs, 4)), always including the first and last frame
+def select_keyframes(times, quats, threshold=KEYFRAME_DEGREES, max_gap=MAX_KEYFRAME_GAP):
+    if len(times) < 3:
+        return np.arange(len(times))
+    quats = _unit_quaternions(quats)
+    # |dot| of two unit quaternions is cos(angle / 2), so no arccos per frame
+    limit = np.cos(np.radians(threshold) / 2)
+    keyframes = [0]
+    key, key_time = quats[0], times[0]
+    for i in range(1, len(times) - 1):
+        if times[i] - key_time >= max_gap or (np.abs((quats[i] * key).sum(axis=-1)) < limit).any():
+            keyframes.append(i)
+            key, key_time = quats[i], times[i]
+    keyframes.append(len(times) - 1)
+    return np.array(keyframes)
+
+# Per frame, the largest angle in degrees between an IMU's orientation and the SLERP of the surrounding solved frames
+def interpolation_deviation(times, quats, solved):
+    quats = _unit_quaternions(quats)
+    right = np.clip(np.searchsorted(solved, np.arange(len(times)), side='right'), 1, len(solved) - 1)
+    left = solved[right - 1]
+    right = solved[right]
+    span = times[right] - times[left]
+    u = np.clip(np.divide(times - times[left], span, out=np.zeros(len(times)), where=span > 0), 0.0, 1.0)
+    u = np.broadcast_to(u[:, None], quats.shape[:2])
+    interpolated = quaternion_normalize(slerp(quats[left], quats[right], u))
+    deviation = quaternion_angle(relative_rotation(interpolated, quats)).max(axis=1)
+    deviation[solved] = 0.0
+    return deviation
+
+# The frames to check against full IK: the worst interpolated frame of each interval, the count worst of those
+def validation_frames(times, quats, solved, count=VALIDATION_FRAMES):
+    deviation = interpolation_deviation(times, quats, solved)
+    candidates = np.setdiff1d(np.arange(len(times)), solved)
+    if not len(candidates):
+        return candidates
+    interval = np.searchsorted(solved, candidates)
+    order = np.lexsort((-deviation[candidates], interval))
+    _, first = np.unique(interval[order], return_index=True)
+    worst = candidates[order[first]]
+    worst = worst[np.argsort(-deviation[worst], kind='stable')[:count]]
+    return np.sort(worst)
+
+# Linear interpolation in time of solved_values (M, coordinates) at solved_times onto times, all columns at once
+def interpolate_coordinates(times, solved_times, solved_values):
+    if len(solved_times) == 1:
+        return np.repeat(solved_values, len(times), axis=0)
+    right = np.clip(np.searchsorted(solved_times, times, side='right'), 1, len(solved_times) - 1)
+    left = right - 1
+    span = solved_times[right] - solved_times[left]
+    u = np.divide(times - solved_times[left], span, out=np.zeros(len(times)), where=span > 0)
+    u = np.clip(u, 0.0, 1.0)[:, None]
+    return (1.0 - u) * solved_values[left] + u * solved_values[right]
+
+# Solve IK on a subset of the frames through IMUInverseKinematicsTool, returns (coordinate labels, (M, coordinates))
+def solve_frames(model_filename, labels, times, quats, frames, work_directory):
+    orientations_file = os.path.join(work_directory, f'frames_{len(frames)}.sto')
+    write_sto(orientations_file, labels, times[frames], quats[frames])
+    run_ik_tool(model_filename, orientations_file, work_directory, times[frames[0]], times[frames[-1]])
+    coordinates, _, values = load_motion(mot_name_for(orientations_file, work_directory), cache=False)
+    if len(values) != len(frames):
+        raise ValueError(f"{orientations_file}: IK returned {len(values)} frames for {len(frames)}")
+    return coordinates, np.asarray(values)
+
+# Keyframe IK of one session through solve(frames) -> (coordinate labels, (M, coordinates)), which solves the given
+# frame indices; returns (coordinate labels, (N, coordinates) for every frame, statistics)
+def keyframe_ik(times, quats, solve, threshold=KEYFRAME_DEGREES, max_gap=MAX_KEYFRAME_GAP, error_bound=ERROR_BOUND,
+                validation_count=VALIDATION_FRAMES, rounds=VALIDATION_ROUNDS):
+    solved = select_keyframes(times, quats, threshold, max_gap)
+    keyframes = len(solved)
+    coordinates, values = solve(solved)
+    bounded = [i for i, name in enumerate(coordinates) if name in BOUNDED_COORDINATES]
+
+    validated, max_error, within = 0, 0.0, False
+    for _ in range(rounds):
+        check = validation_frames(times, quats, solved, validation_count)
+        if not len(check):
+            within = True
+            break
+        full = solve(check)[1]
+        predicted = interpolate_coordinates(times[check], times[solved], values)
+        max_error = float(np.abs(predicted - full)[:, bounded].max()) if bounded else 0.0
+        validated += len(check)
+
+        order = np.argsort(np.concatenate((solved, check)), kind='stable')
+        solved = np.concatenate((solved, check))[order]
+        values = np.concatenate((values, full))[order]
+        if max_error <= error_bound:
+            within = True
+            break
+
+    # Fallback: every frame not solved yet, which together with the solved ones is full IK
+    if not within:
+        rest = np.setdiff1d(np.arange(len(times)), solved)
+        order = np.argsort(np.concatenate((solved, rest)), kind='stable')
+        solved = np.concatenate((solved, rest))[order]
+        values = np.concatenate((values, solve(rest)[1]))[order]
+    stats = {'frames': len(times), 'keyframes': keyframes, 'validated': validated, 'solved': len(solved),
+             'max_error': max_error, 'fallback': not within}
+    return coordinates, interpolate_coordinates(times, times[solved], values), stats
+
+# Worker: keyframe IK of one session into results_directory, returns (session, statistics)
+def adaptive_session(sto_filename, fixed_model=None, results_directory=RESULTS_DIRECTORY, threshold=KEYFRAME_DEGREES,
+                     max_gap=MAX_KEYFRAME_GAP, error_bound=ERROR_BOUND, validation_count=VALIDATION_FRAMES,
+                     rounds=VALIDATION_ROUNDS):
+    start = time.perf_counter()
+    labels, times, quats = load_orientations(sto_filename)
+    times, quats = np.asarray(times), np.asarray(quats)
+    model_filename = fixed_model
+    if model_filename is None:
+        # No eviction from a worker, another one may be using the oldest model; main() evicts after the pool
+        model_filename = calibrated_model(modelFileName, sto_filename, sensor_to_opensim_rotations,
+                                          baseIMUName, baseIMUHeading, max_entries=None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        coordinates, values, stats = keyframe_ik(
+            times, quats, lambda frames: solve_frames(model_filename, labels, times, quats, frames, tmp),
+            threshold, max_gap, error_bound, validation_count, rounds)
+    write_mot(mot_name_for(sto_filename, results_directory), coordinates, times, values)
+    stats['seconds'] = time.perf_counter() - start
+    return sto_filename, stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Keyframe IK with interpolation, checked against full IK on sampled frames')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/)')
+    parser.add_argument('--threshold', type=float, default=KEYFRAME_DEGREES, help='keyframe rotation in degrees')
+    parser.add_argument('--max-gap', type=float, default=MAX_KEYFRAME_GAP, help='seconds between keyframes at most')
+    parser.add_argument('--bound', type=float, default=ERROR_BOUND, help='allowed coordinate error in degrees')
+    parser.add_argument('--validate', type=int, default=VALIDATION_FRAMES, help='frames checked with full IK per round')
+    parser.add_argument('--model', help='use this calibrated model for every session instead of calibrating each one')
+    parser.add_argument('--results-dir', default=RESULTS_DIRECTORY)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--keyframes-only', action='store_true', help='only report how many frames would be solved')
+    args = parser.parse_args()
+
+    sessions = args.sessions or find_sessions()
+    if args.keyframes_only:
+        frames = keyframes = 0
+        for sto_filename in sessions:
+            try:
+                _, times, quats = load_orientations(sto_filename)
+            except ValueError as e:
+                print(f"Skipping {e}")
+                continue
+            n = len(select_keyframes(times, quats, args.threshold, args.max_gap))
+            frames += len(times)
+            keyframes += n
+            print(f"{os.path.basename(sto_filename)}: {n} of {len(times)} frames")
+        print(f"{keyframes} of {frames} frames are keyframes ({keyframes / max(frames, 1):.0%})")
+        return
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    start = time.perf_counter()
+    failed = 0
+    options = (args.model, args.results_dir, args.threshold, args.max_gap, args.bound, args.validate)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(adaptive_session, sto_filename, *options): sto_filename for sto_filename in sessions}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                _, stats = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(sessions)}] {name}: failed: {e}")
+                continue
+            print(f"[{done}/{len(sessions)}] {name}: {stats['solved']} of {stats['frames']} frames solved "
+                  f"({stats['keyframes']} keyframes, {stats['validated']} validated), max error "
+                  f"{stats['max_error']:.2f} deg" + (', fell back to full IK' if stats['fallback'] else '')
+                  + f", {stats['seconds']:.1f}s")
+    evict(max_entries=max(MAX_ENTRIES, len(sessions)))
+
+    print(f"Processed {len(sessions) - failed} sessions in {time.perf_counter() - start:.1f}s with {args.jobs} workers"
+          + (f", {failed} failed" if failed else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import pi
+
+from calibration_cache import MAX_ENTRIES, cached_model_path, calibrated_model, evict, mark_used
+from resample import resample_sto
+
+# Run IMU inverse kinematics for every recorded session in data/ across a process pool.
+#
+# Each session is calibrated from its own first frame through the calibration cache and solved with
+# IMUInverseKinematicsTool into IK_results/ik_<session>.mot. Like make, a session is skipped when its
+# .mot is newer than both the orientation file and the calibrated model and was made with the same resampling
+# settings (recorded in .cache/ik_<session>.mot.json next to it; a .mot without one was made without
+# resampling), so only new or changed sessions are reprocessed. With --resample each session is deduplicated
+# and SLERPed onto a uniform grid (resample.py) before IK, so the solver runs on evenly spaced frames.
+
+FILEPATH = os.path.dirname(__file__)
+DATA_DIRECTORY = os.path.join(FILEPATH, 'data')
+modelFileName = os.path.join(FILEPATH, 'models', 'Rajagopal_2015.osim')
+resultsDirectory = os.path.join(FILEPATH, 'IK_results')
+
+### CALIBRATION VARIABLES ###
+sensor_to_opensim_rotations = (-pi/2, 0, 0)    # The rotation of IMU data to the OpenSim world frame
+baseIMUName = 'pelvis_imu'                      # The base IMU dictates the heading (forward) direction of the model
+baseIMUHeading = '-z'                           # The Coordinate Axis of the base IMU that points in the heading direction
+
+### INVERSE KINEMATICS VARIABLES ###
+startTime = 0               # Start time (in seconds) of the tracking simulation.
+endTime = 1000              # End time (in seconds) of the tracking simulation.
+
+# IMUInverseKinematicsTool names its output after the orientation file
+def mot_name_for(sto_filename, results_directory=resultsDirectory):
+    stem = os.path.splitext(os.path.basename(sto_filename))[0]
+    return os.path.join(results_directory, f'ik_{stem}.mot')
+
+# The settings a .mot was made with, stored next to it so a change of --resample or --rate reruns the session
+def _settings_path(mot_filename):
+    directory, name = os.path.split(mot_filename)
+    return os.path.join(directory, '.cache', f'{name}.json')
+
+def ik_settings(resample=False, rate=None):
+    return {'resample': bool(resample), 'rate': rate if resample else None}
+
+def read_settings(mot_filename):
+    try:
+        with open(_settings_path(mot_filename)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return ik_settings()
+
+def write_settings(mot_filename, settings):
+    path = _settings_path(mot_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(settings, file)
+
+def is_up_to_date(sto_filename, model_filename, results_directory=resultsDirectory, resample=False, rate=None):
+    mot_filename = mot_name_for(sto_filename, results_directory)
+    if not os.path.exists(mot_filename) or not os.path.exists(model_filename):
+        return False
+    if read_settings(mot_filename) != ik_settings(resample, rate):
+        return False
+    mot_time = os.path.getmtime(mot_filename)
+    return mot_time > os.path.getmtime(sto_filename) and mot_time > os.path.getmtime(model_filename)
+
+# The session's calibrated model path, marked as used so an up-to-date session keeps its model in the cache
+def session_model(sto_filename, fixed_model=None):
+    if fixed_model is not None:
+        return fixed_model
+    cached = cached_model_path(modelFileName, sto_filename, sensor_to_opensim_rotations, baseIMUName, baseIMUHeading)
+    if os.path.exists(cached):
+        mark_used(cached)
+    return cached
+
+# One IMUInverseKinematicsTool run, writes ik_<orientations file stem>.mot into results_directory
+def run_ik_tool(model_filename, orientations_file, results_directory=resultsDirectory, start_time=startTime,
+                end_time=endTime):
+    import opensim as osim
+
+    imuIK = osim.IMUInverseKinematicsTool()
+    imuIK.set_model_file(model_filename)
+    imuIK.set_orientations_file(orientations_file)
+    imuIK.set_sensor_to_opensim_rotations(osim.Vec3(*sensor_to_opensim_rotations))
+    imuIK.set_results_directory(results_directory)
+    imuIK.set_time_range(0, start_time)
+    imuIK.set_time_range(1, end_time)
+    imuIK.run(False)
+
+# Worker: calibrate (cache hit in most cases) and solve one session, returns (session, seconds)
+#   resample  False, or True to resample before IK at rate Hz (None: the session's median rate)
+def run_session(sto_filename, fixed_model=None, results_directory=resultsDirectory, resample=False, rate=None):
+    start = time.perf_counter()
+    model_filename = fixed_model
+    if model_filename is None:
+        # No eviction from a worker, another one may be using the oldest model; main() evicts after the pool
+        model_filename = calibrated_model(modelFileName, sto_filename, sensor_to_opensim_rotations,
+                                          baseIMUName, baseIMUHeading, max_entries=None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        orientations_file = sto_filename
+        if resample:
+            # Same file name, so the tool still writes ik_<session>.mot
+            orientations_file = os.path.join(tmp, os.path.basename(sto_filename))
+            resample_sto(sto_filename, orientations_file, rate)
+
+        run_ik_tool(model_filename, orientations_file, results_directory)
+    write_settings(mot_name_for(sto_filename, results_directory), ik_settings(resample, rate))
+    return sto_filename, time.perf_counter() - start
+
+def find_sessions(directory=DATA_DIRECTORY):
+    return sorted(f for f in glob.glob(os.path.join(directory, 'data_*.sto'))
+                  if not os.path.basename(f).startswith('data_raw_'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run IMU inverse kinematics for every session in data/ in parallel')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--model', help='use this calibrated model for every session instead of calibrating each one')
+    parser.add_argument('--resample', action='store_true', help='deduplicate and SLERP each session onto a uniform grid first')
+    parser.add_argument('--rate', type=float, help="resampling rate in Hz (default: each session's median rate)")
+    parser.add_argument('--force', action='store_true', help='reprocess sessions that are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only list the sessions that would run')
+    args = parser.parse_args()
+
+    sessions = args.sessions or find_sessions()
+    todo = []
+    models = set()
+    skipped = 0
+    for sto_filename in sessions:
+        try:
+            model_filename = session_model(sto_filename, args.model)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            skipped += 1
+            continue
+        models.add(model_filename)
+        if args.force or not is_up_to_date(sto_filename, model_filename, resultsDirectory, args.resample, args.rate):
+            todo.append(sto_filename)
+
+    print(f"{len(todo)} of {len(sessions)} sessions to process, {len(sessions) - len(todo) - skipped} up to date"
+          + (f", {skipped} skipped" if skipped else ''))
+    if args.dry_run or not todo:
+        for sto_filename in todo:
+            print(f"  {os.path.basename(sto_filename)}")
+        return
+
+    os.makedirs(resultsDirectory, exist_ok=True)
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(run_session, sto_filename, args.model, resultsDirectory, args.resample, args.rate): sto_filename
+                   for sto_filename in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = os.path.basename(futures[future])
+            try:
+                _, seconds = future.result()
+                print(f"[{done}/{len(todo)}] {name}: {seconds:.1f}s")
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(todo)}] {name}: failed: {e}")
+    # Every model of this batch was used last, so keeping at least that many never evicts one of them
+    evict(max_entries=max(MAX_ENTRIES, len(models)))
+
+    print(f"Processed {len(todo) - failed} sessions in {time.perf_counter() - start:.1f}s with {args.jobs} workers"
+          + (f", {failed} failed" if failed else ''))
+
+if __name__ == '__main__':
+    main()
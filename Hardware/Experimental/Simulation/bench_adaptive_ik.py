@@ -0,0 +1,76 @@
+import argparse
+import glob
+import os
+import time
+import numpy as np
+
+from adaptive_ik import ERROR_BOUND, MAX_KEYFRAME_GAP, BOUNDED_COORDINATES, keyframe_ik
+from batch_ik import mot_name_for
+from storage_loader import load_motion, load_orientations
+
+# Benchmark: adaptive keyframe IK against full IK, without OpenSim. The existing IK_results/ik_<session>.mot of
+# every session stands in for the solver (solving a frame looks up its full-IK row), so the interpolated
+# coordinates can be compared with full IK on every frame, not only the validated ones. Reports, per keyframe
+# threshold, the share of frames that would be solved (the IK time saved), the largest error the validation saw,
+# the true largest and 99th percentile error over all frames, and how many sessions fell back to full IK.
+
+FILEPATH = os.path.dirname(__file__)
+
+def load_pairs(sessions):
+    pairs = []
+    for sto_filename in sessions:
+        mot_filename = mot_name_for(sto_filename)
+        if not os.path.exists(mot_filename):
+            continue
+        try:
+            _, times, quats = load_orientations(sto_filename)
+            coordinates, mot_times, values = load_motion(mot_filename)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        if len(mot_times) != len(times):
+            print(f"Skipping {os.path.basename(mot_filename)}: {len(mot_times)} IK frames for {len(times)} orientations")
+            continue
+        pairs.append((os.path.basename(sto_filename), np.asarray(times), np.asarray(quats), coordinates,
+                      np.asarray(values)))
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark keyframe IK against the full IK results in IK_results/')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/ with an IK result)')
+    parser.add_argument('--thresholds', default='0.5,1,2,4,8', help='comma separated keyframe thresholds in degrees')
+    parser.add_argument('--bound', type=float, default=ERROR_BOUND)
+    parser.add_argument('--max-gap', type=float, default=MAX_KEYFRAME_GAP)
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.sessions or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data*.sto'))))
+    frames = sum(len(times) for _, times, _, _, _ in pairs)
+    print(f"{len(pairs)} sessions, {frames} frames, error bound {args.bound} deg")
+    print(f"{'threshold':>9}{'solved':>9}{'share':>8}{'IK runs':>9}{'checked max':>13}{'true max':>10}{'true p99':>10}"
+          f"{'fallbacks':>11}{'host time':>11}")
+    for threshold in [float(value) for value in args.thresholds.split(',')]:
+        solved = runs = fallbacks = 0
+        checked, errors = [], []
+        host = 0.0
+        for name, times, quats, coordinates, values in pairs:
+            calls = []
+            def solve(frames):
+                calls.append(len(frames))
+                return coordinates, values[frames]
+            start = time.perf_counter()
+            _, interpolated, stats = keyframe_ik(times, quats, solve, threshold, args.max_gap, args.bound)
+            host += time.perf_counter() - start
+
+            bounded = [i for i, label in enumerate(coordinates) if label in BOUNDED_COORDINATES]
+            errors.append(np.abs(interpolated - values)[:, bounded].max(axis=1))
+            checked.append(stats['max_error'])
+            # A fallback solves every frame again on top of what was already solved
+            solved += sum(calls)
+            runs += len(calls)
+            fallbacks += stats['fallback']
+        errors = np.concatenate(errors)
+        print(f"{threshold:>9.1f}{solved:>9}{solved / frames:>8.0%}{runs / len(pairs):>9.1f}{max(checked):>13.2f}"
+              f"{errors.max():>10.2f}{np.percentile(errors, 99):>10.2f}{fallbacks:>11}{host:>10.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import glob
+import os
+import tempfile
+import time
+
+from gateway import Gateway
+from reprocess_raw import load_raw_session
+
+# Benchmark: throughput of the gateway as the number of concurrent capture sessions grows.
+# Every session replays a recorded data_raw_*.txt through ble_replay.ReplayClient into its own CaptureSession
+# (decode, knee angle, rep detection, buffered .sto and raw files). Reports packets/s over all sessions and per
+# session, and checks that every session wrote every packet it received.
+
+FILEPATH = os.path.dirname(__file__)
+
+async def run_sessions(raw_filename, sessions, speed, output_directory):
+    gateway = Gateway(output_directory)
+    start = time.perf_counter()
+    running = [await gateway.start_session(f'replay_{i + 1}', replay=raw_filename, speed=speed) for i in range(sessions)]
+    await gateway.wait_idle(poll=0.01)
+    elapsed = time.perf_counter() - start
+    packets = sum(session.packets for session in running)
+    complete = all(session.writer.rows_written == session.packets for session in running)
+    return packets, elapsed, complete
+
+def main():
+    parser = argparse.ArgumentParser(description='Gateway throughput against the number of concurrent sessions')
+    parser.add_argument('raw_file', nargs='?', help='data_raw_*.txt to replay (default: the longest in data/)')
+    parser.add_argument('--sessions', default='1,2,4,8,16,32,64', help='comma separated session counts')
+    parser.add_argument('--speed', type=float, help='replay speed, 1 = real time (default: as fast as possible)')
+    args = parser.parse_args()
+
+    raw_filename = args.raw_file
+    if raw_filename is None:
+        candidates = []
+        for filename in glob.glob(os.path.join(FILEPATH, 'data', 'data_raw_*.txt')):
+            try:
+                candidates.append((len(load_raw_session(filename)[1]), filename))
+            except ValueError:
+                continue
+        raw_filename = max(candidates)[1]
+    print(f"replaying {os.path.basename(raw_filename)} ({len(load_raw_session(raw_filename)[1])} packets per session)")
+
+    print(f"{'sessions':>9}{'packets':>10}{'seconds':>9}{'packets/s':>11}{'per session':>13}  all written")
+    for sessions in [int(n) for n in args.sessions.split(',')]:
+        with tempfile.TemporaryDirectory() as directory:
+            packets, elapsed, complete = asyncio.run(run_sessions(raw_filename, sessions, args.speed, directory))
+        print(f"{sessions:>9}{packets:>10}{elapsed:>9.2f}{packets / elapsed:>11,.0f}{packets / elapsed / sessions:>13,.0f}"
+              f"  {'yes' if complete else 'NO'}")
+
+if __name__ == '__main__':
+    main()
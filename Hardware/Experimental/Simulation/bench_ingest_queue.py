@@ -0,0 +1,46 @@
+import asyncio
+import os
+import time
+
+from ble_replay import ReplayClient
+from ingest_queue import IngestQueue
+from packet_decoder import decode_rpy
+
+# Overload the ingest queue with replayed devices and a slow processing stage, and report what each drop
+# policy does with the excess: depth, drops and how long the event loop callback takes per packet
+
+FILEPATH = os.path.dirname(__file__)
+DEVICES = 10
+QUEUE_SIZE = 256
+PROCESS_SECONDS = 0.0002    # Simulated per-packet processing cost (e.g. IK)
+
+def slow_process(item):
+    t, data = item
+    decode_rpy(data)
+    time.sleep(PROCESS_SECONDS)
+
+async def overload(recording, policy):
+    callback_time = [0.0]
+    async with IngestQueue(slow_process, QUEUE_SIZE, policy) as ingest_queue:
+        def handler(sender, data):
+            start = time.perf_counter()
+            ingest_queue.put((time.monotonic(), data))
+            callback_time[0] += time.perf_counter() - start
+
+        clients = [ReplayClient(recording, speed=None) for _ in range(DEVICES)]
+        for client in clients:
+            await client.start_notify('replay', handler)
+        await asyncio.gather(*(client.finished.wait() for client in clients))
+    return ingest_queue.stats(), callback_time[0] / ingest_queue.received * 1e6
+
+def main():
+    recording = os.path.join(FILEPATH, 'data', 'data_raw_2024_11_07_18_52.txt')
+    print(f"{DEVICES} devices replaying as fast as possible, queue of {QUEUE_SIZE}, {PROCESS_SECONDS * 1e6:.0f}us per packet")
+    print(f"{'policy':<13}{'received':>9}{'processed':>10}{'dropped':>9}{'max depth':>10}{'callback us':>12}")
+    for policy in IngestQueue.POLICIES:
+        stats, callback_us = asyncio.run(overload(recording, policy))
+        dropped = stats['dropped_oldest'] + stats['dropped_newest']
+        print(f"{policy:<13}{stats['received']:>9}{stats['processed']:>10}{dropped:>9}{stats['max_depth']:>10}{callback_us:>12.2f}")
+
+if __name__ == '__main__':
+    main()
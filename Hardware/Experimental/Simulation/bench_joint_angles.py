@@ -0,0 +1,52 @@
+import time
+import numpy as np
+
+from joint_angles import knee_angles
+from orientation import rpy_to_quaternion, rpy_to_quaternion_batch
+
+# Joint angles for a multi-hour session in one NumPy pass, against the per-sample pitch-only computation
+# the live handlers do
+
+SAMPLE_RATE = 50            # Hz
+HOURS = 3
+REPEATS = 3
+
+def synthetic_session(frames):
+    t = np.arange(frames) / SAMPLE_RATE
+    femur = np.zeros((frames, 3))
+    tibia = np.zeros((frames, 3))
+    femur[:, 1] = 10 + 30 * np.sin(t)
+    tibia[:, 1] = -40 * np.sin(t) ** 2
+    femur[:, 2] = tibia[:, 2] = 15 * np.sin(t / 7)
+    return femur, tibia
+
+def legacy(femur, tibia):
+    femur0, tibia0 = femur[0, 1], tibia[0, 1]
+    angles = []
+    for f, t in zip(femur.tolist(), tibia.tolist()):
+        rpy_to_quaternion(*f)
+        rpy_to_quaternion(*t)
+        angles.append((femur0 - f[1]) - (tibia0 - t[1]))
+    return angles
+
+def main():
+    frames = HOURS * 3600 * SAMPLE_RATE
+    femur_rpy, tibia_rpy = synthetic_session(frames)
+    femur, tibia = rpy_to_quaternion_batch(femur_rpy), rpy_to_quaternion_batch(tibia_rpy)
+
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        knee_angles(femur, tibia)
+        best = min(best, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    legacy(femur_rpy, tibia_rpy)
+    loop = time.perf_counter() - start
+
+    print(f"{HOURS} h at {SAMPLE_RATE} Hz = {frames:,} frames")
+    print(f"per-sample loop (pitch only):     {loop:6.3f}s")
+    print(f"knee_angles (flexion/varus/rot):  {best:6.3f}s  ({frames / best:,.0f} frames/s)")
+
+if __name__ == '__main__':
+    main()
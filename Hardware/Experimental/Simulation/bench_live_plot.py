@@ -0,0 +1,48 @@
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from live_plot import LivePlot
+
+# Cost of one live plot frame against the number of samples in the visible window, compared with
+# redrawing every point the way the end-of-run plot does
+
+FRAMES = 20
+WINDOW_SECONDS = 10.0
+
+def filled_plot(samples):
+    live_plot = LivePlot(window_seconds=WINDOW_SECONDS, capacity=samples + LivePlot.SNAPSHOT_SLACK)
+    live_plot._setup()
+    times = np.linspace(0, WINDOW_SECONDS * 0.99, samples)
+    for t, value in zip(times.tolist(), (60 + 40 * np.sin(times * 3)).tolist()):
+        live_plot.push(t, value)
+    return live_plot, times
+
+def blit_frame_ms(samples):
+    live_plot, _ = filled_plot(samples)
+    live_plot._frame()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        live_plot._frame()
+    plt.close(live_plot._figure)
+    return (time.perf_counter() - start) * 1000 / FRAMES
+
+def full_redraw_ms(samples):
+    times = np.linspace(0, WINDOW_SECONDS, samples)
+    figure, axes = plt.subplots(figsize=(8, 5))
+    axes.plot(times, 60 + 40 * np.sin(times * 3), marker='o', linestyle='-')
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        figure.canvas.draw()
+    plt.close(figure)
+    return (time.perf_counter() - start) * 1000 / FRAMES
+
+def main():
+    print(f"{'samples':>9}{'blit + decimate ms':>20}{'full redraw ms':>16}")
+    for samples in (1_000, 10_000, 100_000, 1_000_000):
+        print(f"{samples:>9}{blit_frame_ms(samples):>20.2f}{full_redraw_ms(samples):>16.2f}")
+
+if __name__ == '__main__':
+    main()
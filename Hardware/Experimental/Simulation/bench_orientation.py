@@ -0,0 +1,51 @@
+import argparse
+import math
+import time
+import numpy as np
+
+from orientation import rpy_to_quaternion, rpy_to_quaternion_batch
+
+# Benchmark: the copy-pasted scalar rpy_to_quaternion against the shared single-sample and NumPy batch versions
+
+# The original per-script implementation, kept here only as the baseline
+def legacy_rpy_to_quaternion(roll, pitch, yaw):
+    roll = math.radians(roll)
+    pitch = math.radians(pitch)
+    yaw = math.radians(yaw)
+
+    q_w = math.cos(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
+    q_x = math.sin(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) - math.cos(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
+    q_y = math.cos(roll/2) * math.sin(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.cos(pitch/2) * math.sin(yaw/2)
+    q_z = math.cos(roll/2) * math.cos(pitch/2) * math.sin(yaw/2) - math.sin(roll/2) * math.sin(pitch/2) * math.cos(yaw/2)
+
+    return q_w, q_x, q_y, q_z
+
+def run_scalar(fn, rpy):
+    flat = rpy.reshape(-1, 3).tolist()
+    start = time.perf_counter()
+    out = [fn(r, p, y) for r, p, y in flat]
+    return time.perf_counter() - start, np.array(out).reshape(rpy.shape[:-1] + (4,))
+
+def run_batch(rpy):
+    start = time.perf_counter()
+    out = rpy_to_quaternion_batch(rpy)
+    return time.perf_counter() - start, out
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare scalar and batch RPY to quaternion conversion')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 1_000_000], help='samples per run')
+    parser.add_argument('--imus', type=int, default=5, help='IMUs per sample')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'samples':>10}{'legacy (s)':>12}{'shared (s)':>12}{'batch (s)':>12}{'batch speedup':>15}")
+    for n in args.sizes:
+        rpy = rng.uniform(-180, 180, size=(n, args.imus, 3))
+        t_legacy, q_legacy = run_scalar(legacy_rpy_to_quaternion, rpy)
+        t_shared, q_shared = run_scalar(rpy_to_quaternion, rpy)
+        t_batch, q_batch = run_batch(rpy)
+        assert np.allclose(q_legacy, q_shared) and np.allclose(q_legacy, q_batch)
+        print(f"{n:>10}{t_legacy:>12.3f}{t_shared:>12.3f}{t_batch:>12.3f}{t_legacy / t_batch:>14.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import os
+import random
+import time
+
+from packet_decoder import (KIND_QUAT_F32, KIND_QUAT_I16, KIND_RPY_F32, KIND_RPY_I16,
+                            decode_packet, encode_binary, encode_text)
+
+# Micro-benchmark: packets/sec of the old inline text parse against every decoder path.
+# Packets are built from a recorded raw session when one is available so the text lengths are realistic.
+# The cases are timed in interleaved rounds and each keeps its best round, so a burst of scheduler noise
+# lands on every case instead of deciding the ratio of whichever case it hit.
+
+FILEPATH = os.path.dirname(__file__)
+RAW_DATA_FILENAME = os.path.join(FILEPATH, 'data', 'data_raw_2024_11_07_19_01.txt')
+
+def load_rpy_rows(filename, n_imus):
+    rows = []
+    if os.path.exists(filename):
+        with open(filename) as file:
+            next(file)
+            for line in file:
+                cells = line.strip().split('\t')[1:1 + n_imus]
+                rows.append([float(v) for cell in cells for v in cell.split(',')])
+    if not rows:
+        rows = [[random.uniform(-180, 180) for _ in range(3 * n_imus)] for _ in range(500)]
+    return rows
+
+# The parse every notification_handler used to do inline
+def legacy_decode(data):
+    values = data.decode('utf-8').strip().split(',')
+    return [float(v) for v in values]
+
+def packets_per_second(decoder, packets, passes):
+    start = time.perf_counter()
+    for _ in range(passes):
+        for packet in packets:
+            decoder(packet)
+    return passes * len(packets) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare packet decode throughput for text and binary frames')
+    parser.add_argument('--imus', type=int, default=3, help='IMUs per packet')
+    parser.add_argument('--rounds', type=int, default=50, help='interleaved rounds, the best one of each format is kept')
+    parser.add_argument('--passes', type=int, default=5, help='passes over the packets per round')
+    args = parser.parse_args()
+
+    rows = load_rpy_rows(RAW_DATA_FILENAME, args.imus)
+    quats = [[0.5, 0.5, 0.5, 0.5] * args.imus for _ in rows]
+
+    cases = [
+        ('text (legacy inline)', legacy_decode, [encode_text(r) for r in rows]),
+        ('text (decoder)', decode_packet, [encode_text(r) for r in rows]),
+        ('binary rpy float32', decode_packet, [encode_binary(KIND_RPY_F32, r) for r in rows]),
+        ('binary rpy int16', decode_packet, [encode_binary(KIND_RPY_I16, r) for r in rows]),
+        ('binary quat float32', decode_packet, [encode_binary(KIND_QUAT_F32, q) for q in quats]),
+        ('binary quat int16', decode_packet, [encode_binary(KIND_QUAT_I16, q) for q in quats]),
+    ]
+
+    rates = [0.0] * len(cases)
+    for _ in range(args.rounds):
+        for i, (_, decoder, packets) in enumerate(cases):
+            rates[i] = max(rates[i], packets_per_second(decoder, packets, args.passes))
+
+    print(f"{'format':<24}{'bytes':>8}{'packets/s':>14}{'speedup':>10}")
+    for (name, _, packets), rate in zip(cases, rates):
+        size = sum(len(p) for p in packets) / len(packets)
+        print(f"{name:<24}{size:>8.0f}{rate:>14,.0f}{rate / rates[0]:>9.2f}x")
+
+if __name__ == '__main__':
+    main()
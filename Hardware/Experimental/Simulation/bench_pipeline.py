@@ -0,0 +1,177 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+from knee_angle import KneeAngleStream
+from orientation import rpy_to_quaternion
+from packet_decoder import decode_rpy, encode_text
+from reprocess_raw import load_raw_session
+
+# End-to-end benchmark of the simulation pipeline, driven by the recorded sessions in data/.
+#
+# Every recorded sample is pushed through the same steps the live handlers run and each step is timed
+# per sample: decode, quaternion conversion, file writing and knee-angle computation. With --ik the
+# IMUInverseKinematicsTool is also run on each session's .sto and its runtime is divided over the frames.
+# Throughput and p50/p95/p99 latency per stage go to a JSON file so runs can be compared across commits.
+
+FILEPATH = os.path.dirname(__file__)
+DATA_DIRECTORY = os.path.join(FILEPATH, 'data')
+RESULTS_DIRECTORY = os.path.join(FILEPATH, 'bench_results')
+CALIBRATED_MODEL = os.path.join(FILEPATH, 'models', 'calibrated_model.osim')
+
+IMUS_PER_PACKET = 3         # pelvis, femur_r, tibia_r, as sent by the ESP32
+FEMUR_INDEX, TIBIA_INDEX = 1, 2
+AVG_CALIBRATION = 10
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=FILEPATH or '.',
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Time every stage for each sample of one recorded session, returns {stage: per-sample ns}
+def bench_session(raw_filename, out_file):
+    _, times, rpy = load_raw_session(raw_filename)
+    if len(times) == 0:
+        raise ValueError(f"{raw_filename}: no samples")
+    packets = [encode_text(row) for row in rpy[:, :IMUS_PER_PACKET, :].reshape(len(times), -1).tolist()]
+    timings = {stage: np.empty(len(packets), dtype=np.int64) for stage in ('decode', 'quaternion', 'write', 'knee_angle')}
+
+    clock = time.perf_counter_ns
+    knee_stream = KneeAngleStream(AVG_CALIBRATION, on_flush=lambda times, angles: None)
+    for n, (timestamp, packet) in enumerate(zip(times.tolist(), packets)):
+        t0 = clock()
+        values = decode_rpy(packet)
+        t1 = clock()
+        quats = [rpy_to_quaternion(values[i], values[i + 1], values[i + 2]) for i in range(0, len(values), 3)]
+        t2 = clock()
+        line = [f"{timestamp:.5f}"]
+        line_raw = [f"{timestamp:.5f}"]
+        for i, (q_w, q_x, q_y, q_z) in enumerate(quats):
+            line.append(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
+            line_raw.append(f"\t{values[3 * i]:.6f},{values[3 * i + 1]:.6f},{values[3 * i + 2]:.6f}")
+        out_file.write(''.join(line) + '\n')
+        out_file.write(''.join(line_raw) + '\n')
+        t3 = clock()
+        # Pitch-only knee angle with a running-mean calibration, as compute_live.py does it
+        knee_stream.update(timestamp, values[3 * FEMUR_INDEX + 1], values[3 * TIBIA_INDEX + 1])
+        t4 = clock()
+
+        timings['decode'][n] = t1 - t0
+        timings['quaternion'][n] = t2 - t1
+        timings['write'][n] = t3 - t2
+        timings['knee_angle'][n] = t4 - t3
+    return timings
+
+# Run IMUInverseKinematicsTool over a session, returns (seconds, frames)
+def bench_ik(sto_filename, results_directory):
+    import opensim as osim
+    from math import pi
+
+    with open(sto_filename) as file:
+        frames = sum(1 for line in file if line.strip()) - 3     # DataType, endheader and the labels
+    if frames <= 0:
+        raise ValueError(f"{sto_filename}: no frames")
+    imuIK = osim.IMUInverseKinematicsTool()
+    imuIK.set_model_file(CALIBRATED_MODEL)
+    imuIK.set_orientations_file(sto_filename)
+    imuIK.set_sensor_to_opensim_rotations(osim.Vec3(-pi/2, 0, 0))
+    imuIK.set_results_directory(results_directory)
+    imuIK.set_time_range(0, 0)
+    imuIK.set_time_range(1, 1000)
+    start = time.perf_counter()
+    imuIK.run(False)
+    return time.perf_counter() - start, frames
+
+def summarize(samples_ns):
+    samples_us = np.asarray(samples_ns, dtype=np.float64) / 1000.0
+    total_s = samples_us.sum() / 1e6
+    return {
+        'samples': int(samples_us.size),
+        'throughput_per_s': float(samples_us.size / total_s) if total_s else None,
+        'mean_us': float(samples_us.mean()),
+        'p50_us': float(np.percentile(samples_us, 50)),
+        'p95_us': float(np.percentile(samples_us, 95)),
+        'p99_us': float(np.percentile(samples_us, 99)),
+    }
+
+def print_table(results, baseline=None):
+    print(f"{'stage':<12}{'samples':>9}{'per s':>14}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}"
+          + (f"{'vs base':>10}" if baseline else ''))
+    for stage, r in results['stages'].items():
+        row = (f"{stage:<12}{r['samples']:>9}{r['throughput_per_s']:>14,.0f}"
+               f"{r['p50_us']:>10.2f}{r['p95_us']:>10.2f}{r['p99_us']:>10.2f}")
+        base = baseline['stages'].get(stage) if baseline else None
+        if base:
+            row += f"{r['throughput_per_s'] / base['throughput_per_s']:>9.2f}x"
+        print(row)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the capture and simulation pipeline on recorded sessions')
+    parser.add_argument('raw_files', nargs='*', help='data_raw_*.txt files (default: every raw file in data/)')
+    parser.add_argument('--ik', action='store_true', help='also time IMUInverseKinematicsTool (needs opensim)')
+    parser.add_argument('--output', help='results file (default: bench_results/pipeline_<commit>.json)')
+    parser.add_argument('--compare', help='previous results file to compare throughput against')
+    args = parser.parse_args()
+
+    raw_files = args.raw_files or sorted(glob.glob(os.path.join(DATA_DIRECTORY, 'data_raw_*.txt')))
+    stage_samples = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'out.txt'), 'w') as out_file:
+            for raw_filename in list(raw_files):
+                try:
+                    timings = bench_session(raw_filename, out_file)
+                except ValueError as e:
+                    print(f"Skipping {e}")
+                    raw_files.remove(raw_filename)
+                    continue
+                for stage, samples in timings.items():
+                    stage_samples.setdefault(stage, []).append(samples)
+        stage_samples = {stage: np.concatenate(s) for stage, s in stage_samples.items()}
+        stage_samples['end_to_end'] = sum(stage_samples.values())
+
+        if args.ik:
+            ik_per_frame = []
+            for raw_filename in raw_files:
+                sto_filename = raw_filename.replace('data_raw_', 'data_').replace('.txt', '.sto')
+                if os.path.exists(sto_filename):
+                    try:
+                        seconds, frames = bench_ik(sto_filename, tmp)
+                    except ValueError as e:
+                        print(f"Skipping {e}")
+                        continue
+                    ik_per_frame.extend([seconds * 1e9 / frames] * frames)
+            stage_samples['ik'] = np.array(ik_per_frame)
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'sessions': len(raw_files),
+        'stages': {stage: summarize(samples) for stage, samples in stage_samples.items() if len(samples)},
+    }
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f'pipeline_{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_table(results, baseline)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+import urllib.request
+import numpy as np
+
+from session_upload import Outbox, StandInServer, Uploader, session_name
+from storage_loader import load_orientations
+
+# Benchmark: uploading recorded sessions to a local StandInServer, batched and gzip-compressed over one
+# kept-alive connection through the outbox, against a naive uploader that POSTs every row as plain JSON on
+# a new connection. Reports requests, bytes on the wire (request line, headers and body, as received by the
+# server) and time per session, and checks that the batched upload survives the server being down.
+
+FILEPATH = os.path.dirname(__file__)
+
+def naive_upload(url, sto_filename, patient_id):
+    labels, times, quats = load_orientations(sto_filename)
+    name = session_name(sto_filename)
+    for t, q in zip(times.tolist(), np.round(quats.reshape(len(times), -1), 6).tolist()):
+        body = json.dumps({'session': name, 'patient_id': patient_id, 'labels': labels, 'time': t, 'values': q}).encode()
+        request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+    return len(times)
+
+def batched_upload(url, sto_filename, patient_id, batch_rows, outbox_directory):
+    outbox = Outbox(outbox_directory)
+    outbox.enqueue(sto_filename, patient_id, batch_rows)
+    with Uploader(url, outbox) as uploader:
+        uploader.flush()
+    return uploader
+
+def measure(upload):
+    with StandInServer() as server:
+        start = time.perf_counter()
+        upload(server.url)
+        elapsed = time.perf_counter() - start
+    return server, elapsed
+
+# Server down for the first attempts, then back but failing and losing acknowledgements: nothing may be lost
+# or stored twice
+def check_offline(sto_filename, batch_rows, outbox_directory):
+    outbox = Outbox(outbox_directory)
+    count = outbox.enqueue(sto_filename, 1, batch_rows)
+    with Uploader('http://127.0.0.1:9/upload_session', outbox, timeout=1.0, max_retries=2, retry_delay=0.01) as uploader:
+        sent_offline = uploader.flush()
+    with StandInServer() as server:
+        server.fail_next = 2
+        server.lose_ack_next = 1
+        with Uploader(server.url, outbox, max_retries=4, retry_delay=0.01) as uploader:
+            sent = uploader.flush()
+        rows = server.rows(session_name(sto_filename))
+    return count, sent_offline, sent, rows, server.duplicates, len(outbox.pending()), uploader.retries
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched, compressed session uploads against row-per-request')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: the 3 largest sessions in data/)')
+    parser.add_argument('--batch-rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    sessions = args.sessions
+    if not sessions:
+        candidates = glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto'))
+        sessions = sorted(candidates, key=os.path.getsize, reverse=True)[:3]
+
+    print(f"{'session':<28}{'rows':>7}  {'':<8}{'requests':>9}{'wire bytes':>14}{'B/row':>8}{'time':>9}")
+    for sto_filename in sessions:
+        try:
+            rows = len(load_orientations(sto_filename)[1])
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            batched, batched_time = measure(lambda url: batched_upload(url, sto_filename, 1, args.batch_rows, directory))
+        naive, naive_time = measure(lambda url: naive_upload(url, sto_filename, 1))
+
+        name = session_name(sto_filename)
+        for label, server, elapsed in (('naive', naive, naive_time), ('batched', batched, batched_time)):
+            print(f"{name if label == 'naive' else '':<28}{rows if label == 'naive' else '':>7}  {label:<8}"
+                  f"{server.requests:>9}{server.bytes_received:>14,}{server.bytes_received / max(rows, 1):>8.1f}"
+                  f"{elapsed:>8.2f}s")
+        print(f"{'':<37}{naive.requests / batched.requests:>8.0f}x fewer requests, "
+              f"{naive.bytes_received / batched.bytes_received:.1f}x fewer bytes, {naive_time / batched_time:.0f}x faster, "
+              f"{batched.connections} connection(s) vs {naive.connections}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        count, sent_offline, sent, rows, duplicates, left, retries = check_offline(sessions[0], 250, directory)
+    print(f"offline check: {count} batches queued, {sent_offline} sent while down, {sent} sent after "
+          f"({retries} retries, {duplicates} duplicate rejected), {rows} rows stored, {left} left in the outbox")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from orientation import rpy_to_quaternion
+from session_writer import SessionWriter
+
+# Benchmark: the old per-packet open()/append handler against the SessionWriter enqueue path.
+# Reports sustained rows/sec (until every row is on disk) and the p99 and slowest single callback, each the
+# median over --repeat runs: a single run's maximum is set by scheduler noise and does not reproduce.
+
+COLUMNS = "time\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\tfemur_l_imu\ttibia_l_imu"
+
+def format_rows(timestamp, values):
+    line = [f"{timestamp:.5f}"]
+    line_raw = [f"{timestamp:.5f}"]
+    for i in range(0, len(values), 3):
+        roll, pitch, yaw = values[i], values[i + 1], values[i + 2]
+        q_w, q_x, q_y, q_z = rpy_to_quaternion(roll, pitch, yaw)
+        line.append(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
+        line_raw.append(f"\t{roll:.6f},{pitch:.6f},{yaw:.6f}")
+    line.append("\n")
+    line_raw.append("\n")
+    return ''.join(line), ''.join(line_raw)
+
+# The handler body ble_opensim.py used to run on every notification
+def make_legacy_handler(sto_filename, raw_filename, sleep):
+    def handler(timestamp, values):
+        with open(sto_filename, 'a') as file:
+            with open(raw_filename, 'a') as file_raw:
+                file.write(f"{timestamp:.5f}")
+                file_raw.write(f"{timestamp:.5f}")
+                for i in range(0, len(values), 3):
+                    roll, pitch, yaw = values[i], values[i + 1], values[i + 2]
+                    q_w, q_x, q_y, q_z = rpy_to_quaternion(roll, pitch, yaw)
+                    file.write(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
+                    file_raw.write(f"\t{roll:.6f},{pitch:.6f},{yaw:.6f}")
+                file.write("\n")
+                file_raw.write("\n")
+                if sleep:
+                    time.sleep(0.001)
+    return handler
+
+# Callback times of one run, sorted
+def drive(handler, samples):
+    latencies = []
+    for i, values in enumerate(samples):
+        start = time.perf_counter()
+        handler(i * 0.01, values)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+# (rows/s, p99 callback, max callback) of one run
+def run_stats(rows, total, latencies):
+    return rows / total, latencies[int(0.99 * (len(latencies) - 1))], latencies[-1]
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-packet file appends with the buffered SessionWriter')
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--imus', type=int, default=5)
+    parser.add_argument('--legacy-sleep', action='store_true', help='include the time.sleep(0.001) the old handler did')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per handler, the median of each figure is reported')
+    args = parser.parse_args()
+
+    samples = [[random.uniform(-180, 180) for _ in range(3 * args.imus)] for _ in range(args.rows)]
+
+    legacy, buffered = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(args.repeat):
+            sto, raw = os.path.join(tmp, f'legacy_{run}.sto'), os.path.join(tmp, f'legacy_{run}.txt')
+            start = time.perf_counter()
+            latencies = drive(make_legacy_handler(sto, raw, args.legacy_sleep), samples)
+            legacy.append(run_stats(args.rows, time.perf_counter() - start, latencies))
+
+            sto, raw = os.path.join(tmp, f'buffered_{run}.sto'), os.path.join(tmp, f'buffered_{run}.txt')
+            start = time.perf_counter()
+            with SessionWriter([(sto, COLUMNS), (raw, COLUMNS)], format_rows) as writer:
+                latencies = drive(lambda t, v: writer.enqueue(t, v), samples)
+            buffered.append(run_stats(args.rows, time.perf_counter() - start, latencies))
+            assert writer.rows_written == args.rows
+
+    print(f"{'handler':<12}{'rows/s':>12}{'p99 callback (ms)':>20}{'max callback (ms)':>20}")
+    for name, runs in (('legacy', legacy), ('buffered', buffered)):
+        rate, p99, worst = (statistics.median(figure) for figure in zip(*runs))
+        print(f"{name:<12}{rate:>12,.0f}{p99 * 1000:>20.3f}{worst * 1000:>20.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import ast
+import json
+import os
+import subprocess
+import sys
+
+# Import time and peak RSS of the live scripts' dependencies, each set measured in a fresh interpreter.
+#
+# capture-only is every module compute_live.py / opensim_live.py import at the top level, read from the scripts
+# themselves so the list follows their imports, plus bleak, which device_registry.py imports on the first
+# connect. The other rows add what plotting and live IK pull in, which the scripts used to import (and build an
+# IMUInverseKinematicsTool and osim.Model with) on every start. Modules that are not installed here are
+# reported and left out.
+
+FILEPATH = os.path.dirname(os.path.abspath(__file__))
+REPEATS = 5
+SCRIPTS = ['compute_live.py', 'opensim_live.py']
+ON_CONNECT = ['bleak']  # Imported by device_registry.py when it first connects
+
+# Modules a script imports unconditionally, i.e. the import statements at its top level
+def top_level_imports(script):
+    with open(os.path.join(FILEPATH, script)) as file:
+        tree = ast.parse(file.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def configurations():
+    rows = []
+    for script in SCRIPTS:
+        capture_only = top_level_imports(script) + ON_CONNECT
+        live_ik = ['ik_session'] if script == 'opensim_live.py' else ['opensim']
+        rows += [
+            (f'{script} capture-only', capture_only),
+            ('  + plotting', capture_only + ['matplotlib.pyplot']),
+            ('  + live IK', capture_only + live_ik),
+            ('  eager (before)', capture_only + ['matplotlib.pyplot'] + live_ik),
+        ]
+    return rows
+
+PROBE = '''
+import importlib, json, resource, sys, time
+missing = []
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        missing.append(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'missing': missing}))
+'''
+
+def measure(modules):
+    runs = []
+    for _ in range(REPEATS):
+        output = subprocess.check_output([sys.executable, '-c', PROBE] + modules, cwd=FILEPATH, text=True)
+        runs.append(json.loads(output))
+    best = min(runs, key=lambda r: r['seconds'])
+    return best['seconds'], best['rss_mb'], best['missing']
+
+def main():
+    # Baseline: an interpreter that imports nothing
+    base_seconds, base_rss, _ = measure([])
+    print(f"{'configuration':<30}{'import ms':>11}{'peak RSS MB':>13}  not installed")
+    print(f"{'python only':<30}{base_seconds * 1000:>11.1f}{base_rss:>13.1f}")
+    for name, modules in configurations():
+        seconds, rss, missing = measure(modules)
+        print(f"{name:<30}{seconds * 1000:>11.1f}{rss:>13.1f}  {', '.join(missing)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import glob
+import os
+import shutil
+import time
+import numpy as np
+
+from storage_loader import SIDECAR_DIRECTORY, load_storage
+
+# Compare loading every .sto / .mot with a line-by-line parse, the columnar parse and the memory-mapped sidecar
+
+FILEPATH = os.path.dirname(__file__)
+REPEATS = 5
+
+# The per-line, per-cell parse the notebooks use
+def legacy_load(filename):
+    rows = []
+    with open(filename) as file:
+        for line in file:
+            if line.strip() == 'endheader':
+                break
+        next(file)
+        for line in file:
+            row = []
+            for cell in line.strip().split('\t'):
+                row.extend(float(v) for v in cell.split(','))
+            rows.append(row)
+    return np.array(rows)
+
+def best_of(function, files):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for filename in files:
+            function(filename)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    files = sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto'))
+                   + glob.glob(os.path.join(FILEPATH, 'IK_results', '*.mot')))
+    megabytes = sum(os.path.getsize(f) for f in files) / 1e6
+    for directory in {os.path.join(os.path.dirname(os.path.abspath(f)), SIDECAR_DIRECTORY) for f in files}:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    legacy = best_of(legacy_load, files)
+    parse = best_of(lambda f: load_storage(f, cache=False), files)
+    for filename in files:
+        load_storage(filename)      # build the sidecars
+    sidecar = best_of(load_storage, files)
+
+    print(f"{len(files)} files, {megabytes:.1f} MB of text")
+    print(f"legacy line parse:  {legacy * 1000:8.1f} ms")
+    print(f"columnar parse:     {parse * 1000:8.1f} ms  ({legacy / parse:.1f}x)")
+    print(f"mmap sidecar:       {sidecar * 1000:8.1f} ms  ({legacy / sidecar:.1f}x)")
+
+if __name__ == '__main__':
+    main()
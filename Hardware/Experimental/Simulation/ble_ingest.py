@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import time
+from collections import namedtuple
+from functools import partial
+
+from packet_decoder import decode_rpy
+from device_registry import DeviceRegistry
+
+CHARACTERISTIC_UUID_TX = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+
+# One notification, tagged with the device it came from and the host monotonic receive time
+Packet = namedtuple('Packet', 'device_id receive_time data')
+
+# One time-aligned sample: the host time of the tick and, per device, the latest decoded values
+# (None when that device has nothing newer than max_age, e.g. while it is reconnecting)
+MergedSample = namedtuple('MergedSample', 't values')
+
+# Connects to N devices at once under one asyncio loop and merges their notifications into a single
+# stream sampled on a fixed host-clock grid.
+#
+# Every device runs in its own task with its own reconnect loop, and the BLE callbacks only append to a
+# per-device slot, so a slow or reconnecting device never blocks the others: the merger keeps ticking
+# and reports that device as None until it is back. Only the newest packet per device is sampled on each
+# tick: packets replaced before any tick used them are counted in dropped, so a device sending faster than
+# sample_rate shows up there instead of vanishing. An exception from on_sample is logged and counted in
+# sample_errors, the merger keeps running.
+#
+#   devices       {device_id: address}, e.g. {'femur': '14:2B:2F:AE:BC:86', 'tibia': ...}
+#                 with a registry the address may be None, it is then looked up (see device_registry.py)
+#   on_sample     called with every MergedSample (default: samples are put on self.samples)
+#   client_factory  BleakClient or a drop-in with the same interface (see ble_replay.py)
+#   registry      device_registry.DeviceRegistry: addresses come from its cache, and a device that fails to
+#                 connect is looked up again with a filtered scan before the next attempt
+class MultiDeviceIngest:
+    def __init__(self, devices, on_sample=None, sample_rate=50.0, max_age=0.25,
+                 characteristic=CHARACTERISTIC_UUID_TX, client_factory=None,
+                 reconnect_delay=0.5, max_reconnect_delay=8.0, registry=None):
+        if client_factory is None:
+            from bleak import BleakClient
+            client_factory = BleakClient
+        self.devices = dict(devices)
+        self.on_sample = on_sample
+        self.sample_rate = sample_rate
+        self.max_age = max_age
+        self.characteristic = characteristic
+        self.client_factory = client_factory
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.registry = registry
+
+        self.samples = asyncio.Queue() if on_sample is None else None
+        self.connected = {device_id: False for device_id in self.devices}
+        self.packet_counts = {device_id: 0 for device_id in self.devices}
+        self.parse_errors = {device_id: 0 for device_id in self.devices}
+        self.reconnects = {device_id: 0 for device_id in self.devices}
+        self.dropped = {device_id: 0 for device_id in self.devices}
+        self.sample_errors = 0
+        self.t0 = None
+
+        self._latest = {device_id: None for device_id in self.devices}
+        self._sampled = {device_id: None for device_id in self.devices}
+        self._stop = None
+        self._tasks = []
+
+    # Callback from the BLE stack: tag the packet and keep only the newest one per device
+    def _on_notify(self, device_id, sender, data):
+        previous = self._latest[device_id]
+        if previous is not None and previous is not self._sampled[device_id]:
+            self.dropped[device_id] += 1
+        self._latest[device_id] = Packet(device_id, time.monotonic(), data)
+        self.packet_counts[device_id] += 1
+
+    async def _device_loop(self, device_id, address):
+        delay = self.reconnect_delay
+        default_address = address
+        refresh = False
+        while not self._stop.is_set():
+            disconnected = asyncio.Event()
+            try:
+                if self.registry is not None:
+                    address = await self.registry.resolve(device_id, refresh=refresh, default=default_address)
+                    refresh = False
+                async with self.client_factory(address, disconnected_callback=lambda client: disconnected.set()) as client:
+                    await client.start_notify(self.characteristic, partial(self._on_notify, device_id))
+                    self.connected[device_id] = True
+                    delay = self.reconnect_delay
+                    print(f"{device_id} connected ({address})")
+                    if self.registry is not None:
+                        self.registry.mark_connected(device_id)
+
+                    stop_wait = asyncio.ensure_future(self._stop.wait())
+                    lost_wait = asyncio.ensure_future(disconnected.wait())
+                    await asyncio.wait([stop_wait, lost_wait], return_when=asyncio.FIRST_COMPLETED)
+                    stop_wait.cancel()
+                    lost_wait.cancel()
+
+                    if not disconnected.is_set():
+                        await client.stop_notify(self.characteristic)
+            except LookupError as e:
+                print(f"{device_id}: {e}")
+            except (asyncio.TimeoutError, OSError, EOFError) as e:
+                print(f"{device_id}: connection failed: {e}")
+                refresh = not self.connected[device_id]
+            except Exception as e:
+                # BleakError and backend specific errors all land here, keep retrying
+                print(f"{device_id}: connection error: {e}")
+                refresh = not self.connected[device_id]
+            finally:
+                self.connected[device_id] = False
+
+            if self._stop.is_set():
+                return
+            self.reconnects[device_id] += 1
+            print(f"{device_id} disconnected, retrying in {delay:.1f}s")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    # Sample the latest packet of every device on a fixed grid of the shared host clock
+    async def _merge_loop(self):
+        period = 1.0 / self.sample_rate
+        decoded = {device_id: (None, None) for device_id in self.devices}
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            next_tick += period
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            now = time.monotonic()
+
+            values = {}
+            for device_id, packet in self._latest.items():
+                if packet is None or now - packet.receive_time > self.max_age:
+                    values[device_id] = None
+                    continue
+                self._sampled[device_id] = packet
+                # Decode each packet once, even if it is held over several ticks
+                if decoded[device_id][0] is not packet:
+                    try:
+                        decoded[device_id] = (packet, decode_rpy(packet.data))
+                    except ValueError:
+                        self.parse_errors[device_id] += 1
+                        decoded[device_id] = (packet, None)
+                values[device_id] = decoded[device_id][1]
+
+            if all(v is None for v in values.values()):
+                continue
+            if self.t0 is None:
+                self.t0 = now
+
+            sample = MergedSample(now - self.t0, values)
+            if self.on_sample is not None:
+                try:
+                    self.on_sample(sample)
+                except Exception as e:
+                    self.sample_errors += 1
+                    print(f"on_sample failed at t={sample.t:.3f}: {e!r}")
+            else:
+                self.samples.put_nowait(sample)
+
+            # Fell more than a tick behind (e.g. a long on_sample): resync instead of bursting
+            if time.monotonic() - next_tick > period:
+                next_tick = time.monotonic()
+
+    async def start(self):
+        self._stop = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._device_loop(device_id, address))
+                       for device_id, address in self.devices.items()]
+        self._tasks.append(asyncio.ensure_future(self._merge_loop()))
+
+    async def stop(self):
+        self._stop.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+async def run(devices, duration, sample_rate):
+    counter = {'samples': 0}
+
+    def on_sample(sample):
+        counter['samples'] += 1
+
+    async with MultiDeviceIngest(devices, on_sample=on_sample, sample_rate=sample_rate, registry=DeviceRegistry()) as ingest:
+        await asyncio.sleep(duration)
+
+    print(f"{counter['samples']} merged samples in {duration}s, {ingest.sample_errors} on_sample errors")
+    for device_id in devices:
+        print(f"{device_id}: {ingest.packet_counts[device_id]} packets, {ingest.dropped[device_id]} dropped, "
+              f"{ingest.parse_errors[device_id]} parse errors, {ingest.reconnects[device_id]} reconnects")
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream several IMU modules at once into one time-aligned sample stream')
+    parser.add_argument('devices', nargs='+', help='name=address, e.g. femur=14:2B:2F:AE:BC:86, or a name cached in the device registry')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=50, help='merged samples per second')
+    args = parser.parse_args()
+
+    devices = dict(d.split('=', 1) if '=' in d else (d, None) for d in args.devices)
+    asyncio.run(run(devices, args.duration, args.rate))
+
+if __name__ == '__main__':
+    main()
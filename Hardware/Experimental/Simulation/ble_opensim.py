@@ -1,10 +1,16 @@
 import opensim as osim
-from bleak import BleakClient
 from datetime import datetime
 from math import pi
 import os, math, time
 import asyncio
 from pathlib import Path
+from packet_decoder import decode_rpy
+from ble_replay import ReplayClient
+from device_registry import ReconnectingClient
+from orientation import rpy_to_quaternion
+from session_writer import SessionWriter
+from metrics import PACKETS, PARSE_ERRORS, HANDLER_SECONDS, WRITE_SECONDS, SummaryReporter, start_http_server
+from calibration_cache import calibrated_model
 
 ################################# VARIABLE SETUP ################################################
 FILEPATH = os.path.dirname(__file__)
@@ -12,11 +18,18 @@ BLE_DURATION_SECONDS = 20
 CAPTURE_NEW_DATA = True # False if you want to visualize the latest motion captured
 
 ### BLUETOOTH VARIABLES ###
+# Seeds the device registry on the first run, afterwards the cached address in devices.json is used
 ESP32_MAC_ADDRESS = "65DAA853-64CB-A387-AEE5-CDF0A60B786C"
 ESP32_MAC_ADDRESS = "14:2B:2F:AF:81:96"
 ESP32_MAC_ADDRESS = "14:2B:2F:AE:BC:86"
 SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
 CHARACTERISTIC_UUID_TX = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+REPLAY_FILE = None  # Path to a data_raw_*.txt to replay through ble_replay.ReplayClient instead of connecting to the ESP32
+REPLAY_SPEED = 1.0  # 1 = real time, N = N times faster, None = as fast as possible
+DEVICE_NAME = 'esp32'   # Name in the device registry and label in the metrics
+ADVERTISED_NAME = 'ESP32_IMU_BLE'   # Name prefix scanned for when the registry has no working address (see device_registry.py)
+METRICS_PORT = 9100     # Prometheus metrics at http://localhost:9100/metrics, None to disable
+SUMMARY_INTERVAL = 5    # Seconds between the one-line pipeline summaries
 FILENAME_SUFFIX = datetime.today().strftime('%Y_%m_%d_%H_%M')
 FILE_HEADER = '''DataType=Quaternion
 endheader'''
@@ -52,133 +65,110 @@ tibia_l_w, tibia_l_x, tibia_l_y, tibia_l_z = 0.0, 0.0, 0.0, 0.0
 pelvis_roll, pelvis_pitch, pelvis_yaw = 0.0, 0.0, 0.0
 pelvis_w, pelvis_x, pelvis_y, pelvis_z = 0.0, 0.0, 0.0, 0.0
 
-# Function to convert Roll, Pitch, Yaw to Quaternion
-def rpy_to_quaternion(roll, pitch, yaw):
-    # Convert angles to radians
-    roll = math.radians(roll)
-    pitch = math.radians(pitch)
-    yaw = math.radians(yaw)
+session_writer = None
 
-    # Quaternion conversion
-    q_w = math.cos(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
-    q_x = math.sin(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) - math.cos(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
-    q_y = math.cos(roll/2) * math.sin(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.cos(pitch/2) * math.sin(yaw/2)
-    q_z = math.cos(roll/2) * math.cos(pitch/2) * math.sin(yaw/2) - math.sin(roll/2) * math.sin(pitch/2) * math.cos(yaw/2)
+# Format one notification into its .sto and raw lines (called by SessionWriter.enqueue)
+def format_rows(timestamp, values, first_run):
+    global femur_l_roll, femur_l_pitch, femur_l_yaw
+    global femur_l_w, femur_l_x, femur_l_y, femur_l_z
+    global tibia_l_roll, tibia_l_pitch, tibia_l_yaw
+    global tibia_l_w, tibia_l_x, tibia_l_y, tibia_l_z
 
-    return q_w, q_x, q_y, q_z
+    line = [f"{timestamp:.5f}"]
+    line_raw = [f"{timestamp:.5f}"]
+
+    # Iterate through each IMU set of data
+    for i in range(0, len(values), 3):
+        roll, pitch, yaw = values[i], values[i + 1], values[i + 2]
+
+        # Convert RPY to quaternion
+        q_w, q_x, q_y, q_z = rpy_to_quaternion(roll, pitch, yaw)
+
+        # if i == 0:
+        #     if first_run:
+        #         pelvis_roll, pelvis_pitch, pelvis_yaw = roll, pitch, yaw
+        #         pelvis_w, pelvis_x, pelvis_y, pelvis_z = q_w, q_x, q_y, q_z
+
+        #     roll, pitch, yaw = pelvis_roll, pelvis_pitch, pelvis_yaw
+        #     q_w, q_x, q_y, q_z = pelvis_w, pelvis_x, pelvis_y, pelvis_z
+
+        # Quaternion data for the .sto file, raw data for the raw file
+        line.append(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
+        line_raw.append(f"\t{roll:.6f},{pitch:.6f},{yaw:.6f}")
+
+        if i == 3 and first_run:
+            femur_l_roll, femur_l_pitch, femur_l_yaw = roll, pitch, yaw
+            femur_l_w, femur_l_x, femur_l_y, femur_l_z = q_w, q_x, q_y, q_z
+
+        if i == 6 and first_run:
+            tibia_l_roll, tibia_l_pitch, tibia_l_yaw = roll, pitch, yaw
+            tibia_l_w, tibia_l_x, tibia_l_y, tibia_l_z = q_w, q_x, q_y, q_z
+
+    line.append(f"\t{femur_l_w:.6f},{femur_l_x:.6f},{femur_l_y:.6f},{femur_l_z:.6f}")
+    line_raw.append(f"\t{femur_l_roll:.6f},{femur_l_pitch:.6f},{femur_l_yaw:.6f}")
+
+    line.append(f"\t{tibia_l_w:.6f},{tibia_l_x:.6f},{tibia_l_y:.6f},{tibia_l_z:.6f}\n")
+    line_raw.append(f"\t{tibia_l_roll:.6f},{tibia_l_pitch:.6f},{tibia_l_yaw:.6f}\n")
+
+    return ''.join(line), ''.join(line_raw)
 
 # Callback function to handle incoming data from ESP32
+# Decodes, timestamps and formats the packet, file I/O happens on the session writer thread
 def notification_handler(sender, data):
-    try:
-        # Decode incoming data (need to add encoding on ESP32 side)
-        decoded_data = data.decode('utf-8').strip()
+    PACKETS.inc(device=DEVICE_NAME)
+    with HANDLER_SECONDS.time():
+        try:
+            # Decode incoming data (comma separated text or a binary frame, see packet_decoder.py)
+            values = decode_rpy(data)
 
-        # Split the incoming data by comma
-        values = decoded_data.split(',')
+            # Ensure the data contains 5 sets of this data roll pitch yaw data (15 total values)
+            # if len(values) != 15:
+            #     print(f"Unexpected data format: {data}")
+            #     return
 
-        # Ensure the data contains 5 sets of this data roll pitch yaw data (15 total values)
-        # if len(values) != 15:
-        #     print(f"Unexpected data format: {decoded_data}")
-        #     return
-        
-        global timestamp_0
-        global femur_l_roll, femur_l_pitch, femur_l_yaw
-        global femur_l_w, femur_l_x, femur_l_y, femur_l_z
-        global tibia_l_roll, tibia_l_pitch, tibia_l_yaw
-        global tibia_l_w, tibia_l_x, tibia_l_y, tibia_l_z
-        
-        global pelvis_roll, pelvis_pitch, pelvis_yaw
-        global pelvis_w, pelvis_x, pelvis_y, pelvis_z
-        
-        first_run = False
-        if timestamp_0 is None:
-            first_run = True
-            timestamp_0 = time.time()
-        timestamp = time.time() - timestamp_0
-        
-        # Open the .sto file in append mode
-        with open(STO_FILENAME, 'a') as file:
-            with open(RAW_DATA_FILENAME, 'a') as file_raw:
-                file.write(f"{timestamp:.5f}")
-                file_raw.write(f"{timestamp:.5f}")
-                
-                # Iterate through each IMU set of data
-                for i in range(0, len(values), 3):        
-                    roll = float(values[i])
-                    pitch = float(values[i + 1])
-                    yaw = float(values[i + 2])
-                    
-                    # Convert RPY to quaternion
-                    q_w, q_x, q_y, q_z = rpy_to_quaternion(roll, pitch, yaw)
-                    
-                    
-                    # if i == 0:
-                    #     if first_run:
-                    #         pelvis_roll, pelvis_pitch, pelvis_yaw = roll, pitch, yaw
-                    #         pelvis_w, pelvis_x, pelvis_y, pelvis_z = q_w, q_x, q_y, q_z
-                    
-                    #     roll, pitch, yaw = pelvis_roll, pelvis_pitch, pelvis_yaw
-                    #     q_w, q_x, q_y, q_z = pelvis_w, pelvis_x, pelvis_y, pelvis_z
-
-
-                    # Append quaternion data to the file
-                    file.write(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
-                    
-                    # Append raw data to the file_raw
-                    file_raw.write(f"\t{roll:.6f},{pitch:.6f},{yaw:.6f}")
-                    
-                    
-                    if i == 3 and first_run:
-                        femur_l_roll, femur_l_pitch, femur_l_yaw = roll, pitch, yaw
-                        femur_l_w, femur_l_x, femur_l_y, femur_l_z = q_w, q_x, q_y, q_z
-                    
-                    if i == 6 and first_run:
-                        tibia_l_roll, tibia_l_pitch, tibia_l_yaw = roll, pitch, yaw
-                        tibia_l_w, tibia_l_x, tibia_l_y, tibia_l_z = q_w, q_x, q_y, q_z
-
-                file.write(f"\t{femur_l_w:.6f},{femur_l_x:.6f},{femur_l_y:.6f},{femur_l_z:.6f}")
-                file_raw.write(f"\t{femur_l_roll:.6f},{femur_l_pitch:.6f},{femur_l_yaw:.6f}")
-                
-                file.write(f"\t{tibia_l_w:.6f},{tibia_l_x:.6f},{tibia_l_y:.6f},{tibia_l_z:.6f}")
-                file_raw.write(f"\t{tibia_l_roll:.6f},{tibia_l_pitch:.6f},{tibia_l_yaw:.6f}")
-                
-                file.write("\n")  # Newline after each set of IMU data
-                file_raw.write("\n")  # Newline after each set of IMU data
-                time.sleep(0.001)
-
-                # Print for verification
-                print(f"Data written for time {timestamp:.3f}")
-
-    except ValueError as e:
-        print(f"Error parsing data: {data}. Error: {e}")
+            global timestamp_0
+
+            first_run = False
+            if timestamp_0 is None:
+                first_run = True
+                timestamp_0 = time.time()
+            timestamp = time.time() - timestamp_0
+
+            session_writer.enqueue(timestamp, values, first_run)
+
+        except ValueError as e:
+            PARSE_ERRORS.inc(device=DEVICE_NAME)
+            print(f"Error parsing data: {data}. Error: {e}")
 
 async def run():
-    async with BleakClient(ESP32_MAC_ADDRESS) as client:
-        # Check if the ESP32 is connected
-        connected = await client.is_connected()
-        print(f"Connected: {connected}")
-
-        # Start receiving notifications from the ESP32
-        await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
-
-        # Initialize the data.sto file with a header to store quertanion values
-        with open(STO_FILENAME, 'w') as file:
-            
-            # Header with time and the 5 IMUs placed at pelvis, right femur, right tibia, left femur, left tibia
-            file.write(f"{FILE_HEADER}\ntime\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\tfemur_l_imu\ttibia_l_imu\n")
-
-        # Initialize the data_raw.txt file wit a header to store raw RPY values
-        with open(RAW_DATA_FILENAME, 'w') as file:
-            
-            # Header with time and the 5 IMUs placed at pelvis, right femur, right tibia, left femur, left tibia
-            file.write("time\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\tfemur_l_imu\ttibia_l_imu\n")
-            
-        # Keep the script running to listen for data
-        print("Waiting for notifications...")
-        await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
-
-        # Stop receiving notifications
-        await client.stop_notify(CHARACTERISTIC_UUID_TX)
+    global session_writer
+
+    # Header with time and the 5 IMUs placed at pelvis, right femur, right tibia, left femur, left tibia
+    columns = "time\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\tfemur_l_imu\ttibia_l_imu"
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    summary = SummaryReporter(SUMMARY_INTERVAL).start()
+    try:
+        # Quaternion values go to the .sto file, raw RPY values to the raw .txt file
+        # Both are opened before notifications start so no packet arrives ahead of its header
+        with SessionWriter([(STO_FILENAME, f"{FILE_HEADER}\n{columns}"), (RAW_DATA_FILENAME, columns)], format_rows, write_histogram=WRITE_SECONDS) as session_writer:
+            async with (ReplayClient(REPLAY_FILE, speed=REPLAY_SPEED) if REPLAY_FILE else ReconnectingClient(DEVICE_NAME, advertised_name=ADVERTISED_NAME, service_uuid=SERVICE_UUID, default_address=ESP32_MAC_ADDRESS)) as client:
+                # Check if the ESP32 is connected
+                connected = await client.is_connected()
+                print(f"Connected: {connected}")
+
+                # Start receiving notifications from the ESP32
+                await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+
+                # Keep the script running to listen for data
+                print("Waiting for notifications...")
+                await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
+
+                # Stop receiving notifications
+                await client.stop_notify(CHARACTERISTIC_UUID_TX)
+    finally:
+        summary.stop()
 
 # Run the asyncio loop
 if CAPTURE_NEW_DATA:
@@ -186,25 +176,15 @@ if CAPTURE_NEW_DATA:
 
 ################################### IMU PLACER CALIBRATION ##################################################
 
-if CAPTURE_NEW_DATA:
-    # Instantiate an IMUPlacer object
-    imuPlacer = osim.IMUPlacer()
-
-    # Set properties for the IMUPlacer
-    imuPlacer.set_model_file(modelFileName)
-    imuPlacer.set_orientation_file_for_calibration(STO_FILENAME)
-    imuPlacer.set_sensor_to_opensim_rotations(sensor_to_opensim_rotations)
-    imuPlacer.set_base_imu_label(baseIMUName)
-    imuPlacer.set_base_heading_axis(baseIMUHeading)
+# The calibrated model used for IK, the latest calibration unless a new capture is calibrated below
+calibratedModelFileName = outputCalibratedFileName
 
-    # Run the IMUPlacer
-    imuPlacer.run(visulizeCalibration)
-
-    # Get the model with the calibrated IMU
-    model = imuPlacer.getCalibratedModel()
-
-    # Print the calibrated model to file.
-    model.printToXML(outputCalibratedFileName)
+if CAPTURE_NEW_DATA:
+    # Run the IMUPlacer, or reuse the stored model if this setup was already calibrated (see calibration_cache.py)
+    # The result is also copied to calibrated_model.osim for the live scripts
+    calibratedModelFileName = calibrated_model(modelFileName, STO_FILENAME, sensor_to_opensim_rotations,
+                                               baseIMUName, baseIMUHeading, output_file=outputCalibratedFileName,
+                                               visualize=visulizeCalibration)
 
 ################################### INVERSE KINEMATICS ##################################################
 
@@ -230,7 +210,7 @@ if not CAPTURE_NEW_DATA:
 imuIK = osim.IMUInverseKinematicsTool()
  
 # Set tool properties
-imuIK.set_model_file(outputCalibratedFileName)
+imuIK.set_model_file(calibratedModelFileName)
 imuIK.set_orientations_file(STO_FILENAME)
 imuIK.set_sensor_to_opensim_rotations(sensor_to_opensim_rotation)
 imuIK.set_results_directory(resultsDirectory)
@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import glob
+import os
+import time
+
+from packet_decoder import KIND_RPY_F32, encode_binary, encode_text
+from reprocess_raw import load_raw_session
+
+FILEPATH = os.path.dirname(__file__)
+
+# Stand-in for BleakClient that replays a recorded data_raw_*.txt into a notification handler,
+# so the capture, ingestion and IK paths can run on any machine without the ESP32.
+#
+#   async with ReplayClient('data/data_raw_2024_11_07_19_01.txt', speed=4) as client:
+#       await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+#
+#   speed       1.0 = real time, N = N times faster, None = as fast as possible
+#   imus        how many IMU columns the device sends (the ESP32 sends pelvis, femur_r, tibia_r;
+#               the femur_l / tibia_l columns of the raw file are filled in by the host)
+#   frame_kind  None to send the comma separated text packets, or a packet_decoder KIND_* for binary frames
+#   disconnect_at_end  call disconnected_callback once the recording is exhausted
+class ReplayClient:
+    def __init__(self, filename, disconnected_callback=None, speed=1.0, imus=3, frame_kind=None,
+                 disconnect_at_end=False):
+        self.address = filename
+        self.disconnected_callback = disconnected_callback
+        self.speed = speed
+        self.disconnect_at_end = disconnect_at_end
+
+        _, times, rpy = load_raw_session(filename)
+        rows = rpy[:, :imus, :].reshape(len(times), 3 * imus).tolist()
+        if frame_kind is None:
+            self.packets = [encode_text(row) for row in rows]
+        else:
+            self.packets = [encode_binary(frame_kind, row) for row in rows]
+        self.times = (times - times[0]).tolist() if len(times) else []
+
+        self.packets_sent = 0
+        self._connected = False
+        self._task = None
+        self.finished = asyncio.Event()
+
+    async def connect(self):
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        await self._cancel()
+        self._connected = False
+        return True
+
+    async def is_connected(self):
+        return self._connected
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def start_notify(self, characteristic, callback):
+        await self._cancel()
+        self.finished.clear()
+        self._task = asyncio.ensure_future(self._replay(characteristic, callback))
+
+    async def stop_notify(self, characteristic):
+        await self._cancel()
+
+    async def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _replay(self, characteristic, callback):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for t, packet in zip(self.times, self.packets):
+            if self.speed is None:
+                await asyncio.sleep(0)
+            else:
+                delay = start + t / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # bleak hands handlers a fresh bytearray per notification
+            callback(characteristic, bytearray(packet))
+            self.packets_sent += 1
+
+        self.finished.set()
+        if self.disconnect_at_end:
+            self._connected = False
+            if self.disconnected_callback is not None:
+                self.disconnected_callback(self)
+
+# Client factory replaying several devices at once, e.g. for MultiDeviceIngest(client_factory=...)
+#   recordings  {address: data_raw_*.txt}
+def replay_factory(recordings, **options):
+    def factory(address, disconnected_callback=None):
+        return ReplayClient(recordings[address], disconnected_callback=disconnected_callback, **options)
+    return factory
+
+################################# LOAD TEST ################################################
+
+async def load_test(filenames, devices, speed, frame_kind):
+    counts = [0] * devices
+
+    def make_handler(i):
+        def handler(sender, data):
+            counts[i] += 1
+        return handler
+
+    recordings = []
+    for filename in filenames:
+        try:
+            load_raw_session(filename)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        recordings.append(filename)
+
+    clients = [ReplayClient(recordings[i % len(recordings)], speed=speed, frame_kind=frame_kind) for i in range(devices)]
+    start = time.perf_counter()
+    for i, client in enumerate(clients):
+        await client.connect()
+        await client.start_notify('replay', make_handler(i))
+    await asyncio.gather(*(client.finished.wait() for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.disconnect()
+    return sum(counts), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded sessions as fake BLE devices and report delivery rate')
+    parser.add_argument('raw_files', nargs='*', help='data_raw_*.txt files (default: every raw file in data/)')
+    parser.add_argument('--devices', type=int, default=1, help='number of devices replaying at once')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, N = N times faster, 0 = as fast as possible')
+    parser.add_argument('--binary', action='store_true', help='send float32 binary frames instead of text')
+    args = parser.parse_args()
+
+    filenames = args.raw_files or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_raw_*.txt')))
+    packets, elapsed = asyncio.run(load_test(filenames, args.devices, args.speed or None,
+                                             KIND_RPY_F32 if args.binary else None))
+    print(f"{packets} packets from {args.devices} device(s) in {elapsed:.2f}s ({packets / elapsed:,.0f} packets/s)")
+
+if __name__ == '__main__':
+    main()
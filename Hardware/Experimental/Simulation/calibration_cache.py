@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from math import pi
+
+# Content-addressed cache of IMUPlacer calibrated models.
+#
+# The calibrated model only depends on the input model, the calibration orientations (IMUPlacer reads the
+# first frame of the orientation file), sensor_to_opensim_rotations, the base IMU and its heading axis.
+# Those inputs are hashed into a key; a hit returns the stored model without running IMUPlacer, a miss
+# calibrates once and stores the result under models/calibration_cache/<key>.osim. Entries are kept in
+# least-recently-used order through their atime (set explicitly on every hit, so it works on noatime mounts)
+# and the oldest ones are evicted past max_entries. Parallel callers (batch_ik.py workers) pass max_entries=None
+# and the parent evicts once after the pool has finished, so no worker deletes a model another one is using.
+# The mtime stays the calibration time, which lets batch_ik.py tell whether an IK result is older than its model.
+# OpenSim finds the meshes in a Geometry folder next to the loaded .osim, so the cache directory links to the
+# input model's Geometry folder (a copy where symlinks are not allowed) and the visualizer still shows the body.
+
+FILEPATH = os.path.dirname(__file__)
+CACHE_DIRECTORY = os.path.join(FILEPATH, 'models', 'calibration_cache')
+MAX_ENTRIES = 128          # Above the number of recorded sessions, so a full batch run fits
+CALIBRATION_ROWS = 1        # IMUPlacer calibrates from the first orientation frame
+CACHE_VERSION = 1           # Bump to invalidate every entry, e.g. after an OpenSim upgrade
+
+# The IMU labels and the orientation rows used for calibration, without the time column
+def calibration_window(orientations_file, rows=CALIBRATION_ROWS):
+    window = []
+    with open(orientations_file) as file:
+        for line in file:
+            if line.strip() == 'endheader':
+                break
+        labels = next(file, '').strip().split('\t')[1:]
+        for line in file:
+            if len(window) == rows:
+                break
+            cells = line.strip().split('\t')
+            if len(cells) > 1:
+                window.append('\t'.join(cells[1:]))
+    if not window:
+        raise ValueError(f"{orientations_file}: no orientation rows to calibrate from")
+    return labels, window
+
+def calibration_key(model_file, orientations_file, sensor_to_opensim_rotations, base_imu, base_heading,
+                    rows=CALIBRATION_ROWS):
+    digest = hashlib.sha256()
+    digest.update(f'v{CACHE_VERSION}\n'.encode())
+    with open(model_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    labels, window = calibration_window(orientations_file, rows)
+    rotations = ','.join(f'{float(sensor_to_opensim_rotations[i]):.12g}' for i in range(3))
+    digest.update('\n'.join(['\t'.join(labels)] + window + [rotations, base_imu, base_heading]).encode())
+    return digest.hexdigest()[:24]
+
+# Mark a cached model as most recently used, keeping its mtime (the calibration time)
+def mark_used(cached):
+    os.utime(cached, (time.time(), os.path.getmtime(cached)))
+
+def evict(cache_directory=CACHE_DIRECTORY, max_entries=MAX_ENTRIES):
+    if not os.path.isdir(cache_directory):
+        return
+    entries = [os.path.join(cache_directory, f) for f in os.listdir(cache_directory) if f.endswith('.osim')]
+    entries.sort(key=os.path.getatime, reverse=True)
+    for stale in entries[max_entries:]:
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+# Give the models in cache_directory the meshes of model_file
+def link_geometry(model_file, cache_directory=CACHE_DIRECTORY):
+    source = os.path.join(os.path.dirname(os.path.abspath(model_file)), 'Geometry')
+    target = os.path.join(cache_directory, 'Geometry')
+    if not os.path.isdir(source) or os.path.lexists(target):
+        return
+    try:
+        os.symlink(os.path.relpath(source, cache_directory), target, target_is_directory=True)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copytree(source, target, dirs_exist_ok=True)
+
+# Path the calibrated model for these inputs is (or will be) stored at
+def cached_model_path(model_file, orientations_file, sensor_to_opensim_rotations, base_imu, base_heading,
+                      cache_directory=CACHE_DIRECTORY):
+    key = calibration_key(model_file, orientations_file, sensor_to_opensim_rotations, base_imu, base_heading)
+    return os.path.join(cache_directory, f'{key}.osim')
+
+# Return the path of the calibrated model for these inputs, running IMUPlacer only on a cache miss.
+# output_file, when given, also receives a copy (e.g. models/calibrated_model.osim for the live scripts).
+# max_entries=None skips eviction, for callers running in parallel that evict once when they are done.
+def calibrated_model(model_file, orientations_file, sensor_to_opensim_rotations, base_imu, base_heading,
+                     output_file=None, visualize=False, cache_directory=CACHE_DIRECTORY, max_entries=MAX_ENTRIES):
+    os.makedirs(cache_directory, exist_ok=True)
+    link_geometry(model_file, cache_directory)
+    cached = cached_model_path(model_file, orientations_file, sensor_to_opensim_rotations, base_imu, base_heading,
+                               cache_directory)
+
+    if os.path.exists(cached):
+        mark_used(cached)
+        print(f"Calibration cache hit: {os.path.basename(cached)}")
+    else:
+        import opensim as osim
+
+        print(f"Calibration cache miss, running IMUPlacer ({os.path.basename(orientations_file)})")
+        rotations = sensor_to_opensim_rotations
+        if not isinstance(rotations, osim.Vec3):
+            rotations = osim.Vec3(*[float(r) for r in rotations])
+
+        imuPlacer = osim.IMUPlacer()
+        imuPlacer.set_model_file(model_file)
+        imuPlacer.set_orientation_file_for_calibration(orientations_file)
+        imuPlacer.set_sensor_to_opensim_rotations(rotations)
+        imuPlacer.set_base_imu_label(base_imu)
+        imuPlacer.set_base_heading_axis(base_heading)
+        imuPlacer.run(visualize)
+
+        # Write to a temporary name first so a concurrent run never reads a half written model, and link it in
+        # only if no concurrent run got there first, so a model's mtime never moves past an IK result made from it
+        partial = f'{cached}.{os.getpid()}.tmp'
+        imuPlacer.getCalibratedModel().printToXML(partial)
+        try:
+            os.link(partial, cached)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(partial)
+        if max_entries is not None:
+            evict(cache_directory, max_entries)
+
+    if output_file is not None:
+        shutil.copyfile(cached, output_file)
+    return cached
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate a model from an orientation file through the calibration cache')
+    parser.add_argument('orientations_file')
+    parser.add_argument('--model', default=os.path.join(FILEPATH, 'models', 'Rajagopal_2015.osim'))
+    parser.add_argument('--base-imu', default='pelvis_imu')
+    parser.add_argument('--heading', default='-z')
+    parser.add_argument('--output', help='also copy the calibrated model here')
+    args = parser.parse_args()
+
+    print(calibrated_model(args.model, args.orientations_file, (-pi/2, 0, 0), args.base_imu, args.heading,
+                           output_file=args.output))
+
+if __name__ == '__main__':
+    main()
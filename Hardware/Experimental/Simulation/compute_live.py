@@ -1,11 +1,16 @@
-import matplotlib.pyplot as plt
-import opensim as osim
-from bleak import BleakClient
 from datetime import datetime
 from math import pi
 import os, math, time
 import asyncio
 from pathlib import Path
+import numpy as np
+from packet_decoder import decode_rpy
+from knee_angle import KneeAngleStream
+from rep_detector import RepDetector, write_reps
+from ble_replay import ReplayClient
+from device_registry import ReconnectingClient
+from live_plot import LivePlot
+from metrics import PACKETS, PARSE_ERRORS, HANDLER_SECONDS, SummaryReporter, start_http_server
 
 
 ################################# VARIABLE SETUP ################################################
@@ -13,18 +18,29 @@ FILEPATH = os.path.dirname(__file__)
 BLE_DURATION_SECONDS = 20
 CAPTURE_NEW_DATA = True # False if you want to visualize the latest motion captured
 RECALIBRATE = False
+PLOT_ANGLES = True  # False for capture-only runs: matplotlib is never imported and nothing is plotted
+LIVE_PLOT = False   # Redraw the angle while capturing (see live_plot.py)
 
 ### BLUETOOTH VARIABLES ###
+# Seeds the device registry on the first run, afterwards the cached address in devices.json is used
 ESP32_MAC_ADDRESS = "65DAA853-64CB-A387-AEE5-CDF0A60B786C"
 ESP32_MAC_ADDRESS = "14:2B:2F:AF:81:96"
 ESP32_MAC_ADDRESS = "14:2B:2F:AE:BC:86"
 SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
 CHARACTERISTIC_UUID_TX = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+REPLAY_FILE = None  # Path to a data_raw_*.txt to replay through ble_replay.ReplayClient instead of connecting to the ESP32
+REPLAY_SPEED = 1.0  # 1 = real time, N = N times faster, None = as fast as possible
+DEVICE_NAME = 'esp32'   # Name in the device registry and label in the metrics
+ADVERTISED_NAME = 'ESP32_IMU_BLE'   # Name prefix scanned for when the registry has no working address (see device_registry.py)
+METRICS_PORT = 9100     # Prometheus metrics at http://localhost:9100/metrics, None to disable
+SUMMARY_INTERVAL = 5    # Seconds between the one-line pipeline summaries
 FILENAME_SUFFIX = datetime.today().strftime('%Y_%m_%d_%H_%M')
 FILE_HEADER = '''DataType=Quaternion
 endheader'''
 STO_FILENAME = os.path.join(FILEPATH, 'data', f'data_{FILENAME_SUFFIX}.sto')
 RAW_DATA_FILENAME = os.path.join(FILEPATH, 'data', f'data_raw_{FILENAME_SUFFIX}.txt')
+ANGLES_FILENAME = os.path.join(FILEPATH, 'data', f'angles_{FILENAME_SUFFIX}.txt')
+REPS_FILENAME = os.path.join(FILEPATH, 'data', f'reps_{FILENAME_SUFFIX}.json')
 ### SIMULATION FILE PATH VARIABLES ###
 modelFileName = os.path.join(FILEPATH, 'models','Rajagopal_2015.osim')          # The path to an input model
 outputCalibratedFileName = os.path.join(FILEPATH, 'models', 'calibrated_model.osim')
@@ -32,32 +48,19 @@ resultsDirectory = os.path.join(FILEPATH, 'IK_results')
 MOT_FILENAME = os.path.join(resultsDirectory, f'ik_data_{FILENAME_SUFFIX}.mot')
 timestamp = time.time()
 ### CALIBRATION VARIABLES ###
-sensor_to_opensim_rotations = osim.Vec3(-pi/2, 0, 0)# The rotation of IMU data to the OpenSim world frame
+sensor_to_opensim_rotations = (-pi/2, 0, 0)# The rotation of IMU data to the OpenSim world frame
 baseIMUName = 'pelvis_imu'                     # The base IMU is the IMU on the base body of the model that dictates the heading (forward) direction of the model.
 baseIMUHeading = '-z'                           # The Coordinate Axis of the base IMU that points in the heading direction. 
 visulizeCalibration = False                     # Boolean to Visualize the Output model
 
 ### INVERSE KINEMATICS VARIABLES ###
-sensor_to_opensim_rotation = osim.Vec3(-pi/2, 0, 0) # The rotation of IMU data to the OpenSim world frame
+sensor_to_opensim_rotation = (-pi/2, 0, 0) # The rotation of IMU data to the OpenSim world frame
 visualizeTracking = True  # Boolean to Visualize the tracking simulation
 startTime = 0           # Start time (in seconds) of the tracking simulation. 
 endTime = 1000              # End time (in seconds) of the tracking simulation.
 
 ################################# BLUETOOTH DATA ACQUISITION ################################################
 
-imuIK = osim.IMUInverseKinematicsTool()
- 
-# Set tool properties
-imuIK.set_model_file(outputCalibratedFileName)
-imuIK.set_sensor_to_opensim_rotations(sensor_to_opensim_rotation)
-imuIK.set_results_directory(resultsDirectory)
-
-# Set time range in seconds
-imuIK.set_time_range(0, startTime) 
-imuIK.set_time_range(1, endTime)   
-
-model = osim.Model(outputCalibratedFileName)
-
 relevant_coords = set([
     # 'hip_flexion_r',
     # 'hip_adduction_r',
@@ -71,91 +74,112 @@ relevant_coords = set([
     # 'knee_angle_l_beta'
 ])
 
-tibia0, femur0 = 6, 11
-angles = []
 timestamp0 = None
-counter = 0
 AVG_CALIBRATION = 10
-avgtibia = []
-avgfemur = []
-# Callback function to handle incoming data from ESP32
-def notification_handler(sender, data):
-    try:
-        # Decode incoming data (need to add encoding on ESP32 side)
-        decoded_data = data.decode('utf-8').strip()
-
-        # Split the incoming data by comma
-        values = decoded_data.split(',')
-        
-        global timestamp0, counter, femur0, tibia0
-        
-        femur, tibia = 0, 0
-        
-        # Iterate through each IMU set of data
-        for i in range(0, len(values), 3):        
-            roll = float(values[i])
-            pitch = float(values[i + 1])        
-            
-            if i == 3:
-                femur = pitch
-            if i == 6:
-                tibia = pitch
-            if i > 0:
-                print(f'{"femur" if i == 3 else "tibia"}: {roll}, {pitch}')
-                
-        if counter < AVG_CALIBRATION:
-            if counter == 0:
-                print('Calibrating, please stand still')
-            avgfemur.append(femur)
-            avgtibia.append(tibia)
-            counter += 1
-        elif counter == AVG_CALIBRATION:
-            tibia0 = sum(avgtibia) / len(avgtibia)
-            femur0 = sum(avgfemur) / len(avgfemur)
-            counter += 1
-        else:
-            print(f'tibia0: {tibia0}; femur0: {femur0}')
-            ang = (femur0 - femur) - (tibia0 - tibia)      
-            print(f'computed angle: {ang}')
-            angles.append((time.time() - timestamp0, ang))
-
-    except ValueError as e:
-        print(f"Error parsing data: {data}. Error: {e}")
-
-async def run():
-    async with BleakClient(ESP32_MAC_ADDRESS) as client:
-        connected = await client.is_connected()
-        print(f"Connected: {connected}")
-        global timestamp0
-        timestamp0 = time.time()
+ANGLE_BUFFER = 4096     # Most recent angles kept in memory for the plot, older ones only live in ANGLES_FILENAME
+TARGET_ANGLE = 60       # Today's target flexion from the treatment plan, in degrees
+HOLD_TIME = 2           # Seconds to hold at the target
 
-        await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+# Append a chunk of computed angles to the angles file
+def store_angles(times, angles):
+    with open(ANGLES_FILENAME, 'a') as file:
+        np.savetxt(file, np.column_stack((times, angles)), fmt='%.5f', delimiter='\t')
 
-        await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
+# One line per finished repetition
+def print_rep(rep):
+    print(f"Rep {rep.index}: peak {rep.peak_angle:.1f} deg, held {rep.hold_seconds:.1f}s, "
+          f"{rep.duration:.1f}s{' (on target)' if rep.on_target else ''}")
 
-        await client.stop_notify(CHARACTERISTIC_UUID_TX)
+knee_stream = KneeAngleStream(AVG_CALIBRATION, capacity=ANGLE_BUFFER, on_flush=store_angles)
+rep_detector = RepDetector(TARGET_ANGLE, HOLD_TIME, on_rep=print_rep)
+live_plot = LivePlot() if LIVE_PLOT else None
 
-# Run the loop
-asyncio.run(run())
-
-
-# Separate the tuples into two lists: time and value
-time, value = zip(*angles)
-
-# Create the plot
-plt.figure(figsize=(8, 5))
-plt.plot(time, value, marker='o', linestyle='-', label='Angle over Time')
+# Callback function to handle incoming data from ESP32
+def notification_handler(sender, data):
+    PACKETS.inc(device=DEVICE_NAME)
+    with HANDLER_SECONDS.time():
+        try:
+            # Decode incoming data (comma separated text or a binary frame, see packet_decoder.py)
+            values = decode_rpy(data)
 
-# Add labels and title
-plt.xlabel('Time')
-plt.ylabel('Angle')
-plt.title('Time vs. Angle Plot')
+            femur, tibia = 0, 0
 
-# Add a legend
-plt.legend()
+            # Iterate through each IMU set of data
+            for i in range(0, len(values), 3):
+                pitch = values[i + 1]
 
-# Show the plot
-plt.grid(True)
-plt.show()
+                if i == 3:
+                    femur = pitch
+                if i == 6:
+                    tibia = pitch
 
+            if knee_stream.calibration_count == 0:
+                print('Calibrating, please stand still')
+            t = time.time() - timestamp0
+            ang = knee_stream.update(t, femur, tibia)
+            if ang is not None:
+                rep_detector.update(t, ang)
+                if len(knee_stream) == 1:
+                    print(f'Calibrated, tibia0: {knee_stream.tibia0}; femur0: {knee_stream.femur0}')
+                if live_plot is not None:
+                    live_plot.push(t, ang)
+
+        except ValueError as e:
+            PARSE_ERRORS.inc(device=DEVICE_NAME)
+            print(f"Error parsing data: {data}. Error: {e}")
+
+# Plot the knee angle over time, matplotlib is only imported when a plot is requested
+def plot_angles(time, value):
+    import matplotlib.pyplot as plt
+
+    # Create the plot
+    plt.figure(figsize=(8, 5))
+    plt.plot(time, value, marker='o', linestyle='-', label='Angle over Time')
+
+    # Add labels and title
+    plt.xlabel('Time')
+    plt.ylabel('Angle')
+    plt.title('Time vs. Angle Plot')
+
+    # Add a legend
+    plt.legend()
+
+    # Show the plot
+    plt.grid(True)
+    plt.show()
 
+async def run():
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    summary = SummaryReporter(SUMMARY_INTERVAL).start()
+    try:
+        async with (ReplayClient(REPLAY_FILE, speed=REPLAY_SPEED) if REPLAY_FILE else ReconnectingClient(DEVICE_NAME, advertised_name=ADVERTISED_NAME, service_uuid=SERVICE_UUID, default_address=ESP32_MAC_ADDRESS)) as client:
+            connected = await client.is_connected()
+            print(f"Connected: {connected}")
+            global timestamp0
+            timestamp0 = time.time()
+
+            await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+
+            await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
+
+            await client.stop_notify(CHARACTERISTIC_UUID_TX)
+    finally:
+        summary.stop()
+
+with open(ANGLES_FILENAME, 'w') as file:
+    file.write('time\tknee_angle\n')
+
+# Run the loop, with the live plot rendering on this thread while it runs
+if live_plot is not None:
+    live_plot.run(run())
+else:
+    asyncio.run(run())
+knee_stream.flush()
+rep_detector.finish()
+write_reps(REPS_FILENAME, rep_detector, f'data_{FILENAME_SUFFIX}')
+print(f"Session: {rep_detector.summary()}")
+
+if PLOT_ANGLES and len(knee_stream):
+    # The buffered angles, the whole session is in ANGLES_FILENAME
+    plot_angles(*knee_stream.recent())
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from functools import partial
+
+# Persistent map from IMU module names (esp32, femur, tibia, ...) to their BLE addresses.
+#
+# Connecting from a cached address skips scanning entirely. Only on a miss (unknown name, or the cached address
+# keeps failing, e.g. macOS handed out a new UUID) a scan runs, filtered on the advertised name prefix or service
+# UUID so it returns as soon as the module shows up instead of waiting out a full BleakScanner.discover().
+# The address found replaces the cached one for the next session; a scan that finds nothing leaves it in place.
+#
+#   registry = DeviceRegistry()
+#   registry.set('femur', '14:2B:2F:AE:BC:86', advertised_name='ESP32_IMU_BLE_1')
+#   async with ReconnectingClient('femur', registry) as client:
+#       await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+#
+#   python device_registry.py scan                 # list the IMU modules in range
+#   python device_registry.py add femur ESP32_IMU_BLE_1
+#   python device_registry.py list
+
+FILEPATH = os.path.dirname(__file__)
+REGISTRY_FILE = os.path.join(FILEPATH, 'devices.json')
+ADVERTISED_PREFIX = 'ESP32_IMU_BLE'     # Every module advertises ESP32_IMU_BLE or ESP32_IMU_BLE_<n>
+SCAN_TIMEOUT = 10.0         # Seconds a filtered scan waits for the module to advertise
+CONNECT_TIMEOUT = 5.0       # Seconds before a connection attempt from the cache is given up
+CACHED_ATTEMPTS = 3         # Tries of the cached address (with backoff) before scanning for a new one
+RECONNECT_DELAY = 0.5       # First retry delay after a failed reconnect, doubled up to MAX_RECONNECT_DELAY
+MAX_RECONNECT_DELAY = 8.0
+
+# Find one advertising device, returns (address, advertised name) or None
+#   advertised_name  name or name prefix to match (ESP32_IMU_BLE matches ESP32_IMU_BLE_1), service_uuid  service
+#                    the device advertises
+async def find_device(advertised_name=None, service_uuid=None, timeout=SCAN_TIMEOUT):
+    from bleak import BleakScanner
+
+    def match(device, advertisement):
+        names = (device.name or '', advertisement.local_name or '')
+        if advertised_name is not None and any(name.startswith(advertised_name) for name in names):
+            return True
+        if service_uuid is not None:
+            return service_uuid.lower() in [uuid.lower() for uuid in advertisement.service_uuids]
+        return False
+
+    device = await BleakScanner.find_device_by_filter(match, timeout=timeout)
+    if device is None:
+        return None
+    return device.address, device.name
+
+class DeviceRegistry:
+    def __init__(self, filename=REGISTRY_FILE, scan_timeout=SCAN_TIMEOUT):
+        self.filename = filename
+        self.scan_timeout = scan_timeout
+        self.devices = {}
+        if os.path.exists(filename):
+            with open(filename) as file:
+                self.devices = json.load(file)
+
+    def save(self):
+        # Write then rename, so an interrupted save never leaves a truncated registry
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.devices, file, indent=2, sort_keys=True)
+        os.replace(temporary, self.filename)
+
+    def get(self, name):
+        entry = self.devices.get(name)
+        return entry.get('address') if entry else None
+
+    def set(self, name, address, advertised_name=None, service_uuid=None):
+        entry = self.devices.setdefault(name, {})
+        entry['address'] = address
+        if advertised_name is not None:
+            entry['advertised_name'] = advertised_name
+        if service_uuid is not None:
+            entry['service_uuid'] = service_uuid
+        self.save()
+
+    # Drop the cached address but keep what the module advertises, so the next resolve scans for it
+    def invalidate(self, name):
+        entry = self.devices.get(name)
+        if entry and entry.pop('address', None) is not None:
+            self.save()
+
+    def forget(self, name):
+        if self.devices.pop(name, None) is not None:
+            self.save()
+
+    def mark_connected(self, name):
+        entry = self.devices.get(name)
+        if entry is not None:
+            entry['last_connected'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.save()
+
+    # Address of name: from the cache unless refresh, otherwise from a filtered scan (LookupError if not found,
+    # the cached address is kept)
+    #   default  address to use and cache when the registry has no address for name, e.g. a script's ESP32_MAC_ADDRESS
+    async def resolve(self, name, refresh=False, advertised_name=None, service_uuid=None, default=None):
+        entry = self.devices.get(name, {})
+        if not refresh:
+            if entry.get('address'):
+                return entry['address']
+            if default is not None:
+                self.set(name, default, advertised_name, service_uuid)
+                return default
+
+        advertised_name = advertised_name or entry.get('advertised_name')
+        service_uuid = service_uuid or entry.get('service_uuid')
+        if advertised_name is None and service_uuid is None:
+            raise LookupError(f"{name}: no cached address and no advertised name or service UUID to scan for")
+        found = await find_device(advertised_name, service_uuid, self.scan_timeout)
+        if found is None:
+            raise LookupError(f"{name}: not found advertising as {advertised_name or service_uuid} within {self.scan_timeout:.0f}s")
+        self.set(name, found[0], advertised_name, service_uuid)
+        return found[0]
+
+# BleakClient stand-in that connects through the registry and keeps reconnecting while the session is open.
+#
+# The cached address is tried CACHED_ATTEMPTS times with backoff, so a brief range drop does not cost a scan;
+# only then is the address re-resolved with a filtered scan and the address found tried once. The cached address
+# is only replaced when the scan finds the module. After a drop, reconnecting starts immediately and backs off (RECONNECT_DELAY doubling up to
+# MAX_RECONNECT_DELAY) until the link is back or disconnect() is called; notifications started with start_notify
+# are re-subscribed automatically, so the caller's handler simply sees a gap in the data.
+#
+#   client_factory  BleakClient or a drop-in taking (address, disconnected_callback=...), see ble_replay.py
+class ReconnectingClient:
+    def __init__(self, name, registry=None, advertised_name=None, service_uuid=None, default_address=None,
+                 client_factory=None, connect_timeout=CONNECT_TIMEOUT, reconnect_delay=RECONNECT_DELAY,
+                 max_reconnect_delay=MAX_RECONNECT_DELAY, cached_attempts=CACHED_ATTEMPTS):
+        if client_factory is None:
+            from bleak import BleakClient
+            client_factory = partial(BleakClient, timeout=connect_timeout)
+        self.name = name
+        self.registry = registry if registry is not None else DeviceRegistry()
+        self.advertised_name = advertised_name
+        self.service_uuid = service_uuid
+        self.default_address = default_address
+        self.client_factory = client_factory
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.cached_attempts = cached_attempts
+
+        self.address = None
+        self.connect_seconds = None     # How long the first connection took, scan included
+        self.reconnects = 0
+        self.gap_seconds = 0.0          # Total time spent disconnected while the session was open
+
+        self._client = None
+        self._connected = False
+        self._closing = False
+        self._notify = {}
+        self._reconnect_task = None
+        self._loop = None
+
+    async def _open(self, address):
+        client = self.client_factory(address, disconnected_callback=self._on_disconnect)
+        await client.connect()
+        self._client = client
+        self.address = address
+        self._connected = True
+        for characteristic, callback in self._notify.items():
+            await client.start_notify(characteristic, callback)
+
+    # Cached address first, retried with backoff, then a fresh scan
+    async def _connect_once(self):
+        resolve = partial(self.registry.resolve, self.name, advertised_name=self.advertised_name,
+                          service_uuid=self.service_uuid, default=self.default_address)
+        address = await resolve()
+        delay = self.reconnect_delay
+        for attempt in range(1, self.cached_attempts + 1):
+            try:
+                await self._open(address)
+                break
+            except Exception as e:
+                print(f"{self.name}: {address} did not connect ({e}), attempt {attempt} of {self.cached_attempts}")
+            if attempt < self.cached_attempts:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        else:
+            print(f"{self.name}: scanning")
+            rescanned = await resolve(refresh=True)
+            await self._open(rescanned)
+        self.registry.mark_connected(self.name)
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        self._closing = False
+        start = time.perf_counter()
+        await self._connect_once()
+        self.connect_seconds = time.perf_counter() - start
+        print(f"{self.name} connected ({self.address}) in {self.connect_seconds:.2f}s")
+        return True
+
+    # Called by the BLE stack, possibly from another thread
+    def _on_disconnect(self, client):
+        if self._closing or client is not self._client:
+            return
+        self._loop.call_soon_threadsafe(self._start_reconnect)
+
+    def _start_reconnect(self):
+        if self._closing or not self._connected:
+            return
+        self._connected = False
+        self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        lost = time.perf_counter()
+        delay = self.reconnect_delay
+        print(f"{self.name} disconnected, reconnecting")
+        while not self._closing:
+            try:
+                await self._connect_once()
+            except Exception as e:
+                print(f"{self.name}: reconnect failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            gap = time.perf_counter() - lost
+            self.reconnects += 1
+            self.gap_seconds += gap
+            print(f"{self.name} reconnected ({self.address}) after {gap:.2f}s")
+            return
+
+    async def disconnect(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            try:
+                await self._reconnect_task
+            except asyncio.CancelledError:
+                pass
+            self._reconnect_task = None
+        if self._client is not None:
+            await self._client.disconnect()
+        self._connected = False
+        return True
+
+    async def is_connected(self):
+        return self._connected
+
+    async def start_notify(self, characteristic, callback):
+        self._notify[characteristic] = callback
+        if self._connected:
+            await self._client.start_notify(characteristic, callback)
+
+    async def stop_notify(self, characteristic):
+        self._notify.pop(characteristic, None)
+        if self._connected:
+            await self._client.stop_notify(characteristic)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+async def scan(timeout):
+    from bleak import BleakScanner
+
+    devices = await BleakScanner.discover(timeout=timeout)
+    for device in devices:
+        if device.name and device.name.startswith(ADVERTISED_PREFIX):
+            print(f"{device.name}\t{device.address}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the cached BLE addresses of the IMU modules')
+    parser.add_argument('--registry', default=REGISTRY_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show the cached devices')
+    scan_command = commands.add_parser('scan', help=f'list the {ADVERTISED_PREFIX}* modules in range')
+    scan_command.add_argument('--timeout', type=float, default=5.0)
+    add = commands.add_parser('add', help='register a module by advertised name, scanning for its address')
+    add.add_argument('name', help='e.g. femur, tibia, esp32')
+    add.add_argument('advertised_name', help='e.g. ESP32_IMU_BLE_1')
+    add.add_argument('--address', help='skip the scan and cache this address')
+    forget = commands.add_parser('forget', help='remove a module')
+    forget.add_argument('name')
+    args = parser.parse_args()
+
+    registry = DeviceRegistry(args.registry)
+    if args.command == 'list':
+        for name, entry in sorted(registry.devices.items()):
+            print(f"{name}\t{entry.get('address', '-')}\t{entry.get('advertised_name', '-')}\t{entry.get('last_connected', 'never')}")
+    elif args.command == 'scan':
+        asyncio.run(scan(args.timeout))
+    elif args.command == 'add':
+        if args.address:
+            registry.set(args.name, args.address, args.advertised_name)
+        else:
+            registry.devices.setdefault(args.name, {})['advertised_name'] = args.advertised_name
+            address = asyncio.run(registry.resolve(args.name, refresh=True))
+            print(f"{args.name}: {address}")
+    else:
+        registry.forget(args.name)
+
+if __name__ == '__main__':
+    main()
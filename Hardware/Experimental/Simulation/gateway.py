@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+from packet_decoder import decode_rpy
+from ble_replay import ReplayClient
+from device_registry import DeviceRegistry, ReconnectingClient
+from orientation import rpy_to_quaternion
+from session_writer import SessionWriter
+from knee_angle import KneeAngleStream
+from rep_detector import HOLD_TIME, TARGET_ANGLE, RepDetector, write_reps
+from metrics import PACKETS, PARSE_ERRORS, HANDLER_SECONDS, WRITE_SECONDS, SummaryReporter, start_http_server
+
+# Gateway running many independent capture sessions in one event loop.
+#
+# Everything ble_receive_convert.py and compute_live.py keep in module globals (the start time, the left leg
+# copied from the first sample, the calibration, the angles) lives in one CaptureSession per patient, with its
+# own SessionWriter and files, so sessions never share state and can be started and stopped while others run.
+#
+#   gateway = Gateway('data/gateway')
+#   await gateway.start_session('patient_3', device='femur')              # through the device registry
+#   await gateway.start_session('replay_1', replay='data/data_raw_2024_11_07_19_01.txt', speed=4)
+#   summary = await gateway.stop_session('patient_3')
+#
+#   python gateway.py                                   # then type: start <id> <device> | replay <id> <file> [speed]
+#   python gateway.py --replay data/data_raw_2024_11_07_19_01.txt --sessions 8    #     | stop <id> | list | quit
+
+FILEPATH = os.path.dirname(__file__)
+OUTPUT_DIRECTORY = os.path.join(FILEPATH, 'data', 'gateway')
+CHARACTERISTIC_UUID_TX = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+FILE_HEADER = '''DataType=Quaternion
+endheader'''
+COLUMNS = "time\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\tfemur_l_imu\ttibia_l_imu"
+CALIBRATION_SAMPLES = 10
+METRICS_PORT = 9100     # Prometheus metrics at http://localhost:9100/metrics, None to disable
+SUMMARY_INTERVAL = 5    # Seconds between the one-line pipeline summaries
+
+class CaptureSession:
+    def __init__(self, session_id, client, output_directory=OUTPUT_DIRECTORY, calibration_samples=CALIBRATION_SAMPLES,
+                 target_angle=TARGET_ANGLE, hold_time=HOLD_TIME):
+        self.session_id = session_id
+        self.client = client
+        suffix = datetime.today().strftime('%Y_%m_%d_%H_%M')
+        base = os.path.join(output_directory, f'{session_id}_{suffix}')
+        self.sto_filename = f'{base}.sto'
+        self.raw_filename = f'{base}_raw.txt'
+        self.reps_filename = f'{base}_reps.json'
+
+        self.t0 = None
+        self.started = None
+        self.packets = 0
+        self.parse_errors = 0
+        self.knee = KneeAngleStream(calibration_samples)
+        self.reps = RepDetector(target_angle, hold_time)
+        self.writer = SessionWriter([(self.sto_filename, f"{FILE_HEADER}\n{COLUMNS}"), (self.raw_filename, COLUMNS)],
+                                    self.format_rows, write_histogram=WRITE_SECONDS)
+        # femur_l / tibia_l columns, copied from the first sample's right leg (only touched on the writer thread)
+        self._left_quaternions = None
+        self._left_rpy = None
+
+    # One notification to its .sto and raw lines, on the writer thread
+    def format_rows(self, timestamp, values):
+        line = [f"{timestamp:.3f}"]
+        line_raw = [f"{timestamp:.3f}"]
+        quaternions = []
+        for i in range(0, len(values), 3):
+            roll, pitch, yaw = values[i], values[i + 1], values[i + 2]
+            q = rpy_to_quaternion(roll, pitch, yaw)
+            quaternions.append(q)
+            line.append(f"\t{q[0]:.6f},{q[1]:.6f},{q[2]:.6f},{q[3]:.6f}")
+            line_raw.append(f"\t{roll:.6f},{pitch:.6f},{yaw:.6f}")
+
+        if self._left_quaternions is None:
+            self._left_quaternions = quaternions[1:3]
+            self._left_rpy = [values[3:6], values[6:9]]
+        for q, rpy in zip(self._left_quaternions, self._left_rpy):
+            line.append(f"\t{q[0]:.6f},{q[1]:.6f},{q[2]:.6f},{q[3]:.6f}")
+            line_raw.append(f"\t{rpy[0]:.6f},{rpy[1]:.6f},{rpy[2]:.6f}")
+        line.append("\n")
+        line_raw.append("\n")
+        return ''.join(line), ''.join(line_raw)
+
+    # BLE callback: decode, timestamp, hand the row to the writer and update the knee angle and reps
+    def notification_handler(self, sender, data):
+        self.packets += 1
+        PACKETS.inc(device=self.session_id)
+        with HANDLER_SECONDS.time():
+            try:
+                values = decode_rpy(data)
+            except ValueError as e:
+                self.parse_errors += 1
+                PARSE_ERRORS.inc(device=self.session_id)
+                print(f"{self.session_id}: error parsing data: {data}. Error: {e}")
+                return
+            if len(values) != 9:
+                self.parse_errors += 1
+                PARSE_ERRORS.inc(device=self.session_id)
+                return
+
+            now = time.time()
+            if self.t0 is None:
+                self.t0 = now
+            t = now - self.t0
+            self.writer.enqueue(t, values)
+            angle = self.knee.update(t, values[4], values[7])
+            if angle is not None:
+                self.reps.update(t, angle)
+
+    async def start(self):
+        self.writer.start()
+        try:
+            await self.client.connect()
+            await self.client.start_notify(CHARACTERISTIC_UUID_TX, self.notification_handler)
+        except Exception:
+            self.writer.close()
+            raise
+        self.started = time.perf_counter()
+
+    async def stop(self):
+        try:
+            if await self.client.is_connected():
+                await self.client.stop_notify(CHARACTERISTIC_UUID_TX)
+            await self.client.disconnect()
+        finally:
+            self.writer.close()
+        self.reps.finish()
+        write_reps(self.reps_filename, self.reps, self.session_id)
+        return self.status()
+
+    def status(self):
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        return {'session': self.session_id, 'packets': self.packets, 'parse_errors': self.parse_errors,
+                'rows_written': self.writer.rows_written, 'seconds': round(elapsed, 2),
+                'calibrating': self.knee.calibrating, 'angle': self.knee.angle, **self.reps.summary()}
+
+class Gateway:
+    def __init__(self, output_directory=OUTPUT_DIRECTORY, registry=None, **session_options):
+        self.output_directory = output_directory
+        self.registry = registry
+        self.session_options = session_options
+        self.sessions = {}
+        self._watchers = {}
+        os.makedirs(output_directory, exist_ok=True)
+
+    # Start a session from a registered device, or replaying a data_raw_*.txt (stopped when it runs out)
+    async def start_session(self, session_id, device=None, replay=None, speed=1.0, client=None):
+        if session_id in self.sessions:
+            raise ValueError(f"session {session_id} is already running")
+        if client is None:
+            if replay is not None:
+                client = ReplayClient(replay, speed=speed)
+            elif device is not None:
+                if self.registry is None:
+                    self.registry = DeviceRegistry()
+                client = ReconnectingClient(device, self.registry)
+            else:
+                raise ValueError(f"session {session_id}: needs a device or a replay file")
+        session = CaptureSession(session_id, client, self.output_directory, **self.session_options)
+        await session.start()
+        self.sessions[session_id] = session
+        if isinstance(client, ReplayClient):
+            self._watchers[session_id] = asyncio.ensure_future(self._stop_when_finished(session_id, client))
+        return session
+
+    # Runs as a task nobody awaits, so a failed stop is printed here and the session is dropped either way
+    async def _stop_when_finished(self, session_id, client):
+        await client.finished.wait()
+        self._watchers.pop(session_id, None)
+        try:
+            summary = await self.stop_session(session_id)
+        except Exception as e:
+            print(f"{session_id} finished, stopping it failed: {e}")
+        else:
+            print(f"{session_id} finished: {summary}")
+        finally:
+            self.sessions.pop(session_id, None)
+
+    async def stop_session(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise ValueError(f"no session {session_id}")
+        watcher = self._watchers.pop(session_id, None)
+        if watcher is not None:
+            watcher.cancel()
+        return await session.stop()
+
+    async def stop_all(self):
+        return [await self.stop_session(session_id) for session_id in list(self.sessions)]
+
+    # Wait until every session has stopped (e.g. all replays ran out)
+    async def wait_idle(self, poll=0.1):
+        while self.sessions:
+            await asyncio.sleep(poll)
+
+################################# CONTROL ################################################
+
+async def handle_command(gateway, line):
+    words = line.split()
+    if not words:
+        return True
+    command, arguments = words[0], words[1:]
+    try:
+        if command == 'start' and len(arguments) == 2:
+            await gateway.start_session(arguments[0], device=arguments[1])
+            print(f"{arguments[0]} started")
+        elif command == 'replay' and len(arguments) in (2, 3):
+            speed = float(arguments[2]) if len(arguments) == 3 else 1.0
+            await gateway.start_session(arguments[0], replay=arguments[1], speed=speed)
+            print(f"{arguments[0]} started")
+        elif command == 'stop' and len(arguments) == 1:
+            print(await gateway.stop_session(arguments[0]))
+        elif command == 'list':
+            for session in gateway.sessions.values():
+                print(session.status())
+            if not gateway.sessions:
+                print("no sessions running")
+        elif command == 'quit':
+            return False
+        else:
+            print("commands: start <id> <device> | replay <id> <file> [speed] | stop <id> | list | quit")
+    except Exception as e:
+        print(f"{command} failed: {e}")
+    return True
+
+async def run(replay_files, sessions, speed):
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    summary = SummaryReporter(SUMMARY_INTERVAL).start()
+    try:
+        gateway = Gateway()
+        for i in range(sessions if replay_files else 0):
+            await gateway.start_session(f'replay_{i + 1}', replay=replay_files[i % len(replay_files)], speed=speed)
+
+        loop = asyncio.get_running_loop()
+        if replay_files and not sys.stdin.isatty():
+            await gateway.wait_idle()
+        else:
+            while await handle_command(gateway, await loop.run_in_executor(None, sys.stdin.readline) or 'quit'):
+                pass
+        for result in await gateway.stop_all():
+            print(result)
+    finally:
+        summary.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many capture sessions in one process, controlled from stdin')
+    parser.add_argument('--replay', nargs='*', default=[], help='data_raw_*.txt files to start replay sessions from')
+    parser.add_argument('--sessions', type=int, default=1, help='replay sessions to start (cycling through --replay)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 1 = real time')
+    args = parser.parse_args()
+    asyncio.run(run(args.replay, args.sessions, args.speed))
+
+if __name__ == '__main__':
+    main()
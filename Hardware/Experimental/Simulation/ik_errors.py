@@ -0,0 +1,116 @@
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from storage_loader import load_motion
+
+# Orientation-error analytics over every IK run.
+#
+# IMUInverseKinematicsTool writes ik_<session>_orientationErrors.sto next to each .mot: per frame and per IMU, the
+# angle in radians between the measured orientation and the model's sensor frame. Every file is loaded through the
+# storage_loader sidecar cache and summarized per IMU (mean, RMS, 95th percentile and max in degrees) across a
+# process pool, and sessions whose errors point to a bad calibration are flagged:
+#   initial   the error is already large on the first frames, which are the calibration pose IMUPlacer used
+#   offset    the error is large but nearly constant over the session, i.e. a fixed misalignment of the sensor
+#   tracking  the 95th percentile is large, IK does not follow the measured motion
+#
+#   python ik_errors.py                            # every IK_results/*_orientationErrors.sto
+#   python ik_errors.py --csv ik_errors.csv --flagged
+
+FILEPATH = os.path.dirname(__file__)
+RESULTS_DIRECTORY = os.path.join(FILEPATH, 'IK_results')
+ERROR_SUFFIX = '_orientationErrors.sto'
+INITIAL_FRAMES = 5          # Frames at the start that reflect the calibration pose
+INITIAL_LIMIT = 5.0         # Degrees of error on the calibration pose that flag the calibration
+OFFSET_LIMIT = 15.0         # Median error above which a steady error counts as a fixed offset, degrees
+OFFSET_SPREAD = 0.25        # ... steady meaning an interquartile range below this fraction of the median
+TRACKING_LIMIT = 30.0       # 95th percentile error that flags poor tracking, degrees
+COLUMNS = ('session', 'imu', 'frames', 'mean', 'rms', 'p95', 'max', 'initial', 'flags')
+
+def session_for(error_filename):
+    name = os.path.basename(error_filename)
+    return name[:-len(ERROR_SUFFIX)] if name.endswith(ERROR_SUFFIX) else os.path.splitext(name)[0]
+
+# Per-IMU statistics of one error file: a list of dicts with the COLUMNS keys
+def error_statistics(error_filename):
+    labels, times, errors = load_motion(error_filename)
+    session = session_for(error_filename)
+    if not len(times):
+        return [dict(session=session, imu=label, frames=0, mean=np.nan, rms=np.nan, p95=np.nan, max=np.nan,
+                     initial=np.nan, flags='empty') for label in labels]
+
+    degrees = np.degrees(np.asarray(errors, dtype=np.float64))
+    mean = degrees.mean(axis=0)
+    rms = np.sqrt((degrees ** 2).mean(axis=0))
+    q25, median, q75, p95 = np.percentile(degrees, [25, 50, 75, 95], axis=0)
+    peak = degrees.max(axis=0)
+    initial = degrees[:INITIAL_FRAMES].mean(axis=0)
+
+    flagged = {'initial': initial > INITIAL_LIMIT,
+               'offset': (median > OFFSET_LIMIT) & (q75 - q25 < OFFSET_SPREAD * median),
+               'tracking': p95 > TRACKING_LIMIT}
+    rows = []
+    for i, label in enumerate(labels):
+        flags = ','.join(flag for flag, mask in flagged.items() if mask[i])
+        rows.append(dict(session=session, imu=label, frames=len(times), mean=mean[i], rms=rms[i], p95=p95[i],
+                         max=peak[i], initial=initial[i], flags=flags))
+    return rows
+
+def _statistics_job(error_filename):
+    try:
+        return error_statistics(error_filename), None
+    except ValueError as e:
+        return None, e
+
+# Statistics of every file in parallel, in the order of error_filenames
+def collect(error_filenames, jobs=None):
+    rows = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result, error in executor.map(_statistics_job, error_filenames, chunksize=8):
+            if error is not None:
+                print(f"Skipping {error}")
+                continue
+            rows.extend(result)
+    return rows
+
+def print_table(rows):
+    width = max([len('session')] + [len(row['session']) for row in rows])
+    print(f"{'session':<{width}}  {'imu':<12}{'frames':>7}{'mean':>8}{'rms':>8}{'p95':>8}{'max':>8}{'initial':>9}  flags")
+    for row in rows:
+        print(f"{row['session']:<{width}}  {row['imu']:<12}{row['frames']:>7}{row['mean']:>8.2f}{row['rms']:>8.2f}"
+              f"{row['p95']:>8.2f}{row['max']:>8.2f}{row['initial']:>9.2f}  {row['flags']}")
+
+def write_csv(filename, rows):
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: f'{value:.4f}' if isinstance(value, float) else value for key, value in row.items()})
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize IK orientation errors per session and IMU, flagging bad calibrations')
+    parser.add_argument('files', nargs='*', help=f'*{ERROR_SUFFIX} files (default: every one in IK_results/)')
+    parser.add_argument('--csv', help='also write the table to this file')
+    parser.add_argument('--flagged', action='store_true', help='only print flagged rows')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(RESULTS_DIRECTORY, f'*{ERROR_SUFFIX}')))
+    start = time.perf_counter()
+    rows = collect(files, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    print_table([row for row in rows if row['flags']] if args.flagged else rows)
+    if args.csv:
+        write_csv(args.csv, rows)
+    sessions = {row['session'] for row in rows}
+    flagged = {row['session'] for row in rows if row['flags'] and row['flags'] != 'empty'}
+    print(f"{len(sessions)} sessions, {len(rows)} IMU rows in {elapsed:.2f}s, {len(flagged)} sessions flagged: "
+          f"{' '.join(sorted(flagged)) or '-'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import math
+import time
+from collections import deque
+import numpy as np
+import opensim as osim
+
+from orientation import quaternion_multiply, rpy_to_quaternion
+
+# Long-lived IMU inverse kinematics for the live path.
+#
+# IMUInverseKinematicsTool reloads the model, re-reads the orientation file and writes a .mot on every run,
+# so solving one packet at a time through it costs hundreds of milliseconds. IKSession loads the calibrated
+# model and builds the InverseKinematicsSolver once, takes orientation samples in memory through a
+# BufferedOrientationsReference (OpenSim >= 4.4) and tracks each frame from the previous solution.
+#
+#   session = IKSession(outputCalibratedFileName, ['pelvis_imu', 'femur_r_imu', 'tibia_r_imu'], relevant_coords)
+#   coords = session.solve(t, quats)      # quats: one (w, x, y, z) per IMU label
+#   coords['knee_angle_r']                # degrees for rotational coordinates, as in the .mot output
+
+# The quaternion of a SpaceRotationSequence X, Y, Z in radians, the convention IMUInverseKinematicsTool
+# uses for sensor_to_opensim_rotations (the same as roll, pitch, yaw)
+def space_xyz_quaternion(rx, ry, rz):
+    return rpy_to_quaternion(math.degrees(rx), math.degrees(ry), math.degrees(rz))
+
+class IKSession:
+    LATENCY_WINDOW = 1000
+
+    def __init__(self, model_file, imu_labels, coordinates, sensor_to_opensim_rotations=(-math.pi/2, 0, 0),
+                 accuracy=1e-4):
+        self.imu_labels = list(imu_labels)
+        self.accuracy = accuracy
+        rotation = [float(sensor_to_opensim_rotations[i]) for i in range(3)]
+        self._sensor_to_opensim = space_xyz_quaternion(*rotation)
+
+        self.model = osim.Model(model_file)
+        self._state = self.model.initSystem()
+
+        coordinate_set = self.model.getCoordinateSet()
+        self._coordinates = []
+        for name in coordinates:
+            coordinate = coordinate_set.get(name)
+            in_degrees = coordinate.getMotionType() == osim.Coordinate.Rotational
+            self._coordinates.append((name, coordinate, in_degrees))
+
+        self._orientations = None
+        self._solver = None
+
+        self.frames = 0
+        self.latencies = deque(maxlen=self.LATENCY_WINDOW)
+
+    # Rotate the sensor quaternions into the OpenSim world frame and pack them as one row of Rotations
+    def _rotation_row(self, quats):
+        rotated = quaternion_multiply(self._sensor_to_opensim, np.asarray(quats, dtype=np.float64))
+        row = osim.RowVectorRotation(len(self.imu_labels), osim.Rotation())
+        for j, (w, x, y, z) in enumerate(rotated.tolist()):
+            row[j] = osim.Rotation(osim.Quaternion(w, x, y, z))
+        return row
+
+    def _start(self, t, row):
+        labels = osim.StdVectorString()
+        for label in self.imu_labels:
+            labels.append(label)
+        table = osim.TimeSeriesTableRotation()
+        table.setColumnLabels(labels)
+        table.appendRow(t, row)
+
+        self._orientations = osim.BufferedOrientationsReference(table)
+        self._solver = osim.InverseKinematicsSolver(self.model, osim.MarkersReference(), self._orientations,
+                                                    osim.SimTKArrayCoordinateReference())
+        self._solver.setAccuracy(self.accuracy)
+
+        # Full assembly only for the first frame, every later frame is tracked from the last solution
+        self._state.setTime(t)
+        self._solver.assemble(self._state)
+
+    # Solve one frame and return {coordinate name: value}
+    def solve(self, t, quats):
+        start = time.perf_counter()
+        row = self._rotation_row(quats)
+        if self._solver is None:
+            self._start(t, row)
+        else:
+            self._orientations.putValues(t, row)
+            self._state.setTime(t)
+            self._solver.track(self._state)
+
+        coords = {}
+        for name, coordinate, in_degrees in self._coordinates:
+            value = coordinate.getValue(self._state)
+            coords[name] = math.degrees(value) if in_degrees else value
+
+        self.frames += 1
+        self.latencies.append(time.perf_counter() - start)
+        return coords
+
+    # p50 / p95 / max solve latency in ms over the last LATENCY_WINDOW frames
+    def latency_summary(self):
+        if not self.latencies:
+            return {}
+        ms = np.array(self.latencies) * 1000.0
+        return {'frames': self.frames, 'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)), 'max_ms': float(ms.max())}
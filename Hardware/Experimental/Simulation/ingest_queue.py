@@ -0,0 +1,197 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_STOP = object()
+
+# Runs on the worker: process every item, returns (number of items that raised, the last exception)
+def _process_batch(process, batch):
+    errors, error = 0, None
+    for item in batch:
+        try:
+            process(item)
+        except Exception as e:
+            errors += 1
+            error = e
+    return errors, error
+
+# Bounded queue between the BLE notification callback and the processing stage.
+#
+# The callback only calls put(), which never waits: processing (decoding, conversion, IK, printing, file I/O)
+# runs in batches on a worker thread, or a process pool passed as executor, one batch at a time so packets stay
+# in order. When processing falls behind and the queue is full, policy decides what happens:
+#   drop_oldest   discard the oldest queued packet to make room (keeps the live view current)
+#   drop_newest   discard the incoming packet (keeps the queued backlog intact)
+#   block         keep every packet: puts wait for space in arrival order; the BLE stack cannot be slowed
+#                 down, so the waiting puts are counted in depth and blocked. At most max_waiting puts wait
+#                 (default maxsize), beyond that incoming packets are dropped as with drop_newest, so memory
+#                 stays bounded under sustained overload
+# Depth and the drop counters are available at any time through stats(), and drops are reported at most
+# once a second while they happen.
+#
+#   async with IngestQueue(process_packet, maxsize=1024, policy='drop_oldest') as ingest_queue:
+#       await client.start_notify(CHARACTERISTIC_UUID_TX, lambda sender, data: ingest_queue.put(data))
+#
+#   process     called with each queued item on the worker (a batch per executor call), its return value is
+#               ignored; an item it raises on is counted in process_errors and the rest of the batch goes on
+class IngestQueue:
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+    REPORT_INTERVAL = 1.0
+
+    def __init__(self, process, maxsize=1024, policy='drop_oldest', executor=None, batch_size=64, name='ingest',
+                 max_waiting=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown drop policy {policy!r}, expected one of {self.POLICIES}")
+        self.process = process
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self.max_waiting = maxsize if max_waiting is None else max_waiting
+        self.name = name
+        self._executor = executor
+        self._own_executor = executor is None
+
+        self.received = 0
+        self.processed = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.blocked = 0
+        self.process_errors = 0
+        self.max_depth = 0
+        self.first_drop_time = None
+        self.last_drop_time = None
+
+        self._queue = None
+        self._waiting = 0
+        self._waiters = set()
+        self._task = None
+        self._reported_drops = 0
+        self._last_report = 0.0
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    # Packets accepted but not processed yet, including puts waiting for space under the block policy
+    @property
+    def depth(self):
+        return (self._queue.qsize() if self._queue is not None else 0) + self._waiting
+
+    def stats(self):
+        return {'depth': self.depth, 'max_depth': self.max_depth, 'received': self.received,
+                'processed': self.processed, 'dropped_oldest': self.dropped_oldest,
+                'dropped_newest': self.dropped_newest, 'blocked': self.blocked,
+                'process_errors': self.process_errors}
+
+    def _note_drop(self):
+        now = time.monotonic()
+        if self.first_drop_time is None:
+            self.first_drop_time = now
+        self.last_drop_time = now
+        if now - self._last_report >= self.REPORT_INTERVAL:
+            print(f"{self.name}: queue full ({self.maxsize}), dropped {self.dropped - self._reported_drops} "
+                  f"packets ({self.policy}), {self.dropped} in total")
+            self._reported_drops = self.dropped
+            self._last_report = now
+
+    # Called from the BLE callback on the event loop thread, never waits
+    def put(self, item):
+        self.received += 1
+        queue = self._queue
+        if self._waiting or queue.full():
+            if self.policy == 'drop_newest' or (self.policy == 'block' and self._waiting >= self.max_waiting):
+                self.dropped_newest += 1
+                self._note_drop()
+                return
+            if self.policy == 'drop_oldest':
+                queue.get_nowait()
+                self.dropped_oldest += 1
+                self._note_drop()
+            else:
+                self.blocked += 1
+                self._waiting += 1
+                waiter = asyncio.ensure_future(self._put_waiting(item))
+                self._waiters.add(waiter)
+                waiter.add_done_callback(self._waiters.discard)
+                self.max_depth = max(self.max_depth, self.depth)
+                return
+        queue.put_nowait(item)
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    async def _put_waiting(self, item):
+        try:
+            await self._queue.put(item)
+        finally:
+            self._waiting -= 1
+
+    # For producers that can wait (e.g. reading a file), honours the drop policy the same way
+    async def put_wait(self, item):
+        if self.policy != 'block':
+            self.put(item)
+            return
+        self.received += 1
+        self._waiting += 1
+        await self._put_waiting(item)
+        self.max_depth = max(self.max_depth, self.depth)
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                errors, error = await loop.run_in_executor(self._executor, _process_batch, self.process, batch)
+            except Exception as e:
+                # The executor itself failed (e.g. a broken process pool), none of the batch was processed
+                errors, error = len(batch), e
+            if errors:
+                self.process_errors += errors
+                print(f"{self.name}: processing failed for {errors} of {len(batch)} packets: {error}")
+            self.processed += len(batch) - errors
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.maxsize)
+        if self._own_executor:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        self._task = asyncio.ensure_future(self._drain())
+        return self
+
+    # drain: process everything still queued first, otherwise drop it
+    async def stop(self, drain=True):
+        if self._task is None:
+            return
+        if drain:
+            if self._waiters:
+                await asyncio.gather(*self._waiters)
+            await self._queue.put(_STOP)
+            await self._task
+        else:
+            self._task.cancel()
+            for waiter in self._waiters:
+                waiter.cancel()
+            await asyncio.gather(self._task, *self._waiters, return_exceptions=True)
+        self._task = None
+        if self.dropped > self._reported_drops:
+            print(f"{self.name}: dropped {self.dropped} packets in total ({self.policy})")
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
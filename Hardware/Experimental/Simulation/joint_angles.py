@@ -0,0 +1,120 @@
+import argparse
+import glob
+import os
+import time
+import numpy as np
+
+from orientation import quaternion_conjugate, quaternion_multiply, quaternion_normalize, relative_rotation
+from storage_loader import load_orientations
+
+# Knee angles for whole sessions straight from the orientation .sto files, without OpenSim IK.
+#
+# The tibia orientation relative to the femur, conj(femur) * tibia, is referenced to its mean over the first
+# calibration_samples frames (standing still, as compute_live.py calibrates) and decomposed as intrinsic Y, X, Z
+# rotations in the femur IMU frame:
+#   flexion   about Y, the pitch axis compute_live.py uses, with the same sign ((femur0 - femur) - (tibia0 - tibia))
+#   varus     about X, varus / valgus (sign depends on which leg and how the IMUs are mounted)
+#   rotation  about Z, internal / external rotation of the tibia
+# Everything is one NumPy pass over the session, all angles in degrees.
+#
+#   times, angles = session_joint_angles('data/data_2024_11_07_17_06.sto')
+#   angles['knee_flexion_r']
+
+FILEPATH = os.path.dirname(__file__)
+CALIBRATION_SAMPLES = 10
+SIDES = ('r', 'l')
+ANGLE_NAMES = ('knee_flexion', 'knee_varus', 'knee_rotation')
+
+# Mean orientation of a (N, 4) set of nearby quaternions: sign-aligned to the first one, summed and normalized
+def quaternion_mean(q):
+    q = np.asarray(q, dtype=np.float64)
+    signs = np.where(q @ q[0] < 0, -1.0, 1.0)
+    return quaternion_normalize((q * signs[:, None]).sum(axis=0))
+
+# Intrinsic Y, X, Z angles in degrees of quaternions (..., 4), returned as (..., 3)
+def quaternion_to_yxz(q):
+    q = quaternion_normalize(q)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    # Rotation matrix terms of R = Ry(a) Rx(b) Rz(c)
+    r02 = 2.0 * (x * z + w * y)
+    r22 = 1.0 - 2.0 * (x * x + y * y)
+    r12 = 2.0 * (y * z - w * x)
+    r10 = 2.0 * (x * y + w * z)
+    r11 = 1.0 - 2.0 * (x * x + z * z)
+
+    angles = np.empty(q.shape[:-1] + (3,))
+    angles[..., 0] = np.arctan2(r02, r22)
+    angles[..., 1] = np.arcsin(np.clip(-r12, -1.0, 1.0))
+    angles[..., 2] = np.arctan2(r10, r11)
+    return np.degrees(angles)
+
+# Flexion, varus and rotation (N, 3) from femur and tibia quaternions (N, 4). Frames where either IMU reported
+# an all-zero quaternion (not connected yet) come out as NaN and are not used for calibration.
+def knee_angles(femur, tibia, calibration_samples=CALIBRATION_SAMPLES):
+    knee = relative_rotation(femur, tibia)
+    valid = np.linalg.norm(knee, axis=-1) > 0.5
+    if not valid.any():
+        return np.full((len(knee), 3), np.nan)
+    neutral = quaternion_mean(knee[valid][:calibration_samples])
+    knee[~valid] = np.nan
+    return quaternion_to_yxz(quaternion_multiply(quaternion_conjugate(neutral), knee))
+
+# Joint angles of every side that has both IMUs in the session, returns (labels, times, angles)
+#   labels  e.g. ['knee_flexion_r', 'knee_varus_r', 'knee_rotation_r', 'knee_flexion_l', ...]
+#   angles  (N, len(labels)) in degrees
+def session_joint_angles_array(sto_filename, sides=SIDES, calibration_samples=CALIBRATION_SAMPLES):
+    imu_labels, times, quats = load_orientations(sto_filename)
+    labels, columns = [], []
+    for side in sides:
+        femur_label, tibia_label = f'femur_{side}_imu', f'tibia_{side}_imu'
+        if femur_label not in imu_labels or tibia_label not in imu_labels:
+            continue
+        femur = quats[:, imu_labels.index(femur_label)]
+        tibia = quats[:, imu_labels.index(tibia_label)]
+        columns.append(knee_angles(femur, tibia, calibration_samples))
+        labels.extend(f'{name}_{side}' for name in ANGLE_NAMES)
+    angles = np.concatenate(columns, axis=1) if columns else np.empty((len(times), 0))
+    return labels, np.asarray(times), angles
+
+# Same as session_joint_angles_array, as (times, {label: angles})
+def session_joint_angles(sto_filename, sides=SIDES, calibration_samples=CALIBRATION_SAMPLES):
+    labels, times, angles = session_joint_angles_array(sto_filename, sides, calibration_samples)
+    return times, {label: angles[:, i] for i, label in enumerate(labels)}
+
+# Write the angles in the .mot layout IMUInverseKinematicsTool produces, so the same tools can read them
+def write_mot(filename, labels, times, angles):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    header = (f'inDegrees=yes\nname={name}\nDataType=double\nversion=3\nendheader\n'
+              + '\t'.join(['time'] + labels))
+    np.savetxt(filename, np.column_stack((times, angles)), fmt='%.6f', delimiter='\t', header=header, comments='')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute knee angles from orientation .sto files without IK')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/)')
+    parser.add_argument('--sides', default='r,l', help='comma separated IMU sets (default: r,l)')
+    parser.add_argument('--output-dir', help='write joint_angles_<session>.mot files here')
+    args = parser.parse_args()
+
+    sessions = args.sessions or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto')))
+    sides = tuple(args.sides.split(','))
+    start = time.perf_counter()
+    frames = 0
+    for sto_filename in sessions:
+        try:
+            labels, times, angles = session_joint_angles_array(sto_filename, sides)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        frames += len(times)
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(sto_filename))[0]
+            write_mot(os.path.join(args.output_dir, f'joint_angles_{stem}.mot'), labels, times, angles)
+        if len(times) and labels:
+            flexion = angles[:, 0]
+            print(f"{os.path.basename(sto_filename)}: {len(times)} frames, "
+                  f"{labels[0]} {np.nanmin(flexion):.1f} to {np.nanmax(flexion):.1f} deg")
+    print(f"{len(sessions)} sessions, {frames} frames in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Constant-memory knee angle from the femur and tibia pitch, as compute_live.py computes it.
+#
+# The first calibration_samples samples are averaged (running sums, no lists) into the standing baseline
+# femur0 / tibia0; every later sample gives angle = (femur0 - femur) - (tibia0 - tibia). Angles go into a
+# fixed-capacity ring buffer, so memory stays flat however long the session runs. With an on_flush hook,
+# every flush_size new angles are handed to it as (times, angles) arrays, e.g. to append them to a file;
+# call flush() at the end of the session for the last partial chunk.
+#
+#   stream = KneeAngleStream(10, on_flush=store_angles)
+#   angle = stream.update(t, femur_pitch, tibia_pitch)    # None while calibrating
+#   times, angles = stream.recent()                       # the last `capacity` angles, oldest first
+class KneeAngleStream:
+    __slots__ = ('calibration_samples', 'capacity', 'flush_size', 'on_flush', 'femur0', 'tibia0', 'angle',
+                 'calibration_count', '_femur_sum', '_tibia_sum', '_times', '_angles', '_total', '_flushed')
+
+    def __init__(self, calibration_samples=10, capacity=4096, flush_size=256, on_flush=None):
+        if calibration_samples < 1:
+            raise ValueError("calibration_samples must be at least 1")
+        if not 0 < flush_size <= capacity:
+            raise ValueError(f"flush_size must be between 1 and the capacity ({capacity})")
+        self.calibration_samples = calibration_samples
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.on_flush = on_flush
+
+        self.femur0 = self.tibia0 = None
+        self.angle = None
+        self.calibration_count = 0
+        self._femur_sum = self._tibia_sum = 0.0
+
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._angles = np.empty(capacity, dtype=np.float64)
+        self._total = 0         # angles ever appended
+        self._flushed = 0       # angles handed to on_flush
+
+    @property
+    def calibrating(self):
+        return self.calibration_count < self.calibration_samples
+
+    # Number of angles computed so far (including ones no longer in the buffer)
+    def __len__(self):
+        return self._total
+
+    def reset(self):
+        self.flush()
+        self.femur0 = self.tibia0 = None
+        self.angle = None
+        self.calibration_count = 0
+        self._femur_sum = self._tibia_sum = 0.0
+        self._total = self._flushed = 0
+
+    # Feed one sample, returns the knee angle or None while calibrating
+    def update(self, t, femur, tibia):
+        if self.calibration_count < self.calibration_samples:
+            self._femur_sum += femur
+            self._tibia_sum += tibia
+            self.calibration_count += 1
+            if self.calibration_count == self.calibration_samples:
+                self.femur0 = self._femur_sum / self.calibration_samples
+                self.tibia0 = self._tibia_sum / self.calibration_samples
+            return None
+
+        angle = (self.femur0 - femur) - (self.tibia0 - tibia)
+        i = self._total % self.capacity
+        self._times[i] = t
+        self._angles[i] = angle
+        self._total += 1
+        self.angle = angle
+
+        if self.on_flush is not None and self._total - self._flushed >= self.flush_size:
+            self.flush()
+        return angle
+
+    def _window(self, start):
+        index = np.arange(start, self._total) % self.capacity
+        return self._times[index], self._angles[index]
+
+    # Hand every angle not yet flushed to on_flush
+    def flush(self):
+        if self.on_flush is None or self._total == self._flushed:
+            return
+        times, angles = self._window(self._flushed)
+        self._flushed = self._total
+        self.on_flush(times, angles)
+
+    # Copies of the buffered (times, angles), oldest first
+    def recent(self):
+        return self._window(max(0, self._total - self.capacity))
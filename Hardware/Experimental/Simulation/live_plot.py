@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import numpy as np
+
+# Live angle plot, redrawn at a fixed frame rate while the BLE session runs.
+#
+# The BLE loop moves to a worker thread and the plot renders on the main thread, which GUI backends need.
+# The notification handler only calls push(), which writes one sample into a preallocated ring buffer and
+# never waits on rendering. The render loop snapshots the buffer frame_rate times a second, reduces the visible
+# window to a min/max pair per pixel column and blits just the line over a cached background, so a frame costs
+# the same for 100 or 100k samples. The axes are only fully redrawn when the window scrolls or the y range grows.
+#
+#   live_plot = LivePlot(window_seconds=10)
+#   ... in the handler: live_plot.push(t, angle)
+#   live_plot.run(run())      # instead of asyncio.run(run()), returns once run() finishes
+
+# Reduce (times, values) to the min and max of every pixel column between x0 and x1, in time order.
+# times must be increasing; returns at most 2 * width points.
+def decimate_minmax(times, values, x0, x1, width):
+    if len(times) <= 2 * width:
+        return times, values
+    columns = ((times - x0) * (width / (x1 - x0))).astype(np.int64)
+    starts = np.flatnonzero(np.diff(columns, prepend=-1))
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    x = times[starts]
+    return np.repeat(x, 2), np.column_stack((lows, highs)).ravel()
+
+class LivePlot:
+    SNAPSHOT_SLACK = 256
+
+    def __init__(self, window_seconds=10.0, frame_rate=20, capacity=16384, ylim=(-30.0, 150.0),
+                 title='Knee angle', ylabel='Angle'):
+        self.window_seconds = window_seconds
+        self.frame_rate = frame_rate
+        self.capacity = capacity
+        self.ylim = list(ylim)
+        self.title = title
+        self.ylabel = ylabel
+
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._count = 0
+
+        self.frames = 0
+        self.full_redraws = 0
+
+    # Called from the BLE handler: O(1), no locks, nothing that waits on the renderer
+    def push(self, t, value):
+        i = self._count % self.capacity
+        self._times[i] = t
+        self._values[i] = value
+        self._count += 1
+
+    # The buffered samples newer than since, oldest first. The oldest SNAPSHOT_SLACK slots are left out so
+    # samples pushed while copying never overwrite the ones being read.
+    def _snapshot(self, since):
+        count = self._count
+        n = min(count, self.capacity - self.SNAPSHOT_SLACK)
+        index = np.arange(count - n, count) % self.capacity
+        times, values = self._times[index], self._values[index]
+        keep = times >= since
+        return times[keep], values[keep]
+
+    def _setup(self):
+        import matplotlib.pyplot as plt
+
+        plt.ion()
+        self._figure, self._axes = plt.subplots(figsize=(8, 5))
+        self._axes.set_xlabel('Time')
+        self._axes.set_ylabel(self.ylabel)
+        self._axes.set_title(self.title)
+        self._axes.grid(True)
+        self._line, = self._axes.plot([], [], linestyle='-', animated=True)
+        self._xlim = [0.0, self.window_seconds]
+        self._full_redraw()
+        plt.show(block=False)
+
+    # Redraw the axes without the line and cache them as the blitting background
+    def _full_redraw(self):
+        self._axes.set_xlim(*self._xlim)
+        self._axes.set_ylim(*self.ylim)
+        self._figure.canvas.draw()
+        self._background = self._figure.canvas.copy_from_bbox(self._axes.bbox)
+        self.full_redraws += 1
+
+    def _frame(self):
+        times, values = self._snapshot(self._xlim[0])
+        if len(times):
+            redraw = False
+            # Scroll by half a window once the newest sample runs off the right edge
+            if times[-1] > self._xlim[1]:
+                self._xlim = [times[-1] - self.window_seconds / 2, times[-1] + self.window_seconds / 2]
+                keep = times >= self._xlim[0]
+                times, values = times[keep], values[keep]
+                redraw = True
+            low, high = values.min(), values.max()
+            if low < self.ylim[0] or high > self.ylim[1]:
+                self.ylim = [min(low, self.ylim[0]) - 10, max(high, self.ylim[1]) + 10]
+                redraw = True
+            if redraw:
+                self._full_redraw()
+
+            width = max(1, int(self._axes.get_window_extent().width))
+            self._line.set_data(*decimate_minmax(times, values, self._xlim[0], self._xlim[1], width))
+
+        canvas = self._figure.canvas
+        canvas.restore_region(self._background)
+        self._axes.draw_artist(self._line)
+        canvas.blit(self._axes.bbox)
+        canvas.flush_events()
+        self.frames += 1
+
+    # Run the coroutine on a worker thread and render until it finishes (or the window is closed)
+    def run(self, coroutine):
+        import matplotlib.pyplot as plt
+
+        errors = []
+        def worker():
+            try:
+                asyncio.run(coroutine)
+            except BaseException as e:
+                errors.append(e)
+
+        self._setup()
+        thread = threading.Thread(target=worker, name='ble-loop', daemon=True)
+        thread.start()
+
+        period = 1.0 / self.frame_rate
+        next_frame = time.perf_counter()
+        while thread.is_alive():
+            if plt.fignum_exists(self._figure.number):
+                self._frame()
+            next_frame += period
+            thread.join(max(0.0, next_frame - time.perf_counter()))
+            next_frame = max(next_frame, time.perf_counter())
+
+        if errors:
+            raise errors[0]
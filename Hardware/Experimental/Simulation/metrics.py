@@ -0,0 +1,266 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight in-process metrics for the capture pipeline.
+#
+# Counters and histograms are plain Python objects updated in O(1) from the BLE callback or any worker thread.
+# They can be scraped as Prometheus text from a local HTTP endpoint and/or summarized in one console line every
+# few seconds, which replaces the per-packet prints.
+#
+#   from metrics import PACKETS, PARSE_ERRORS, HANDLER_SECONDS, start_http_server, SummaryReporter
+#   PACKETS.inc(device='esp32')
+#   with HANDLER_SECONDS.time():
+#       ...
+#   start_http_server(9100)                   # curl localhost:9100/metrics
+#   SummaryReporter(interval=5).start()       # packets/s esp32=49.8 | parse errors 0 | handler p50 0.04ms ...
+
+DEFAULT_PORT = 9100
+SUMMARY_INTERVAL = 5.0
+# Latency buckets in seconds, from 10us to 10s
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    # {label key: value}
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # label key -> [bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    # {label key: (bucket counts, sum, count)}, bucket counts not cumulative
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    # Quantile estimate from the buckets (linear inside a bucket), optionally from the difference to a
+    # previous snapshot entry so it covers only the last interval
+    def quantile(self, q, counts, previous=None):
+        if previous is not None:
+            counts = [a - b for a, b in zip(counts, previous)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind:
+                    raise ValueError(f"metric {metric.name} already registered as a {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help):
+        return self._register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+################################# PIPELINE METRICS ################################################
+
+PACKETS = REGISTRY.counter('motionmend_packets_total', 'BLE notifications received, per device')
+PARSE_ERRORS = REGISTRY.counter('motionmend_parse_errors_total', 'Notifications that failed to decode, per device')
+HANDLER_SECONDS = REGISTRY.histogram('motionmend_handler_seconds', 'Time spent handling one notification')
+WRITE_SECONDS = REGISTRY.histogram('motionmend_write_seconds', 'Time spent writing one batch of rows to disk')
+IK_SECONDS = REGISTRY.histogram('motionmend_ik_seconds', 'Time spent solving IK for one frame')
+
+################################# EXPOSITION ################################################
+
+# Serve registry.render() on http://host:port/metrics from a daemon thread, returns the server
+def start_http_server(port=DEFAULT_PORT, host='127.0.0.1', registry=REGISTRY):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+# Prints one line every interval seconds: packets/s per device, parse errors and p50/p95 of every latency
+# histogram over that interval
+class SummaryReporter:
+    def __init__(self, interval=SUMMARY_INTERVAL, registry=REGISTRY, printer=print):
+        self.interval = interval
+        self.registry = registry
+        self.printer = printer
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_packets = {}
+        self._last_histograms = {}
+        self._last_time = None
+
+    def summary(self):
+        now = time.monotonic()
+        elapsed = now - self._last_time if self._last_time is not None else None
+        self._last_time = now
+        parts = []
+
+        packets_metric = self.registry.get(PACKETS.name)
+        errors_metric = self.registry.get(PARSE_ERRORS.name)
+        packets = packets_metric.values() if packets_metric is not None else {}
+        rates = []
+        for key, count in sorted(packets.items()):
+            device = dict(key).get('device', 'all')
+            if elapsed:
+                rates.append(f"{device}={(count - self._last_packets.get(key, 0)) / elapsed:.1f}")
+        self._last_packets = packets
+        if rates:
+            parts.append('packets/s ' + ' '.join(rates))
+        if errors_metric is not None:
+            parts.append(f"parse errors {sum(errors_metric.values().values())}")
+
+        for histogram in [metric for metric in self.registry.metrics() if metric.kind == 'histogram']:
+            counts = [0] * (len(histogram.buckets) + 1)
+            for series_counts, _, _ in histogram.snapshot().values():
+                counts = [a + b for a, b in zip(counts, series_counts)]
+            previous = self._last_histograms.get(histogram.name)
+            self._last_histograms[histogram.name] = counts
+            p50 = histogram.quantile(0.5, counts, previous)
+            if p50 is None:
+                continue
+            p95 = histogram.quantile(0.95, counts, previous)
+            label = histogram.name.replace('motionmend_', '').replace('_seconds', '')
+            parts.append(f"{label} p50 {p50 * 1000:.2f}ms p95 {p95 * 1000:.2f}ms")
+        return ' | '.join(parts)
+
+    def _run(self):
+        self.summary()
+        while not self._stop.wait(self.interval):
+            self.printer(self.summary())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-summary', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.printer(self.summary())
@@ -1,11 +1,15 @@
-import matplotlib.pyplot as plt
-import opensim as osim
-from bleak import BleakClient
 from datetime import datetime
 from math import pi
 import os, math, time
 import asyncio
 from pathlib import Path
+from packet_decoder import decode_rpy
+from ble_replay import ReplayClient
+from device_registry import ReconnectingClient
+from live_plot import LivePlot
+from ingest_queue import IngestQueue
+from orientation import rpy_to_quaternion
+from metrics import PACKETS, PARSE_ERRORS, HANDLER_SECONDS, IK_SECONDS, SummaryReporter, start_http_server
 
 
 ################################# VARIABLE SETUP ################################################
@@ -13,13 +17,24 @@ FILEPATH = os.path.dirname(__file__)
 BLE_DURATION_SECONDS = 20
 CAPTURE_NEW_DATA = True # False if you want to visualize the latest motion captured
 RECALIBRATE = False
+PLOT_ANGLES = True  # False for capture-only runs: matplotlib is never imported and nothing is plotted
+LIVE_PLOT = False   # Redraw the angle while capturing (see live_plot.py)
 
 ### BLUETOOTH VARIABLES ###
+# Seeds the device registry on the first run, afterwards the cached address in devices.json is used
 ESP32_MAC_ADDRESS = "65DAA853-64CB-A387-AEE5-CDF0A60B786C"
 ESP32_MAC_ADDRESS = "14:2B:2F:AF:81:96"
 ESP32_MAC_ADDRESS = "14:2B:2F:AE:BC:86"
 SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
 CHARACTERISTIC_UUID_TX = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+REPLAY_FILE = None  # Path to a data_raw_*.txt to replay through ble_replay.ReplayClient instead of connecting to the ESP32
+REPLAY_SPEED = 1.0  # 1 = real time, N = N times faster, None = as fast as possible
+DEVICE_NAME = 'esp32'   # Name in the device registry and label in the metrics
+ADVERTISED_NAME = 'ESP32_IMU_BLE'   # Name prefix scanned for when the registry has no working address (see device_registry.py)
+METRICS_PORT = 9100     # Prometheus metrics at http://localhost:9100/metrics, None to disable
+SUMMARY_INTERVAL = 5    # Seconds between the one-line pipeline summaries
+INGEST_QUEUE_SIZE = 1024            # Packets buffered between the BLE callback and processing
+INGEST_DROP_POLICY = 'drop_oldest'  # 'drop_oldest', 'drop_newest' or 'block' once the queue is full (see ingest_queue.py)
 FILENAME_SUFFIX = datetime.today().strftime('%Y_%m_%d_%H_%M')
 FILE_HEADER = '''DataType=Quaternion
 endheader'''
@@ -32,32 +47,19 @@ resultsDirectory = os.path.join(FILEPATH, 'IK_results')
 MOT_FILENAME = os.path.join(resultsDirectory, f'ik_data_{FILENAME_SUFFIX}.mot')
 timestamp = time.time()
 ### CALIBRATION VARIABLES ###
-sensor_to_opensim_rotations = osim.Vec3(-pi/2, 0, 0)# The rotation of IMU data to the OpenSim world frame
+sensor_to_opensim_rotations = (-pi/2, 0, 0)# The rotation of IMU data to the OpenSim world frame
 baseIMUName = 'pelvis_imu'                     # The base IMU is the IMU on the base body of the model that dictates the heading (forward) direction of the model.
 baseIMUHeading = '-z'                           # The Coordinate Axis of the base IMU that points in the heading direction. 
 visulizeCalibration = False                     # Boolean to Visualize the Output model
 
 ### INVERSE KINEMATICS VARIABLES ###
-sensor_to_opensim_rotation = osim.Vec3(-pi/2, 0, 0) # The rotation of IMU data to the OpenSim world frame
+sensor_to_opensim_rotation = (-pi/2, 0, 0) # The rotation of IMU data to the OpenSim world frame
 visualizeTracking = True  # Boolean to Visualize the tracking simulation
 startTime = 0           # Start time (in seconds) of the tracking simulation. 
 endTime = 1000              # End time (in seconds) of the tracking simulation.
 
 ################################# BLUETOOTH DATA ACQUISITION ################################################
 
-imuIK = osim.IMUInverseKinematicsTool()
- 
-# Set tool properties
-imuIK.set_model_file(outputCalibratedFileName)
-imuIK.set_sensor_to_opensim_rotations(sensor_to_opensim_rotation)
-imuIK.set_results_directory(resultsDirectory)
-
-# Set time range in seconds
-imuIK.set_time_range(0, startTime) 
-imuIK.set_time_range(1, endTime)   
-
-model = osim.Model(outputCalibratedFileName)
-
 relevant_coords = set([
     # 'hip_flexion_r',
     # 'hip_adduction_r',
@@ -71,130 +73,120 @@ relevant_coords = set([
     # 'knee_angle_l_beta'
 ])
 
-import os, sys
-
-class HiddenPrints:
-    def __enter__(self):
-        self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout.close()
-        sys.stdout = self._original_stdout
+LIVE_IK = False  # Solve IK for every packet through a persistent IKSession (needs a calibrated model)
+IMU_LABELS = ['pelvis_imu', 'femur_r_imu', 'tibia_r_imu']  # IMUs sent by the ESP32, in packet order
+ik_session = None
+if LIVE_IK:
+    from ik_session import IKSession  # Imports opensim, so only when live IK is requested
+    ik_session = IKSession(outputCalibratedFileName, IMU_LABELS, relevant_coords, sensor_to_opensim_rotation)
 
-# Function to convert Roll, Pitch, Yaw to Quaternion
-def rpy_to_quaternion(roll, pitch, yaw):
-    # Convert angles to radians
-    roll = math.radians(roll)
-    pitch = math.radians(pitch)
-    yaw = math.radians(yaw)
+live_plot = LivePlot() if LIVE_PLOT else None
 
-    # Quaternion conversion
-    q_w = math.cos(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
-    q_x = math.sin(roll/2) * math.cos(pitch/2) * math.cos(yaw/2) - math.cos(roll/2) * math.sin(pitch/2) * math.sin(yaw/2)
-    q_y = math.cos(roll/2) * math.sin(pitch/2) * math.cos(yaw/2) + math.sin(roll/2) * math.cos(pitch/2) * math.sin(yaw/2)
-    q_z = math.cos(roll/2) * math.cos(pitch/2) * math.sin(yaw/2) - math.sin(roll/2) * math.sin(pitch/2) * math.cos(yaw/2)
-
-    return q_w, q_x, q_y, q_z
 tibia0, femur0 = 6, 11
 angles = []
 timestamp0 = None
 counter = 0
 
+ingest_queue = None
+
 # Callback function to handle incoming data from ESP32
+# Only timestamps the packet, everything else runs on the ingest queue's worker thread
 def notification_handler(sender, data):
+    PACKETS.inc(device=DEVICE_NAME)
+    ingest_queue.put((time.time() - timestamp0, data))
+
+# Process one (t, packet) from the ingest queue, on its worker thread
+def process_queued(item):
+    t, data = item
+    with HANDLER_SECONDS.time():
+        process_packet(t, data)
+
+def process_packet(t, data):
     try:
-        # Decode incoming data (need to add encoding on ESP32 side)
-        decoded_data = data.decode('utf-8').strip()
-
-        # Split the incoming data by comma
-        values = decoded_data.split(',')
-        
-        global timestamp
-        
-        # Open the .sto file in append mode
-        buf = [f"{FILE_HEADER}\ntime\tpelvis_imu\tfemur_r_imu\ttibia_r_imu\n0"]
-        with open(STO_FILENAME, 'w') as file:
-            femur, tibia = 0, 0
-            
-            # Iterate through each IMU set of data
-            for i in range(0, len(values), 3):        
-                roll = float(values[i])
-                pitch = float(values[i + 1])
-                yaw = float(values[i + 2])
-                
-                # Convert RPY to quaternion
-                # q_w, q_x, q_y, q_z = rpy_to_quaternion(roll, pitch, yaw)
-
-                # Append quaternion data to the file
-                # buf.append(f"\t{q_w:.6f},{q_x:.6f},{q_y:.6f},{q_z:.6f}")
-                
-                if i == 3:
-                    femur = pitch
-                if i == 6:
-                    tibia = pitch
-                if i > 0:
-                    print(f'{"femur" if i == 3 else "tibia"}: {roll}, {pitch}, {yaw}')
-                
-            # file.write(''.join(buf))  
-            ang = (femur0 - femur) - (tibia0 - tibia)      
-            print(f'computed angle: {ang}')
-            global timestamp0
-            angles.append((time.time() - timestamp0, ang))
-
-        
-        # # Run IK
-        # with HiddenPrints():
-        #     imuIK.set_orientations_file(STO_FILENAME);
-        #     imuIK.run();
-
-        # q = osim.TimeSeriesTable(MOT_FILENAME)
-        
-        # for i,t in enumerate(q.getIndependentColumn()):
-        #     value=osim.RowVector(q.getRowAtIndex(i))
-        #     for j, coordinate in enumerate(model.updCoordinateSet()):
-        #         if coordinate.getName() in relevant_coords:
-        #             # enablePrint()
-        #             print(t, coordinate.getName(), value[j])
-        # print(f'{(time.time() - timestamp)*1000:.1f}ms')
+        # Decode incoming data (comma separated text or a binary frame, see packet_decoder.py)
+        values = decode_rpy(data)
+
+        femur, tibia = 0, 0
+        quats = []
+
+        # Iterate through each IMU set of data
+        for i in range(0, len(values), 3):
+            roll, pitch, yaw = values[i], values[i + 1], values[i + 2]
+
+            # Convert RPY to quaternion for the IK solver
+            if ik_session is not None:
+                quats.append(rpy_to_quaternion(roll, pitch, yaw))
+
+            if i == 3:
+                femur = pitch
+            if i == 6:
+                tibia = pitch
+
+        ang = (femur0 - femur) - (tibia0 - tibia)
+        angles.append((t, ang))
+        if live_plot is not None:
+            live_plot.push(t, ang)
+
+        # Run IK in memory, warm-started from the previous frame
+        if ik_session is not None:
+            ik_session.solve(t, quats)
+            IK_SECONDS.observe(ik_session.latencies[-1])
 
     except ValueError as e:
+        PARSE_ERRORS.inc(device=DEVICE_NAME)
         print(f"Error parsing data: {data}. Error: {e}")
 
-async def run():
-    async with BleakClient(ESP32_MAC_ADDRESS) as client:
-        connected = await client.is_connected()
-        print(f"Connected: {connected}")
-        global timestamp0
-        timestamp0 = time.time()
+# Plot the knee angle over time, matplotlib is only imported when a plot is requested
+def plot_angles(time, value):
+    import matplotlib.pyplot as plt
 
-        await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
+    # Create the plot
+    plt.figure(figsize=(8, 5))
+    plt.plot(time, value, marker='o', linestyle='-', label='Angle over Time')
 
-        await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
+    # Add labels and title
+    plt.xlabel('Time')
+    plt.ylabel('Angle')
+    plt.title('Time vs. Angle Plot')
 
-        await client.stop_notify(CHARACTERISTIC_UUID_TX)
+    # Add a legend
+    plt.legend()
 
-# Run the loop
-asyncio.run(run())
+    # Show the plot
+    plt.grid(True)
+    plt.show()
 
+async def run():
+    global ingest_queue, timestamp0
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    summary = SummaryReporter(SUMMARY_INTERVAL).start()
+    try:
+        async with IngestQueue(process_queued, INGEST_QUEUE_SIZE, INGEST_DROP_POLICY) as ingest_queue:
+            async with (ReplayClient(REPLAY_FILE, speed=REPLAY_SPEED) if REPLAY_FILE else ReconnectingClient(DEVICE_NAME, advertised_name=ADVERTISED_NAME, service_uuid=SERVICE_UUID, default_address=ESP32_MAC_ADDRESS)) as client:
+                connected = await client.is_connected()
+                print(f"Connected: {connected}")
+                timestamp0 = time.time()
 
-# Separate the tuples into two lists: time and value
-time, value = zip(*angles)
+                await client.start_notify(CHARACTERISTIC_UUID_TX, notification_handler)
 
-# Create the plot
-plt.figure(figsize=(8, 5))
-plt.plot(time, value, marker='o', linestyle='-', label='Angle over Time')
+                await asyncio.sleep(BLE_DURATION_SECONDS)  # Run for 1 min 
 
-# Add labels and title
-plt.xlabel('Time')
-plt.ylabel('Angle')
-plt.title('Time vs. Angle Plot')
+                await client.stop_notify(CHARACTERISTIC_UUID_TX)
+    finally:
+        summary.stop()
+    print(f"Ingest queue: {ingest_queue.stats()}")
 
-# Add a legend
-plt.legend()
+# Run the loop, with the live plot rendering on this thread while it runs
+if live_plot is not None:
+    live_plot.run(run())
+else:
+    asyncio.run(run())
 
-# Show the plot
-plt.grid(True)
-plt.show()
+if ik_session is not None:
+    print(f"IK solve latency: {ik_session.latency_summary()}")
 
 
+if PLOT_ANGLES and angles:
+    # Separate the tuples into two lists: time and value
+    plot_angles(*zip(*angles))
@@ -1,6 +1,7 @@
 import opensim as osim
 from math import pi
 import os
+from calibration_cache import calibrated_model
 
 ### FILE PATH VARIABLES ###
 FILEPATH = os.path.dirname(__file__)
@@ -23,24 +24,11 @@ endTime = 1000              # End time (in seconds) of the tracking simulation.
 
 ################################### IMU PLACER CALIBRATION ##################################################
 
-# Instantiate an IMUPlacer object
-imuPlacer = osim.IMUPlacer()
-
-# Set properties for the IMUPlacer
-imuPlacer.set_model_file(modelFileName)
-imuPlacer.set_orientation_file_for_calibration(orientationsFileName)
-imuPlacer.set_sensor_to_opensim_rotations(sensor_to_opensim_rotations)
-imuPlacer.set_base_imu_label(baseIMUName)
-imuPlacer.set_base_heading_axis(baseIMUHeading)
-
-# Run the IMUPlacer
-imuPlacer.run(visulizeCalibration)
-
-# Get the model with the calibrated IMU
-model = imuPlacer.getCalibratedModel()
-
-# Print the calibrated model to file.
-model.printToXML(outputCalibratedFileName)
+# Run the IMUPlacer, or reuse the stored model if this setup was already calibrated (see calibration_cache.py)
+# The result is also copied to calibrated_model.osim
+calibratedModelFileName = calibrated_model(modelFileName, orientationsFileName, sensor_to_opensim_rotations,
+                                           baseIMUName, baseIMUHeading, output_file=outputCalibratedFileName,
+                                           visualize=visulizeCalibration)
 
 ################################### INVERSE KINEMATICS ##################################################
 
@@ -48,7 +36,7 @@ model.printToXML(outputCalibratedFileName)
 imuIK = osim.IMUInverseKinematicsTool()
  
 # Set tool properties
-imuIK.set_model_file(outputCalibratedFileName)
+imuIK.set_model_file(calibratedModelFileName)
 imuIK.set_orientations_file(orientationsFileName)
 imuIK.set_sensor_to_opensim_rotations(sensor_to_opensim_rotation)
 imuIK.set_results_directory(resultsDirectory)
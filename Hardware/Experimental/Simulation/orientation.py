@@ -0,0 +1,69 @@
+import math
+import numpy as np
+
+################################# ORIENTATION MATH ################################################
+# Quaternions are stored (w, x, y, z) in the last axis, the same order written to the .sto files.
+# Roll, pitch and yaw are in degrees, as sent by the ESP32.
+
+# Function to convert a single Roll, Pitch, Yaw sample to Quaternion (used by the live handlers)
+def rpy_to_quaternion(roll, pitch, yaw):
+    # Half angles in radians, each sin/cos computed once
+    hr, hp, hy = math.radians(roll) * 0.5, math.radians(pitch) * 0.5, math.radians(yaw) * 0.5
+    cr, sr = math.cos(hr), math.sin(hr)
+    cp, sp = math.cos(hp), math.sin(hp)
+    cy, sy = math.cos(hy), math.sin(hy)
+
+    q_w = cr * cp * cy + sr * sp * sy
+    q_x = sr * cp * cy - cr * sp * sy
+    q_y = cr * sp * cy + sr * cp * sy
+    q_z = cr * cp * sy - sr * sp * cy
+
+    return q_w, q_x, q_y, q_z
+
+# Convert an array of Roll, Pitch, Yaw of shape (..., 3), e.g. (N, IMUs, 3), to quaternions of shape (..., 4)
+def rpy_to_quaternion_batch(rpy):
+    half = np.radians(np.asarray(rpy, dtype=np.float64)) * 0.5
+    c, s = np.cos(half), np.sin(half)
+    cr, cp, cy = c[..., 0], c[..., 1], c[..., 2]
+    sr, sp, sy = s[..., 0], s[..., 1], s[..., 2]
+
+    cp_cy, sp_sy = cp * cy, sp * sy
+    sp_cy, cp_sy = sp * cy, cp * sy
+
+    q = np.empty(half.shape[:-1] + (4,))
+    q[..., 0] = cr * cp_cy + sr * sp_sy
+    q[..., 1] = sr * cp_cy - cr * sp_sy
+    q[..., 2] = cr * sp_cy + sr * cp_sy
+    q[..., 3] = cr * cp_sy - sr * sp_cy
+    return q
+
+def quaternion_normalize(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+def quaternion_conjugate(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+# Hamilton product a * b, broadcasting over the leading axes
+def quaternion_multiply(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+    q = np.empty(np.broadcast_shapes(a.shape, b.shape))
+    q[..., 0] = aw * bw - ax * bx - ay * by - az * bz
+    q[..., 1] = aw * bx + ax * bw + ay * bz - az * by
+    q[..., 2] = aw * by - ax * bz + ay * bw + az * bx
+    q[..., 3] = aw * bz + ax * by - ay * bx + az * bw
+    return q
+
+# Rotation of b expressed in the frame of a (conj(a) * b), e.g. tibia relative to femur
+def relative_rotation(a, b):
+    return quaternion_multiply(quaternion_conjugate(a), b)
+
+# Rotation angle in degrees of each quaternion, in [0, 180]
+def quaternion_angle(q):
+    w = np.abs(quaternion_normalize(q)[..., 0])
+    return np.degrees(2.0 * np.arccos(np.clip(w, 0.0, 1.0)))
@@ -0,0 +1,119 @@
+import struct
+
+################################# PACKET FORMATS ################################################
+# Packets from the ESP32 come in one of two layouts:
+#
+#   Text   "roll,pitch,yaw,roll,pitch,yaw,..." (UTF-8, one IMU every 3 values)
+#   Binary FRAME_MAGIC, <kind>, then a fixed-size little-endian block per IMU:
+#       KIND_RPY_F32   3 x float32 roll, pitch, yaw in degrees          (12 bytes / IMU)
+#       KIND_RPY_I16   3 x int16   roll, pitch, yaw in 1/50 degree      ( 6 bytes / IMU)
+#       KIND_QUAT_F32  4 x float32 w, x, y, z                           (16 bytes / IMU)
+#       KIND_QUAT_I16  4 x int16   w, x, y, z scaled by QUAT_I16_SCALE  ( 8 bytes / IMU)
+#
+# A text packet always starts with a digit, '-' or whitespace, so the magic byte (non ASCII)
+# is enough to tell the two layouts apart without any extra negotiation.
+
+FRAME_MAGIC = 0xA5
+HEADER_SIZE = 2
+
+KIND_RPY_F32 = 0x01
+KIND_RPY_I16 = 0x02
+KIND_QUAT_F32 = 0x03
+KIND_QUAT_I16 = 0x04
+
+RPY_I16_SCALE = 50.0    # 0.02 deg resolution, still fits yaw in [0, 360)
+QUAT_I16_SCALE = 32767.0
+
+# kind -> (struct code, values per IMU, scale applied after unpacking)
+_KINDS = {
+    KIND_RPY_F32: ('f', 3, None),
+    KIND_RPY_I16: ('h', 3, RPY_I16_SCALE),
+    KIND_QUAT_F32: ('f', 4, None),
+    KIND_QUAT_I16: ('h', 4, QUAT_I16_SCALE),
+}
+
+# (kind, frame length) -> (payload label, decode(data, offset) returning the scaled values)
+# Filled on the first frame of each shape so the hot path is a single dict lookup
+_layouts = {}
+
+# scale -> the 65536 int16 values divided by scale, indexed by the same two bytes read as uint16
+# Built on the first frame of a scaled kind (about 2 MB each) so scaling is one lookup per value:
+# a NumPy multiply costs more per call than the whole text parse at 3-5 IMUs
+_scaled_tables = {}
+
+def _scaled_table(scale):
+    table = _scaled_tables.get(scale)
+    if table is None:
+        table = tuple((v - 65536 if v >= 32768 else v) / scale for v in range(65536))
+        _scaled_tables[scale] = table
+    return table
+
+def _build_layout(kind, frame_size):
+    if kind not in _KINDS:
+        raise ValueError(f"Unknown binary frame kind 0x{kind:02x}")
+    code, per_imu, scale = _KINDS[kind]
+    payload_size = frame_size - HEADER_SIZE
+    item_size = struct.calcsize(code) * per_imu
+    if payload_size <= 0 or payload_size % item_size != 0:
+        raise ValueError(f"Binary frame payload of {payload_size} bytes does not fit kind 0x{kind:02x}")
+    count = payload_size // item_size * per_imu
+    if scale is None:
+        decode = struct.Struct(f'<{count}{code}').unpack_from
+    else:
+        unpack_from = struct.Struct(f'<{count}H').unpack_from
+        table = _scaled_table(scale)
+
+        def decode(data, offset):
+            return [table[v] for v in unpack_from(data, offset)]
+    layout = ('quat' if per_imu == 4 else 'rpy', decode)
+    _layouts[(kind, frame_size)] = layout
+    return layout
+
+def is_binary(data):
+    return len(data) >= HEADER_SIZE and data[0] == FRAME_MAGIC
+
+# Decode the comma separated text packet into a flat list of floats
+def decode_text(data):
+    values = str(data, 'utf-8').strip().split(',')
+    if len(values) % 3 != 0:
+        raise ValueError(f"Unexpected data format: {len(values)} values is not a multiple of 3")
+    return list(map(float, values))
+
+# Decode a binary frame into ('rpy' | 'quat', flat sequence of floats).
+# unpack_from reads the payload straight out of the notification buffer, nothing is sliced or copied.
+def decode_binary(data):
+    layout = _layouts.get((data[1], len(data)))
+    if layout is None:
+        layout = _build_layout(data[1], len(data))
+    label, decode = layout
+    return label, decode(data, HEADER_SIZE)
+
+# Decode any packet into ('rpy' | 'quat', flat sequence of floats)
+def decode_packet(data):
+    if len(data) >= HEADER_SIZE and data[0] == FRAME_MAGIC:
+        return decode_binary(data)
+    return 'rpy', decode_text(data)
+
+# Decode a packet that must carry roll, pitch, yaw triples (what every notification_handler expects)
+def decode_rpy(data):
+    if len(data) >= HEADER_SIZE and data[0] == FRAME_MAGIC:
+        label, values = decode_binary(data)
+        if label != 'rpy':
+            raise ValueError(f"Expected a roll/pitch/yaw frame, got kind 0x{data[1]:02x}")
+        return values
+    return decode_text(data)
+
+################################# ENCODERS ################################################
+# Used by the benchmark and the replay tools to produce frames the ESP32 would send
+
+def encode_text(values):
+    return ','.join(f'{v:.2f}' for v in values).encode('utf-8')
+
+def encode_binary(kind, values):
+    code, per_imu, scale = _KINDS[kind]
+    if len(values) % per_imu != 0:
+        raise ValueError(f"{len(values)} values is not a multiple of {per_imu}")
+    if scale is not None:
+        values = [int(round(v * scale)) for v in values]
+    packer = struct.Struct(f'<{len(values)}{code}')
+    return bytes((FRAME_MAGIC, kind)) + packer.pack(*values)
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from orientation import rpy_to_quaternion_batch
+from reprocess_raw import load_raw_session, sto_name_for, write_sto
+
+# Host-side re-filtering of raw roll/pitch/yaw captures.
+#
+# The ESP32 filters on board, so a data_raw_*.txt holds its filtered output and changing the filter used to mean
+# recapturing. This stage re-filters the recording instead and regenerates the quaternion .sto, every step one
+# NumPy pass over all IMUs and channels at once:
+#   1. yaw unwrap     roll and yaw are unwrapped, so a step from +179 to -179 deg is 2 deg, not a 358 deg jump
+#   2. outliers       Hampel filter: a sample further than OUTLIER_SIGMAS robust standard deviations (1.4826 * MAD)
+#                     and OUTLIER_MIN_DEGREES from the median of its OUTLIER_WINDOW neighbours is replaced by that median
+#   3. smoothing      zero-phase Gaussian: a symmetric kernel of SMOOTH_SECONDS standard deviation, centred on
+#                     every sample, so the filtered motion is not delayed
+# Angles are wrapped back to (-180, 180] afterwards. The whole archive runs across a process pool.
+#
+#   python refilter.py                                  # every raw file in data/ -> data/filtered/
+#   python refilter.py --smooth 0.15 --outlier-sigmas 4 data/data_raw_2024_11_07_17_55.txt
+
+FILEPATH = os.path.dirname(__file__)
+OUTPUT_DIRECTORY = os.path.join(FILEPATH, 'data', 'filtered')
+SMOOTH_SECONDS = 0.1        # Standard deviation of the Gaussian smoothing, 0 to disable
+OUTLIER_WINDOW = 7          # Samples in the Hampel window (odd), 0 to disable
+OUTLIER_SIGMAS = 3.0        # Robust standard deviations from the window median that make a sample an outlier
+OUTLIER_MIN_DEGREES = 2.0   # Smaller deviations are never outliers (the 0.01 deg steps of a still IMU have a tiny MAD)
+UNWRAP_CHANNELS = (0, 2)    # Roll and yaw wrap at +-180 deg, pitch stays within +-90 deg
+
+def unwrap_angles(rpy, channels=UNWRAP_CHANNELS):
+    rpy = np.array(rpy, dtype=np.float64)
+    for channel in channels:
+        rpy[:, :, channel] = np.unwrap(rpy[:, :, channel], period=360.0, axis=0)
+    return rpy
+
+def wrap_angles(rpy):
+    return 180.0 - np.mod(180.0 - rpy, 360.0)
+
+# Hampel filter along time (axis 0), returns (filtered values, outlier mask)
+def reject_outliers(values, window=OUTLIER_WINDOW, sigmas=OUTLIER_SIGMAS, min_degrees=OUTLIER_MIN_DEGREES):
+    half = window // 2
+    if half < 1 or len(values) < 2:
+        return values, np.zeros(values.shape, dtype=bool)
+    padded = np.pad(values, [(half, half)] + [(0, 0)] * (values.ndim - 1), mode='edge')
+    windows = sliding_window_view(padded, 2 * half + 1, axis=0)
+    median = np.median(windows, axis=-1)
+    mad = np.median(np.abs(windows - median[..., None]), axis=-1)
+    deviation = np.abs(values - median)
+    outliers = (deviation > sigmas * 1.4826 * mad) & (deviation > min_degrees)
+    return np.where(outliers, median, values), outliers
+
+# Zero-phase Gaussian smoothing along time (axis 0), sigma in samples
+def gaussian_smooth(values, sigma):
+    if sigma < 0.5 or len(values) < 2:
+        return values
+    half = int(np.ceil(3 * sigma))
+    x = np.arange(-half, half + 1)
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    kernel /= kernel.sum()
+    padded = np.pad(values, [(half, half)] + [(0, 0)] * (values.ndim - 1), mode='edge')
+    return sliding_window_view(padded, 2 * half + 1, axis=0) @ kernel
+
+# Re-filter (N, IMUs, 3) roll/pitch/yaw in degrees, returns (filtered rpy, number of outliers replaced)
+def filter_rpy(times, rpy, smooth_seconds=SMOOTH_SECONDS, outlier_window=OUTLIER_WINDOW, outlier_sigmas=OUTLIER_SIGMAS):
+    unwrapped = unwrap_angles(rpy)
+    cleaned, outliers = reject_outliers(unwrapped, outlier_window, outlier_sigmas)
+    steps = np.diff(times)
+    steps = steps[steps > 0]
+    if smooth_seconds and len(steps):
+        cleaned = gaussian_smooth(cleaned, smooth_seconds / np.median(steps))
+    return wrap_angles(cleaned), int(outliers.sum())
+
+def refilter(raw_filename, sto_filename, smooth_seconds=SMOOTH_SECONDS, outlier_window=OUTLIER_WINDOW,
+             outlier_sigmas=OUTLIER_SIGMAS):
+    labels, times, rpy = load_raw_session(raw_filename)
+    filtered, outliers = filter_rpy(times, rpy, smooth_seconds, outlier_window, outlier_sigmas)
+    write_sto(sto_filename, labels, times, rpy_to_quaternion_batch(filtered))
+    return len(times), outliers
+
+def _refilter_job(raw_filename, output_directory, options):
+    sto_filename = os.path.join(output_directory, os.path.basename(sto_name_for(raw_filename)))
+    try:
+        return raw_filename, refilter(raw_filename, sto_filename, *options), None
+    except ValueError as e:
+        return raw_filename, None, e
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-filter raw roll/pitch/yaw recordings and regenerate their .sto')
+    parser.add_argument('raw_files', nargs='*', help='data_raw_*.txt files (default: every raw file in data/)')
+    parser.add_argument('--output-dir', default=OUTPUT_DIRECTORY)
+    parser.add_argument('--smooth', type=float, default=SMOOTH_SECONDS, help='Gaussian sigma in seconds, 0 to disable')
+    parser.add_argument('--outlier-window', type=int, default=OUTLIER_WINDOW, help='Hampel window in samples, 0 to disable')
+    parser.add_argument('--outlier-sigmas', type=float, default=OUTLIER_SIGMAS)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    args = parser.parse_args()
+
+    raw_files = args.raw_files or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_raw_*.txt')))
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = (args.smooth, args.outlier_window, args.outlier_sigmas)
+    start = time.perf_counter()
+    samples = replaced = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        jobs = [executor.submit(_refilter_job, raw_filename, args.output_dir, options) for raw_filename in raw_files]
+        for job in jobs:
+            raw_filename, result, error = job.result()
+            if error is not None:
+                print(f"Skipping {error}")
+                continue
+            n, outliers = result
+            samples += n
+            replaced += outliers
+            print(f"{os.path.basename(raw_filename)}: {n} samples, {outliers} outlier values replaced")
+    print(f"{len(raw_files)} recordings, {samples} samples, {replaced} outliers in {time.perf_counter() - start:.2f}s "
+          f"-> {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
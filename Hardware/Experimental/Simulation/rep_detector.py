@@ -0,0 +1,176 @@
+import argparse
+import glob
+import json
+import math
+import os
+from collections import namedtuple
+
+from joint_angles import session_joint_angles_array
+
+# Streaming repetition and hold-time detector over the knee angle.
+#
+# A rep starts when the angle rises to start_angle and ends when it falls back below start_angle - hysteresis.
+# While it lasts, the peak angle and the longest hold at the target are tracked: the time spent at or above
+# target_angle, where only a drop of hysteresis below the target breaks the hold (so noise does not split it)
+# and time inside that band counts for nothing. Every sample is O(1) work and
+# O(1) memory; only the finished reps are kept, one small record each, so a session reduces to a handful of
+# summaries that can be stored and uploaded instead of every angle.
+#
+#   detector = RepDetector(target_angle=60, hold_time=2, on_rep=print)
+#   rep = detector.update(t, angle)        # a Rep when a repetition just ended, otherwise None
+#   detector.finish()                      # closes a rep still in progress at the end of the session
+#   detector.summary()                     # {'num_reps': ..., 'max_angle_achieved': ..., ...}
+
+FILEPATH = os.path.dirname(__file__)
+TARGET_ANGLE = 60.0     # Degrees of flexion a rep should reach (the treatment plan's daily angle)
+HOLD_TIME = 2.0         # Seconds to hold at the target (the treatment plan's hold time)
+START_ANGLE = 20.0      # Flexion that starts a rep
+HYSTERESIS = 5.0        # Degrees below a threshold before crossing back counts
+MIN_DURATION = 0.5      # Shorter excursions are noise, not reps
+
+# One finished repetition, times in seconds and angles in degrees
+#   hold_seconds  longest time at or above the target within one unbroken hold
+#   on_target     peak reached the target and was held for hold_time
+Rep = namedtuple('Rep', 'index start end duration peak_angle peak_time hold_seconds on_target')
+
+class RepDetector:
+    __slots__ = ('target_angle', 'hold_time', 'start_angle', 'hysteresis', 'min_duration', 'on_rep', 'reps',
+                 'samples', 'first_time', 'last_time', 'last_angle', 'max_angle', 'in_rep', '_start', '_peak',
+                 '_peak_time', '_above', '_hold', '_longest_hold')
+
+    def __init__(self, target_angle=TARGET_ANGLE, hold_time=HOLD_TIME, start_angle=START_ANGLE,
+                 hysteresis=HYSTERESIS, min_duration=MIN_DURATION, on_rep=None):
+        if start_angle - hysteresis >= target_angle:
+            raise ValueError(f"start_angle - hysteresis ({start_angle - hysteresis}) must be below the target ({target_angle})")
+        self.target_angle = target_angle
+        self.hold_time = hold_time
+        self.start_angle = start_angle
+        self.hysteresis = hysteresis
+        self.min_duration = min_duration
+        self.on_rep = on_rep
+        self.reps = []
+        self.reset()
+
+    def reset(self):
+        self.reps.clear()
+        self.samples = 0
+        self.first_time = self.last_time = self.last_angle = None
+        self.max_angle = None
+        self.in_rep = False
+        self._start = self._peak = self._peak_time = None
+        self._above = False
+        self._hold = self._longest_hold = 0.0
+
+    def _begin(self, t, angle):
+        self.in_rep = True
+        self._start = self._peak_time = t
+        self._peak = angle
+        self._above = angle >= self.target_angle
+        self._hold = self._longest_hold = 0.0
+
+    def _end(self, t):
+        self.in_rep = False
+        duration = t - self._start
+        if duration < self.min_duration:
+            return None
+        rep = Rep(len(self.reps) + 1, self._start, t, duration, self._peak, self._peak_time, self._longest_hold,
+                  self._peak >= self.target_angle and self._longest_hold >= self.hold_time)
+        self.reps.append(rep)
+        if self.on_rep is not None:
+            self.on_rep(rep)
+        return rep
+
+    def update(self, t, angle):
+        if angle is None or math.isnan(angle):
+            return None
+        previous, previous_angle = self.last_time, self.last_angle
+        self.samples += 1
+        if self.first_time is None:
+            self.first_time = t
+        self.last_time = t
+        self.last_angle = angle
+        if self.max_angle is None or angle > self.max_angle:
+            self.max_angle = angle
+
+        if not self.in_rep:
+            if angle >= self.start_angle:
+                self._begin(t, angle)
+            return None
+
+        # The time since the previous sample counts towards the hold if the angle was on target over it; inside
+        # the hysteresis band below the target the hold is not broken but gains no time
+        if self._above and previous_angle >= self.target_angle:
+            self._hold += t - previous
+            if self._hold > self._longest_hold:
+                self._longest_hold = self._hold
+        if angle > self._peak:
+            self._peak, self._peak_time = angle, t
+        if angle >= self.target_angle:
+            self._above = True
+        elif self._above and angle < self.target_angle - self.hysteresis:
+            self._above = False
+            self._hold = 0.0
+
+        if angle < self.start_angle - self.hysteresis:
+            return self._end(t)
+        return None
+
+    # End of the session: a rep still in progress ends at the last sample
+    def finish(self):
+        if self.in_rep:
+            return self._end(self.last_time)
+        return None
+
+    # Session totals, with the patient_data fields the dashboard shows
+    def summary(self):
+        durations = [rep.duration for rep in self.reps]
+        return {'num_reps': len(self.reps),
+                'reps_on_target': sum(rep.on_target for rep in self.reps),
+                'max_angle_achieved': round(self.max_angle, 2) if self.max_angle is not None else None,
+                'best_hold': round(max((rep.hold_seconds for rep in self.reps), default=0.0), 3),
+                'mean_rep_duration': round(sum(durations) / len(durations), 3) if durations else None,
+                'session_duration': round(self.last_time - self.first_time, 3) if self.samples else 0.0}
+
+# The per-rep summaries of a session as JSON, a few hundred bytes instead of every angle
+def write_reps(filename, detector, session=None):
+    document = {'session': session, 'target_angle': detector.target_angle, 'hold_time': detector.hold_time,
+                'summary': detector.summary(),
+                'reps': [{field: round(value, 3) if isinstance(value, float) else value
+                          for field, value in rep._asdict().items()} for rep in detector.reps]}
+    with open(filename, 'w') as file:
+        json.dump(document, file, indent=1)
+    return document
+
+def main():
+    parser = argparse.ArgumentParser(description='Count repetitions and hold times in recorded sessions')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/)')
+    parser.add_argument('--target', type=float, default=TARGET_ANGLE, help='target flexion in degrees')
+    parser.add_argument('--hold', type=float, default=HOLD_TIME, help='hold time at the target in seconds')
+    parser.add_argument('--output-dir', help='write reps_<session>.json files here')
+    args = parser.parse_args()
+
+    sessions = args.sessions or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto')))
+    detector = RepDetector(args.target, args.hold)
+    for sto_filename in sessions:
+        try:
+            labels, times, angles = session_joint_angles_array(sto_filename, sides=('r',))
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        if not labels:
+            continue
+        detector.reset()
+        for t, angle in zip(times.tolist(), angles[:, labels.index('knee_flexion_r')].tolist()):
+            detector.update(t, angle)
+        detector.finish()
+
+        stem = os.path.splitext(os.path.basename(sto_filename))[0]
+        summary = detector.summary()
+        print(f"{stem}: {summary['num_reps']} reps ({summary['reps_on_target']} on target), "
+              f"max {summary['max_angle_achieved']} deg, best hold {summary['best_hold']}s, {len(times)} samples")
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            write_reps(os.path.join(args.output_dir, f'reps_{stem}.json'), detector, stem)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import glob
+import io
+import os
+import numpy as np
+
+from orientation import rpy_to_quaternion_batch
+
+# Offline reprocessing: rebuild the quaternion .sto of a whole session from its data_raw_*.txt in one pass
+#
+# The output reproduces what the capture scripts wrote: times keep the precision of the raw file (%.3f up to
+# data_2024_11_07_17_38, %.5f after), and an IMU column that was never filled (0,0,0 in the raw file, the
+# left-leg placeholders of 3 IMU captures) stays 0,0,0,0 instead of becoming the identity quaternion.
+# --check compares against the recorded .sto files. Every session matches except data_2024_11_05_18_09,
+# whose .sto is a 6 row file with one repeated orientation and hand edited times, not a capture of its raw
+# file, and data_2024_11_06_16_53, which has no .sto and whose raw file cannot be parsed.
+
+FILEPATH = os.path.dirname(__file__)
+OUTPUT_DIRECTORY = os.path.join(FILEPATH, 'data', 'reprocessed')    # Kept apart from the recorded .sto files
+FILE_HEADER = '''DataType=Quaternion
+endheader'''
+TIME_FORMAT = '%.5f'    # Time column format of new files (the raw file's own precision when reprocessing)
+
+# Load a data_raw_*.txt file into (labels, times of shape (N,), rpy of shape (N, IMUs, 3))
+def load_raw_session(filename):
+    with open(filename) as file:
+        labels = file.readline().strip().split('\t')[1:]
+        text = file.read()
+
+    try:
+        values = np.array(text.replace(',', ' ').split(), dtype=np.float64)
+    except ValueError as e:
+        raise ValueError(f"{filename}: {e}") from None
+    n_cols = 1 + 3 * len(labels)
+    if values.size % n_cols != 0:
+        raise ValueError(f"{filename}: expected {n_cols} values per row")
+    if values.size == 0:
+        raise ValueError(f"{filename}: no samples")
+    values = values.reshape(-1, n_cols)
+    return labels, values[:, 0], values[:, 1:].reshape(len(values), len(labels), 3)
+
+# The time format of a raw file, '%.3f' or '%.5f' depending on the capture script that wrote it
+def raw_time_format(filename):
+    with open(filename) as file:
+        file.readline()
+        first = file.readline().split('\t', 1)[0]
+    decimals = len(first.partition('.')[2])
+    return f'%.{decimals}f' if decimals else TIME_FORMAT
+
+# Write quaternions of shape (N, IMUs, 4) to an OpenSim orientation .sto
+def write_sto(filename, labels, times, quats, time_format=TIME_FORMAT):
+    rows = np.concatenate([times[:, None], quats.reshape(len(times), -1)], axis=1)
+    fmt = time_format + '\t%.6f,%.6f,%.6f,%.6f' * len(labels)
+    header = f"{FILE_HEADER}\ntime\t" + '\t'.join(labels)
+    np.savetxt(filename, rows, fmt=fmt, header=header, comments='')
+
+# Quaternions of a raw session as the capture scripts computed them, unfilled (0,0,0) IMUs stay 0,0,0,0
+def session_quaternions(rpy):
+    quats = rpy_to_quaternion_batch(rpy)
+    quats[np.all(rpy == 0, axis=-1)] = 0
+    return quats
+
+def reprocess(raw_filename, sto_filename):
+    labels, times, rpy = load_raw_session(raw_filename)
+    write_sto(sto_filename, labels, times, session_quaternions(rpy), raw_time_format(raw_filename))
+    return len(times)
+
+# Compare the reprocessed .sto text with the recorded one, returns None or the first differing line
+def check(raw_filename, recorded_filename):
+    output = io.StringIO()
+    labels, times, rpy = load_raw_session(raw_filename)
+    write_sto(output, labels, times, session_quaternions(rpy), raw_time_format(raw_filename))
+    with open(recorded_filename) as file:
+        recorded = [line.rstrip() for line in file if line.strip()]
+    reprocessed = [line.rstrip() for line in output.getvalue().splitlines() if line.strip()]
+    for i, (ours, theirs) in enumerate(zip(reprocessed, recorded)):
+        if ours != theirs:
+            return f"line {i + 1}: {theirs!r} recorded, {ours!r} reprocessed"
+    if len(reprocessed) != len(recorded):
+        return f"{len(recorded)} lines recorded, {len(reprocessed)} reprocessed"
+    return None
+
+def sto_name_for(raw_filename):
+    directory, name = os.path.split(raw_filename)
+    return os.path.join(directory, name.replace('data_raw_', 'data_', 1).replace('.txt', '.sto'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Regenerate quaternion .sto files from raw roll/pitch/yaw captures')
+    parser.add_argument('raw_files', nargs='*', help='data_raw_*.txt files (default: every raw file in data/)')
+    parser.add_argument('--output-dir', default=OUTPUT_DIRECTORY, help='where the .sto files go (default: data/reprocessed/)')
+    parser.add_argument('--in-place', action='store_true', help='write next to each raw file, overwriting the recorded .sto')
+    parser.add_argument('--suffix', default='', help='appended to the output name, e.g. _reprocessed')
+    parser.add_argument('--check', action='store_true', help='compare with the recorded .sto files instead of writing')
+    args = parser.parse_args()
+
+    raw_files = args.raw_files or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_raw_*.txt')))
+    if args.check:
+        mismatched = 0
+        for raw_filename in raw_files:
+            recorded_filename = sto_name_for(raw_filename)
+            if not os.path.exists(recorded_filename):
+                continue
+            try:
+                difference = check(raw_filename, recorded_filename)
+            except ValueError as e:
+                print(f"Skipping {e}")
+                continue
+            mismatched += difference is not None
+            print(f"{os.path.basename(raw_filename)}: {difference or 'matches'}")
+        print(f"{mismatched} of {len(raw_files)} sessions differ from their recorded .sto")
+        return
+    if not args.in_place:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for raw_filename in raw_files:
+        sto_filename = sto_name_for(raw_filename)
+        if not args.in_place:
+            sto_filename = os.path.join(args.output_dir, os.path.basename(sto_filename))
+        if args.suffix:
+            sto_filename = sto_filename[:-len('.sto')] + args.suffix + '.sto'
+        try:
+            n = reprocess(raw_filename, sto_filename)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        print(f"{os.path.basename(raw_filename)} -> {os.path.relpath(sto_filename)} ({n} samples)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import glob
+import os
+import numpy as np
+
+from orientation import quaternion_normalize
+from reprocess_raw import write_sto
+from storage_loader import load_orientations
+
+# Resample orientation sessions onto a uniform time grid before IK.
+#
+# Timestamps are taken on the host when a notification arrives, so spacing jitters and bursts deliver the same
+# frame several times a millisecond apart. Frames are first cleaned up:
+#   - frames whose time does not increase are dropped
+#   - inside a run of identical frames only the first and last are kept, which loses nothing since the
+#     orientation is constant in between
+# then every IMU's quaternion is SLERPed onto t0, t0 + 1/rate, ... in one vectorized pass, and written as an
+# IK-ready .sto. IMUInverseKinematicsTool then solves evenly spaced frames. With rate=None the grid runs at the
+# session's median rate, capped so it never has more frames than the deduplicated session; an explicit rate
+# is used as given and can add frames.
+#
+#   times, quats = resample_session(times, quats, rate=20)     # quats (N, IMUs, 4), rate=None: median rate
+
+FILEPATH = os.path.dirname(__file__)
+RESAMPLE_RATE = None        # Hz, None for each session's median rate, capped so no frames are added
+SLERP_LINEAR_THRESHOLD = 1e-6   # Below this angle (rad) between neighbours fall back to normalized linear interpolation
+
+# Indices of the frames to keep: strictly increasing times, without the inside of identical runs
+def deduplicate(times, quats):
+    times = np.asarray(times)
+    if len(times) == 0:
+        return np.arange(0)
+    increasing = np.ones(len(times), dtype=bool)
+    increasing[1:] = times[1:] > np.maximum.accumulate(times)[:-1]
+    index = np.flatnonzero(increasing)
+
+    flat = quats[index].reshape(len(index), -1)
+    same = (flat[1:] == flat[:-1]).all(axis=1)
+    interior = np.zeros(len(index), dtype=bool)
+    interior[1:-1] = same[:-1] & same[1:]
+    return index[~interior]
+
+# SLERP between quaternion arrays a and b (..., 4) by fractions u (...), shortest path
+def slerp(a, b, u):
+    u = np.asarray(u)[..., None]
+    dot = (a * b).sum(axis=-1, keepdims=True)
+    b = np.where(dot < 0, -b, b)
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    linear = sin_theta < SLERP_LINEAR_THRESHOLD
+    safe = np.where(linear, 1.0, sin_theta)
+    wa = np.where(linear, 1.0 - u, np.sin((1.0 - u) * theta) / safe)
+    wb = np.where(linear, u, np.sin(u * theta) / safe)
+    return wa * a + wb * b
+
+# Deduplicate and SLERP (times (N,), quats (N, IMUs, 4)) onto a uniform grid at rate Hz
+# Raises ValueError when fewer than two frames with increasing times are left, e.g. two frames at the same time
+def resample_session(times, quats, rate=RESAMPLE_RATE):
+    keep = deduplicate(times, quats)
+    times = np.asarray(times, dtype=np.float64)[keep]
+    quats = np.asarray(quats, dtype=np.float64)[keep]
+    if len(times) < 2 or times[-1] <= times[0]:
+        raise ValueError(f"no time span to resample, {len(times)} frame(s) left after dropping repeated times")
+    if rate is None:
+        # Jittered timestamps make the median step shorter than the mean one, which would add frames
+        rate = min(1.0 / np.median(np.diff(times)), (len(times) - 1) / (times[-1] - times[0]))
+
+    grid = times[0] + np.arange(int(np.floor((times[-1] - times[0]) * rate)) + 1) / rate
+    right = np.clip(np.searchsorted(times, grid, side='right'), 1, len(times) - 1)
+    left = right - 1
+    u = np.clip((grid - times[left]) / (times[right] - times[left]), 0.0, 1.0)
+
+    a, b = quats[left], quats[right]
+    # All-zero quaternions (IMU not connected yet) cannot be interpolated, hold the nearest frame instead
+    missing = (np.linalg.norm(a, axis=-1) == 0) | (np.linalg.norm(b, axis=-1) == 0)
+    u = np.broadcast_to(u[:, None], missing.shape)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        resampled = quaternion_normalize(slerp(a, b, u))
+    nearest = np.where((u < 0.5)[..., None], a, b)
+    resampled = np.where(missing[..., None], nearest, resampled)
+    return grid, resampled
+
+def resample_sto(sto_filename, output_filename, rate=RESAMPLE_RATE):
+    labels, times, quats = load_orientations(sto_filename)
+    try:
+        grid, resampled = resample_session(times, quats, rate)
+    except ValueError as e:
+        raise ValueError(f"{sto_filename}: {e}") from None
+    write_sto(output_filename, labels, grid, resampled)
+    return len(times), len(grid)
+
+def main():
+    parser = argparse.ArgumentParser(description='Resample orientation .sto files onto a uniform grid for IK')
+    parser.add_argument('sessions', nargs='*', help='.sto files (default: every session in data/)')
+    parser.add_argument('--rate', type=float, default=RESAMPLE_RATE, help="Hz (default: each session's median rate)")
+    parser.add_argument('--output-dir', default=os.path.join(FILEPATH, 'data', 'resampled'))
+    args = parser.parse_args()
+
+    sessions = args.sessions or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto')))
+    os.makedirs(args.output_dir, exist_ok=True)
+    before = after = 0
+    for sto_filename in sessions:
+        output_filename = os.path.join(args.output_dir, os.path.basename(sto_filename))
+        try:
+            n_in, n_out = resample_sto(sto_filename, output_filename, args.rate)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        before += n_in
+        after += n_out
+        print(f"{os.path.basename(sto_filename)}: {n_in} -> {n_out} frames")
+    print(f"{before} frames -> {after} frames")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import bisect
+import glob
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+from reprocess_raw import load_raw_session, write_sto
+from storage_loader import load_orientations
+
+# Compressed, chunked binary archive of a recorded session (.sarc).
+#
+# Samples are cut into fixed-duration chunks (chunk_seconds of recording each). Every chunk holds the float64
+# times and the float32 values (quaternion w, x, y, z or roll, pitch, yaw per IMU), byte-shuffled and zlib
+# compressed. An index at the end of the file keeps each chunk's time range and byte range, so reading any
+# [start, end] window only decompresses the chunks that overlap it.
+#
+#   file    MAGIC, chunk, chunk, ..., index (JSON), footer
+#   footer  struct '<Q8s': byte offset of the index, MAGIC
+#
+#   sto_to_archive('data/data_2024_11_07_17_06.sto', 'data_2024_11_07_17_06.sarc')
+#   with SessionArchive('data_2024_11_07_17_06.sarc') as archive:
+#       times, quats = archive.read(5.0, 10.0)            # quats (N, IMUs, 4)
+#   archive_to_sto('data_2024_11_07_17_06.sarc', 'window.sto', 5.0, 10.0)
+
+FILEPATH = os.path.dirname(__file__)
+OUTPUT_DIRECTORY = os.path.join(FILEPATH, 'data', 'archives')     # Kept apart from the recorded sessions
+MAGIC = b'MMSARC1\n'
+FOOTER = struct.Struct('<Q8s')
+ARCHIVE_VERSION = 1
+CHUNK_SECONDS = 10.0
+COMPRESSION_LEVEL = 6
+KIND_WIDTHS = {'quaternion': 4, 'rpy': 3}
+
+# Group the bytes of each float by significance, which compresses much better than interleaved floats
+def _shuffle(array):
+    return array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+def _unshuffle(data, dtype, count):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+class ArchiveWriter:
+    def __init__(self, filename, labels, kind='quaternion', chunk_seconds=CHUNK_SECONDS, level=COMPRESSION_LEVEL):
+        if kind not in KIND_WIDTHS:
+            raise ValueError(f"unknown archive kind {kind!r}, expected one of {sorted(KIND_WIDTHS)}")
+        self.filename = filename
+        self.labels = list(labels)
+        self.kind = kind
+        self.width = KIND_WIDTHS[kind]
+        self.chunk_seconds = chunk_seconds
+        self.level = level
+
+        self.chunks = []        # [t0, t1, rows, offset, nbytes]
+        self._times = []
+        self._values = []
+        self._chunk_start = None
+        self._chunk_id = None
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Append samples: times (N,) and values (N, IMUs, width)
+    def append(self, times, values):
+        times = np.asarray(times, dtype=np.float64).reshape(-1)
+        values = np.asarray(values, dtype=np.float32).reshape(len(times), len(self.labels), self.width)
+        if not len(times):
+            return
+        # Chunks are cut on the chunk_seconds grid starting at the first sample
+        if self._chunk_start is None:
+            self._chunk_start = times[0]
+        chunk_ids = np.floor((times - self._chunk_start) / self.chunk_seconds)
+        if self._chunk_id is not None and chunk_ids[0] != self._chunk_id:
+            self._write_chunk()
+        cuts = (np.flatnonzero(np.diff(chunk_ids)) + 1).tolist()
+        for i, (start, stop) in enumerate(zip([0] + cuts, cuts + [len(times)])):
+            if i:
+                self._write_chunk()
+            self._times.append(times[start:stop])
+            self._values.append(values[start:stop])
+        self._chunk_id = chunk_ids[-1]
+
+    def _write_chunk(self):
+        if not self._times:
+            return
+        times = np.concatenate(self._times)
+        values = np.ascontiguousarray(np.concatenate(self._values))
+        self._times, self._values = [], []
+        payload = zlib.compress(_shuffle(times) + _shuffle(values), self.level)
+        offset = self._file.tell()
+        self._file.write(payload)
+        self.chunks.append([float(times[0]), float(times[-1]), len(times), offset, len(payload)])
+
+    def close(self):
+        if self._file is None:
+            return
+        self._write_chunk()
+        index = {'version': ARCHIVE_VERSION, 'kind': self.kind, 'labels': self.labels, 'width': self.width,
+                 'chunk_seconds': self.chunk_seconds, 'chunks': self.chunks}
+        offset = self._file.tell()
+        self._file.write(json.dumps(index).encode())
+        self._file.write(FOOTER.pack(offset, MAGIC))
+        self._file.close()
+        self._file = None
+
+class SessionArchive:
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename}: not a session archive")
+            end = self._file.seek(0, os.SEEK_END)
+            if end < len(MAGIC) + FOOTER.size:
+                raise ValueError(f"{filename}: truncated session archive (no index)")
+            self._file.seek(end - FOOTER.size)
+            offset, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{filename}: truncated session archive (no index)")
+            self._file.seek(offset)
+            index = json.loads(self._file.read(end - FOOTER.size - offset))
+        except Exception:
+            self._file.close()
+            raise
+
+        self.kind = index['kind']
+        self.labels = index['labels']
+        self.width = index['width']
+        self.chunk_seconds = index['chunk_seconds']
+        self.chunks = index['chunks']
+        self._chunk_starts = [chunk[0] for chunk in self.chunks]
+        self._chunk_ends = [chunk[1] for chunk in self.chunks]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return sum(chunk[2] for chunk in self.chunks)
+
+    @property
+    def time_range(self):
+        if not self.chunks:
+            return None
+        return self.chunks[0][0], self.chunks[-1][1]
+
+    def _read_chunk(self, chunk):
+        t0, t1, rows, offset, nbytes = chunk
+        self._file.seek(offset)
+        data = zlib.decompress(self._file.read(nbytes))
+        split = rows * 8
+        times = _unshuffle(data[:split], np.float64, rows)
+        values = _unshuffle(data[split:], np.float32, rows * len(self.labels) * self.width)
+        return times, values.reshape(rows, len(self.labels), self.width)
+
+    # Samples with start <= t <= end (None for open ends): times (N,), values (N, IMUs, width) float32
+    def read(self, start=None, end=None):
+        first = 0 if start is None else bisect.bisect_left(self._chunk_ends, start)
+        last = len(self.chunks) if end is None else bisect.bisect_right(self._chunk_starts, end)
+        parts = [self._read_chunk(chunk) for chunk in self.chunks[first:last]]
+        if not parts:
+            return np.empty(0), np.empty((0, len(self.labels), self.width), dtype=np.float32)
+
+        times = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        keep = slice(None if start is None else np.searchsorted(times, start, 'left'),
+                     None if end is None else np.searchsorted(times, end, 'right'))
+        return times[keep], values[keep]
+
+################################# CONVERTERS ################################################
+
+def sto_to_archive(sto_filename, archive_filename, chunk_seconds=CHUNK_SECONDS):
+    labels, times, quats = load_orientations(sto_filename)
+    with ArchiveWriter(archive_filename, labels, 'quaternion', chunk_seconds) as writer:
+        writer.append(times, quats)
+    return len(times)
+
+def raw_to_archive(raw_filename, archive_filename, chunk_seconds=CHUNK_SECONDS):
+    labels, times, rpy = load_raw_session(raw_filename)
+    with ArchiveWriter(archive_filename, labels, 'rpy', chunk_seconds) as writer:
+        writer.append(times, rpy)
+    return len(times)
+
+# Write the [start, end] window of a quaternion archive as an orientation .sto for the OpenSim tools. The values
+# match the recording (float32 keeps the 6 decimals written), the text does not: times are written as %.5f.
+# An empty window (or an archive of a session without samples) is a ValueError, IK cannot run on it.
+def archive_to_sto(archive_filename, sto_filename, start=None, end=None):
+    with SessionArchive(archive_filename) as archive:
+        if archive.kind != 'quaternion':
+            raise ValueError(f"{archive_filename}: {archive.kind} archive, expected quaternion")
+        times, quats = archive.read(start, end)
+        if not len(times):
+            window = '' if start is None and end is None else f" between {start} and {end}"
+            raise ValueError(f"{archive_filename}: no samples{window}")
+        write_sto(sto_filename, archive.labels, times, quats.astype(np.float64))
+    return len(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack recorded sessions into compressed .sarc archives, or unpack a window to .sto')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='.sto or data_raw_*.txt files to .sarc')
+    pack.add_argument('files', nargs='*', help='default: every .sto session in data/')
+    pack.add_argument('--output-dir', default=OUTPUT_DIRECTORY, help='default: data/archives/')
+    pack.add_argument('--chunk-seconds', type=float, default=CHUNK_SECONDS)
+    unpack = commands.add_parser('unpack', help='a time window of a quaternion .sarc to .sto')
+    unpack.add_argument('archive')
+    unpack.add_argument('output')
+    unpack.add_argument('--start', type=float)
+    unpack.add_argument('--end', type=float)
+    args = parser.parse_args()
+
+    if args.command == 'unpack':
+        try:
+            n = archive_to_sto(args.archive, args.output, args.start, args.end)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            return
+        print(f"{n} samples -> {args.output}")
+        return
+
+    files = args.files or sorted(glob.glob(os.path.join(FILEPATH, 'data', 'data_2*.sto')))
+    os.makedirs(args.output_dir, exist_ok=True)
+    text_bytes = archive_bytes = 0
+    for filename in files:
+        archive_filename = os.path.join(args.output_dir, os.path.splitext(os.path.basename(filename))[0] + '.sarc')
+        convert = raw_to_archive if filename.endswith('.txt') else sto_to_archive
+        try:
+            n = convert(filename, archive_filename, args.chunk_seconds)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        text_bytes += os.path.getsize(filename)
+        archive_bytes += os.path.getsize(archive_filename)
+        print(f"{os.path.basename(filename)} -> {os.path.basename(archive_filename)} ({n} samples)")
+    if archive_bytes:
+        print(f"{text_bytes:,} bytes of text -> {archive_bytes:,} bytes archived ({text_bytes / archive_bytes:.1f}x smaller)")
+
+if __name__ == '__main__':
+    main()
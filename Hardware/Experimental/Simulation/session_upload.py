@@ -0,0 +1,347 @@
+import argparse
+import glob
+import gzip
+import http.client
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import numpy as np
+
+from storage_loader import load_orientations
+
+# Upload finished capture sessions to the dashboard backend.
+#
+# Every session is cut into batches of batch_rows samples, and every batch is written to a local outbox as the
+# gzip-compressed JSON request body it will be sent as. That happens before anything goes over the network, and
+# each file is written and renamed into place, so a batch is either fully in the outbox or not at all. flush()
+# then POSTs the outbox in order over one kept-alive HTTP connection and deletes a batch once the server
+# acknowledges it. Each batch carries an Idempotency-Key (patient, session name and batch number), so a batch
+# that is resent after a lost acknowledgement is recognised by the server instead of stored twice, while two
+# patients' sessions with the same file name stay separate uploads. When the server is
+# unreachable, flush() retries with backoff and then stops, leaving the outbox for the next run: going offline
+# delays an upload but never loses it.
+#
+#   outbox/<entry>/<seq>.json.gz        pending batches, deleted once acknowledged
+#   outbox/<entry>/ENQUEUED             written after the last batch, so a half-enqueued session is redone
+#   outbox/uploaded.txt                 entries fully uploaded, never enqueued again
+#   <entry> is patient<id>_<session>, or <session> when no patient id is given; <entry>/<seq> is the key
+#
+#   python session_upload.py --url http://localhost:8080/upload_session --patient-id 3
+#   python session_upload.py --stand-in                 # upload to a local StandInServer
+#   python session_upload.py --reps data/reps_*.json     # only the per-rep summaries (see rep_detector.py)
+
+FILEPATH = os.path.dirname(__file__)
+OUTBOX_DIRECTORY = os.path.join(FILEPATH, 'data', 'outbox')
+UPLOAD_URL = 'http://localhost:8080/upload_session'
+BATCH_ROWS = 2000           # Samples per request, ~40 s of a 50 Hz capture
+COMPRESSION_LEVEL = 6
+TIMEOUT = 10.0              # Seconds per request
+MAX_RETRIES = 5             # Attempts per batch before flush() gives up until the next run
+RETRY_DELAY = 0.5           # Doubled after every failed attempt
+ENQUEUED_MARKER = 'ENQUEUED'
+UPLOADED_LOG = 'uploaded.txt'
+
+def _write_atomic(filename, data):
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+
+def session_name(sto_filename):
+    return os.path.splitext(os.path.basename(sto_filename))[0]
+
+# Outbox entry of a session, which also starts each batch's Idempotency-Key
+def outbox_entry(filename, patient_id):
+    name = session_name(filename)
+    return name if patient_id is None else f"patient{patient_id}_{name}"
+
+# JSON bodies of one session, batch_rows samples each
+# A header-only session is one batch without rows, so it is uploaded once instead of failing on every run
+def session_batches(sto_filename, patient_id, batch_rows=BATCH_ROWS):
+    labels, times, quats = load_orientations(sto_filename)
+    name = session_name(sto_filename)
+    count = max(1, -(-len(times) // batch_rows))
+    for seq in range(count):
+        window = slice(seq * batch_rows, (seq + 1) * batch_rows)
+        rows = np.column_stack((times[window], quats[window].reshape(-1, 4 * len(labels))))
+        yield seq, {'session': name, 'patient_id': patient_id, 'seq': seq, 'batches': count,
+                    'labels': labels, 'rows': np.round(rows, 6).tolist()}
+
+class Outbox:
+    def __init__(self, directory=OUTBOX_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def uploaded(self):
+        log = os.path.join(self.directory, UPLOADED_LOG)
+        if not os.path.exists(log):
+            return set()
+        with open(log) as file:
+            return set(file.read().split())
+
+    def is_enqueued(self, name):
+        return os.path.exists(os.path.join(self.directory, name, ENQUEUED_MARKER))
+
+    # Write the (seq, body) batches of name, returns the number of batches (0 if it is already queued or uploaded)
+    def _enqueue_batches(self, name, batches):
+        if name in self.uploaded() or self.is_enqueued(name):
+            return 0
+        session_directory = os.path.join(self.directory, name)
+        os.makedirs(session_directory, exist_ok=True)
+        count = 0
+        for seq, body in batches:
+            data = gzip.compress(json.dumps(body, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+            _write_atomic(os.path.join(session_directory, f'{seq:05d}.json.gz'), data)
+            count += 1
+        _write_atomic(os.path.join(session_directory, ENQUEUED_MARKER), b'')
+        return count
+
+    def enqueue(self, sto_filename, patient_id, batch_rows=BATCH_ROWS):
+        return self._enqueue_batches(outbox_entry(sto_filename, patient_id), session_batches(sto_filename, patient_id, batch_rows))
+
+    # A reps_*.json written by rep_detector.py, uploaded as one small batch instead of the raw session
+    def enqueue_reps(self, reps_filename, patient_id):
+        with open(reps_filename) as file:
+            document = json.load(file)
+        document['patient_id'] = patient_id
+        return self._enqueue_batches(outbox_entry(reps_filename, patient_id), [(0, document)])
+
+    # (idempotency key, batch path) of every fully enqueued batch, in upload order
+    def pending(self):
+        batches = []
+        for name in sorted(os.listdir(self.directory)):
+            session_directory = os.path.join(self.directory, name)
+            if not self.is_enqueued(name):
+                continue
+            for filename in sorted(os.listdir(session_directory)):
+                if filename.endswith('.json.gz'):
+                    batches.append((f"{name}/{filename[:-len('.json.gz')]}", os.path.join(session_directory, filename)))
+        return batches
+
+    def acknowledge(self, path):
+        os.remove(path)
+        session_directory = os.path.dirname(path)
+        if any(f.endswith('.json.gz') for f in os.listdir(session_directory)):
+            return
+        # Last batch of the session: record it and drop its directory
+        with open(os.path.join(self.directory, UPLOADED_LOG), 'a') as file:
+            file.write(os.path.basename(session_directory) + '\n')
+        os.remove(os.path.join(session_directory, ENQUEUED_MARKER))
+        os.rmdir(session_directory)
+
+class Uploader:
+    def __init__(self, url=UPLOAD_URL, outbox=None, timeout=TIMEOUT, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"{url}: expected an http:// or https:// URL")
+        self.url = url
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._scheme, self._netloc = parts.scheme, parts.netloc
+        self._path = parts.path or '/'
+        self._connection = None
+
+        self.requests = 0
+        self.bytes_sent = 0         # Compressed request bodies
+        self.retries = 0
+        self.connections = 0
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        self._connection = connection_class(self._netloc, timeout=self.timeout)
+        self.connections += 1
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # POST one batch on the kept-alive connection, returns the response status
+    def _post(self, key, body):
+        if self._connection is None:
+            self._connect()
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'Idempotency-Key': key}
+        try:
+            self._connection.request('POST', self._path, body, headers)
+            response = self._connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # The server may have closed the kept-alive connection, reconnect on the next attempt
+            self.close()
+            raise
+        self.requests += 1
+        self.bytes_sent += len(body)
+        if response.will_close:
+            self.close()
+        return response.status
+
+    # Upload every pending batch in order. Returns the number acknowledged; stops early (leaving the rest in
+    # the outbox) when a batch still fails after max_retries attempts, e.g. while offline.
+    def flush(self):
+        sent = 0
+        for key, path in self.outbox.pending():
+            with open(path, 'rb') as file:
+                body = file.read()
+            delay = self.retry_delay
+            for attempt in range(self.max_retries):
+                try:
+                    status = self._post(key, body)
+                except (OSError, http.client.HTTPException) as e:
+                    status, error = None, e
+                else:
+                    error = f"HTTP {status}"
+                # 409: the server already has this batch from an earlier attempt
+                if status is not None and (200 <= status < 300 or status == 409):
+                    self.outbox.acknowledge(path)
+                    sent += 1
+                    break
+                if status is not None and 400 <= status < 500 and status not in (408, 429):
+                    # Retrying will not help, keep it for inspection and move on to the next batch
+                    print(f"{key}: rejected by {self.url} ({error}), kept in the outbox")
+                    break
+                self.retries += 1
+                if attempt + 1 < self.max_retries:
+                    time.sleep(delay)
+                    delay *= 2
+            else:
+                print(f"{key}: upload failed after {self.max_retries} attempts ({error}), kept in the outbox")
+                return sent
+        return sent
+
+################################# STAND-IN SERVER ################################################
+
+# Local stand-in for the upload endpoint of the dashboard backend, for tests and benchmarks.
+# Accepts gzip or plain JSON batches, stores each Idempotency-Key once (409 on a repeat) and counts requests,
+# connections and bytes received. fail_next makes the next N requests answer 503, lose_ack_next stores the next N
+# batches but drops the connection instead of answering, as if the acknowledgement was lost on the way back.
+class StandInServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.batches = {}
+        self.requests = 0
+        self.connections = 0
+        self.bytes_received = 0     # Request line, headers and body as received
+        self.duplicates = 0
+        self.fail_next = 0
+        self.lose_ack_next = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length)
+                with server._lock:
+                    server.requests += 1
+                    server.bytes_received += len(self.requestline) + 2 + len(bytes(self.headers)) + length
+                    if server.fail_next:
+                        server.fail_next -= 1
+                        self._reply(503)
+                        return
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                payload = json.loads(body)
+                key = self.headers.get('Idempotency-Key') or f"row-{server.requests}"
+                with server._lock:
+                    if key in server.batches:
+                        server.duplicates += 1
+                        self._reply(409)
+                        return
+                    server.batches[key] = payload
+                    if server.lose_ack_next:
+                        server.lose_ack_next -= 1
+                        self.close_connection = True
+                        return
+                self._reply(201)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f'http://{host}:{self._server.server_address[1]}/upload_session'
+        self._thread = None
+
+    # Number of samples received for a session
+    def rows(self, name):
+        return sum(len(batch.get('rows', [batch])) for batch in self.batches.values() if batch.get('session') == name)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stand-in-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue finished sessions in the outbox and upload them to the dashboard backend')
+    parser.add_argument('sessions', nargs='*', help='.sto files, or reps_*.json with --reps (default: every one in data/)')
+    parser.add_argument('--reps', action='store_true', help='upload per-rep summaries instead of the raw sessions')
+    parser.add_argument('--url', default=UPLOAD_URL)
+    parser.add_argument('--patient-id', type=int)
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    parser.add_argument('--outbox', default=OUTBOX_DIRECTORY)
+    parser.add_argument('--flush-only', action='store_true', help='only send what is already in the outbox')
+    parser.add_argument('--stand-in', action='store_true', help='upload to a local StandInServer instead of --url')
+    args = parser.parse_args()
+
+    outbox = Outbox(args.outbox)
+    if not args.flush_only:
+        pattern = 'reps_*.json' if args.reps else 'data_2*.sto'
+        sessions = args.sessions or sorted(glob.glob(os.path.join(FILEPATH, 'data', pattern)))
+        for sto_filename in sessions:
+            try:
+                if args.reps:
+                    count = outbox.enqueue_reps(sto_filename, args.patient_id)
+                else:
+                    count = outbox.enqueue(sto_filename, args.patient_id, args.batch_rows)
+            except ValueError as e:
+                print(f"Skipping {os.path.basename(sto_filename)}: {e}")
+                continue
+            if count:
+                print(f"{session_name(sto_filename)}: {count} batches queued")
+
+    stand_in = StandInServer().start() if args.stand_in else None
+    start = time.perf_counter()
+    with Uploader(stand_in.url if stand_in else args.url, outbox) as uploader:
+        sent = uploader.flush()
+    print(f"{sent} batches in {uploader.requests} requests over {uploader.connections} connection(s), "
+          f"{uploader.bytes_sent:,} bytes, {time.perf_counter() - start:.2f}s, {len(outbox.pending())} left in the outbox")
+    if stand_in is not None:
+        stand_in.stop()
+
+if __name__ == '__main__':
+    main()
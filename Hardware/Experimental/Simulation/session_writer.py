@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+# Buffered writer for the files of one capture session.
+#
+# The BLE callback calls enqueue(), which formats the row and queues its lines; file I/O happens on a
+# dedicated thread that keeps every file open and writes the buffered rows in one call once FLUSH_ROWS rows
+# are pending or FLUSH_INTERVAL seconds have passed. close() drains the queue and fsyncs each file.
+# Formatting stays on the caller because a writer thread formatting a burst of rows holds the GIL for up to
+# the 5 ms switch interval, which is what the callback then waits for; the writer thread only joins and writes.
+# A row format_row fails on is counted in format_errors and skipped. A failed write stops the thread and is
+# kept in error: later rows are counted in rows_dropped instead of raising inside the BLE callback, and the
+# error is raised from check() and close(), so rows are never lost silently.
+#
+#   files       list of (filename, header) pairs, the header is written when the writer starts
+#   format_row  called by enqueue() with its arguments, returns one line per file
+#   write_histogram  optional metrics.Histogram observing how long each batched write takes
+class SessionWriter:
+    FLUSH_ROWS = 256
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, files, format_row, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, write_histogram=None):
+        self.files = list(files)
+        self.format_row = format_row
+        self.write_histogram = write_histogram
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.format_errors = 0
+        self.rows_dropped = 0
+        self.error = None
+        self._queue = queue.SimpleQueue()
+        self._handles = []
+        self._thread = None
+
+    def start(self):
+        self._handles = [open(filename, 'w') for filename, _ in self.files]
+        for handle, (_, header) in zip(self._handles, self.files):
+            if header:
+                handle.write(header if header.endswith('\n') else header + '\n')
+        self._thread = threading.Thread(target=self._run, name='SessionWriter', daemon=True)
+        self._thread.start()
+        return self
+
+    # Called from the BLE callback: formats the row, no I/O and never raises
+    def enqueue(self, *row):
+        if self.error is not None:
+            self.rows_dropped += 1
+            return
+        try:
+            lines = self.format_row(*row)
+        except Exception as e:
+            self.format_errors += 1
+            print(f"Error formatting row {row}. Error: {e}")
+            return
+        self._queue.put(lines)
+
+    # Raise the writer thread's error, if any; call it outside the BLE callback
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        try:
+            if self.error is None:
+                for handle in self._handles:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+        finally:
+            for handle in self._handles:
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+            self._handles = []
+        self.check()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        try:
+            self._write_loop()
+        except Exception as e:
+            self.error = e
+            print(f"SessionWriter stopped, rows are no longer written. Error: {e}")
+
+    def _write_loop(self):
+        buffers = [[] for _ in self._handles]
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                lines = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                lines = None
+
+            if lines is _STOP:
+                self._flush(buffers, pending)
+                return
+
+            if lines is not None:
+                for buffer, line in zip(buffers, lines):
+                    buffer.append(line)
+                pending += 1
+
+            if pending >= self.flush_rows or (pending and time.monotonic() - last_flush >= self.flush_interval):
+                self._flush(buffers, pending)
+                pending = 0
+            if not pending:
+                last_flush = time.monotonic()
+
+    def _flush(self, buffers, pending):
+        start = time.perf_counter()
+        for handle, buffer in zip(self._handles, buffers):
+            if buffer:
+                handle.write(''.join(buffer))
+                handle.flush()
+                buffer.clear()
+        self.rows_written += pending
+        if self.write_histogram is not None and pending:
+            self.write_histogram.observe(time.perf_counter() - start)
@@ -0,0 +1,134 @@
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+
+# Columnar loader for OpenSim storage files straight into NumPy arrays.
+#
+#   labels, times, quats = load_orientations('data/data_2024_11_07_17_06.sto')     # quats (T, IMUs, 4) w, x, y, z
+#   labels, times, values = load_motion('IK_results/ik_data_2024_11_07_17_06.mot')  # values (T, coords)
+#
+# The first load parses the text and stores the (T, 1 + columns) float64 block, time first, as a .npy sidecar in
+# a .cache/ directory next to the source, with a small .json that records the labels and the source's mtime and
+# size. Later loads memory-map the sidecar instead of parsing; a sidecar whose recorded mtime or size no longer
+# matches the source is rebuilt. The returned arrays are read-only views when they come from the sidecar.
+
+FILEPATH = os.path.dirname(__file__)
+SIDECAR_DIRECTORY = '.cache'
+SIDECAR_VERSION = 1         # Bump when the sidecar layout changes
+
+def sidecar_paths(filename):
+    directory, name = os.path.split(os.path.abspath(filename))
+    base = os.path.join(directory, SIDECAR_DIRECTORY, name)
+    return f'{base}.npy', f'{base}.json'
+
+# Header key=value pairs, column labels and the numeric body of a storage file
+def parse_storage(filename):
+    header = {}
+    with open(filename) as file:
+        for line in file:
+            line = line.strip()
+            if line == 'endheader':
+                break
+            if '=' in line:
+                key, value = line.split('=', 1)
+                header[key] = value
+        else:
+            raise ValueError(f"{filename}: no endheader line")
+        labels = next(file, '').strip().split('\t')
+        body = file.read()
+
+    if header.get('DataType') == 'Quaternion':
+        body = body.replace(',', '\t')
+        columns = 1 + 4 * (len(labels) - 1)
+    else:
+        columns = len(labels)
+
+    values = np.array(body.split(), dtype=np.float64)
+    if values.size % columns:
+        raise ValueError(f"{filename}: {values.size} values do not fill rows of {columns} columns")
+    return header, labels[1:], values.reshape(-1, columns)
+
+def _source_stamp(filename):
+    stat = os.stat(filename)
+    return {'version': SIDECAR_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+def _read_sidecar(filename, stamp):
+    data_path, meta_path = sidecar_paths(filename)
+    try:
+        with open(meta_path) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get('stamp') != stamp or not os.path.exists(data_path):
+        return None
+    # An empty array has nothing to map
+    data = np.load(data_path, mmap_mode='r' if meta['rows'] else None)
+    return meta['header'], meta['labels'], data
+
+def _write_sidecar(filename, stamp, header, labels, data):
+    data_path, meta_path = sidecar_paths(filename)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    # Write to temporary names first so a concurrent load never maps a half written sidecar,
+    # and the .json last so it only ever describes a complete .npy
+    partial = f'{data_path}.{os.getpid()}.tmp'
+    with open(partial, 'wb') as file:
+        np.save(file, data)
+    os.replace(partial, data_path)
+    partial = f'{meta_path}.{os.getpid()}.tmp'
+    with open(partial, 'w') as file:
+        json.dump({'stamp': stamp, 'header': header, 'labels': labels, 'rows': len(data)}, file)
+    os.replace(partial, meta_path)
+
+# (header, labels, (T, 1 + columns) block with time first), through the sidecar when cache is set
+def load_storage(filename, cache=True):
+    if not cache:
+        return parse_storage(filename)
+    stamp = _source_stamp(filename)
+    cached = _read_sidecar(filename, stamp)
+    if cached is not None:
+        return cached
+    header, labels, data = parse_storage(filename)
+    try:
+        _write_sidecar(filename, stamp, header, labels, data)
+    except OSError as e:
+        print(f"Could not write sidecar for {filename}: {e}")
+    return header, labels, data
+
+# Orientation .sto (DataType=Quaternion): labels, times (T,), quats (T, IMUs, 4)
+def load_orientations(filename, cache=True):
+    header, labels, data = load_storage(filename, cache)
+    if header.get('DataType') != 'Quaternion':
+        raise ValueError(f"{filename}: not a quaternion orientation file")
+    return labels, data[:, 0], data[:, 1:].reshape(len(data), len(labels), 4)
+
+# .mot / double .sto (IK output, orientation errors): labels, times (T,), values (T, columns)
+def load_motion(filename, cache=True):
+    header, labels, data = load_storage(filename, cache)
+    if header.get('DataType') == 'Quaternion':
+        raise ValueError(f"{filename}: quaternion file, use load_orientations")
+    return labels, data[:, 0], data[:, 1:]
+
+def main():
+    parser = argparse.ArgumentParser(description='Build (or check) the sidecar caches of .sto and .mot files')
+    parser.add_argument('files', nargs='*', help='storage files (default: data/*.sto and IK_results/*)')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(FILEPATH, 'data', '*.sto'))
+                                 + glob.glob(os.path.join(FILEPATH, 'IK_results', '*.mot'))
+                                 + glob.glob(os.path.join(FILEPATH, 'IK_results', '*.sto')))
+    start = time.perf_counter()
+    rows = 0
+    for filename in files:
+        try:
+            _, _, data = load_storage(filename)
+        except ValueError as e:
+            print(f"Skipping {e}")
+            continue
+        rows += len(data)
+    print(f"{len(files)} files, {rows} rows in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from resample import deduplicate, resample_session
+
+IDENTITY = np.array([[[1.0, 0.0, 0.0, 0.0]]])
+
+def test_two_frames_at_the_same_time_raise():
+    quats = np.repeat(IDENTITY, 2, axis=0)
+    assert list(deduplicate(np.array([1.0, 1.0]), quats)) == [0]
+    with pytest.raises(ValueError, match='no time span'):
+        resample_session([1.0, 1.0], quats)
+
+def test_two_increasing_frames_resample():
+    quats = np.repeat(IDENTITY, 2, axis=0)
+    grid, resampled = resample_session([0.0, 0.1], quats, rate=20)
+    assert np.allclose(grid, [0.0, 0.05, 0.1])
+    assert np.allclose(resampled, IDENTITY)